@@ -23,9 +23,9 @@ from nova import availability_zones
 from nova import context
 from nova import db
 from nova import exception
+from nova import memorycache
 from nova.network import model as network_model
 from nova.openstack.common import log as logging
-from nova.openstack.common import memorycache
 from nova.openstack.common import timeutils
 from nova.openstack.common import uuidutils
 
@@ -28,8 +28,8 @@ import webob.exc
 from nova.api.metadata import base
 from nova import conductor
 from nova import exception
+from nova import memorycache
 from nova.openstack.common import log as logging
-from nova.openstack.common import memorycache
 from nova import wsgi
 
 CACHE_EXPIRATION = 15  # in seconds
@@ -28,6 +28,9 @@ from nova import context
 from nova import exception
 from nova import manager
 from nova.openstack.common import importutils
+from nova.openstack.common import jsonutils
+from nova.openstack.common import log as logging
+from nova.openstack.common import loopingcall
 from nova.openstack.common import periodic_task
 from nova.openstack.common import timeutils
 
@@ -41,13 +44,34 @@ cell_manager_opts = [
                         "or deleted to continue to update cells"),
         cfg.IntOpt("instance_update_num_instances",
                 default=1,
-                help="Number of instances to update per periodic task run")
+                help="Number of instances to update per periodic task run"),
+        cfg.FloatOpt("instance_update_coalesce_window",
+                default=0.0,
+                help="Number of seconds to buffer instance updates for "
+                        "before sending them to parent cells as one "
+                        "batch with only the fields that changed.  "
+                        "Parent cells must support batched updates.  "
+                        "0 sends every update immediately"),
+        cfg.IntOpt("instance_digest_interval",
+                default=0,
+                help="Number of seconds between comparing digests of the "
+                        "instances in child cells with the top level "
+                        "cell's copies of them, to sync the instances that "
+                        "differ.  0 disables the comparison, and child "
+                        "cells keep sending their recently updated "
+                        "instances up again instead")
 ]
 
 
 CONF = cfg.CONF
 CONF.register_opts(cell_manager_opts, group='cells')
 
+LOG = logging.getLogger(__name__)
+
+# Instance updates younger than this many seconds may still be on their way
+# to the top level cell, so they're left out of instance digests
+_DIGEST_SETTLE_TIME = 60
+
 
 class CellsManager(manager.Manager):
     """The nova-cells manager class.  This class defines RPC
@@ -78,7 +102,12 @@ class CellsManager(manager.Manager):
         cells_driver_cls = importutils.import_class(
                 CONF.cells.driver)
         self.driver = cells_driver_cls()
-        self.instances_to_heal = iter([])
+        # (updated_at, id) of the last instance _heal_instances sent up
+        self.heal_watermark = None
+        # Instance updates waiting to be sent up, and what was last sent
+        # up for each instance, by instance uuid
+        self.pending_instance_updates = {}
+        self.sent_instance_updates = {}
 
     def post_start_hook(self):
         """Have the driver start its consumers for inter-cell communication.
@@ -91,6 +120,11 @@ class CellsManager(manager.Manager):
         # FIXME(comstud): There's currently no hooks when services are
         # stopping, so we have no way to stop consumers cleanly.
         self.driver.start_consumers(self.msg_runner)
+        window = CONF.cells.instance_update_coalesce_window
+        if window > 0:
+            timer = loopingcall.FixedIntervalLoopingCall(
+                    self._flush_instance_updates)
+            timer.start(interval=window)
         ctxt = context.get_admin_context()
         if self.state_manager.get_child_cells():
             self.msg_runner.ask_children_for_capabilities(ctxt)
@@ -106,67 +140,167 @@ class CellsManager(manager.Manager):
         self.msg_runner.tell_parents_our_capabilities(ctxt)
         self.msg_runner.tell_parents_our_capacities(ctxt)
 
+    def _flush_instance_updates(self):
+        """Send the instance updates buffered by instance_update_at_top
+        up to parent cells in one batch.  Only fields that changed since
+        the last update sent up for an instance are included.
+        """
+        pending = self.pending_instance_updates
+        if not pending:
+            return
+        self.pending_instance_updates = {}
+        instances = []
+        for instance_uuid, instance in pending.iteritems():
+            sent = self.sent_instance_updates.setdefault(instance_uuid, {})
+            changes = dict((key, value) for key, value in instance.iteritems()
+                           if key not in sent or sent[key] != value)
+            if not changes:
+                continue
+            sent.update(changes)
+            changes['uuid'] = instance_uuid
+            instances.append(changes)
+        if not instances:
+            return
+        try:
+            self.msg_runner.instance_update_batch_at_top(
+                    context.get_admin_context(), instances)
+        except Exception:
+            LOG.exception(_("Failed to send instance updates to parent "
+                            "cells"))
+            # Send the full instances next time
+            for instance in instances:
+                self.sent_instance_updates.pop(instance['uuid'], None)
+
     @periodic_task.periodic_task
     def _heal_instances(self, ctxt):
         """Periodic task to send updates for a number of instances to
         parent cells.
 
-        On every run of the periodic task, we will attempt to sync
-        'CONF.cells.instance_update_num_instances' number of instances.
-        When we get the list of instances, we shuffle them so that multiple
-        nova-cells services aren't attempting to sync the same instances
-        in lockstep.
-
-        If CONF.cells.instance_update_at_threshold is set, only attempt
-        to sync instances that have been updated recently.  The CONF
-        setting defines the maximum number of seconds old the updated_at
-        can be.  Ie, a threshold of 3600 means to only update instances
-        that have modified in the last hour.
+        Instances are sent in the order they were last updated in,
+        starting after the watermark: the (updated_at, id) of the last
+        instance sent.  On every run of the periodic task, we will sync
+        up to 'CONF.cells.instance_update_num_instances' instances, so
+        every change is sent up once.  Parent cells find instances that
+        differ for other reasons, such as a lost update, by comparing
+        digests of them with us.  When CONF.cells.instance_digest_interval
+        is 0 they don't, so once we caught up with the watermark we start
+        over and send all the instances again to heal them.
+
+        If CONF.cells.instance_update_at_threshold is set, the watermark
+        starts at that many seconds ago.  Ie, a threshold of 3600 means
+        to start with instances that were modified in the last hour.
         """
 
         if not self.state_manager.get_parent_cells():
             # No need to sync up if we have no parents.
             return
 
-        info = {'updated_list': False}
-
-        def _next_instance():
-            try:
-                instance = self.instances_to_heal.next()
-            except StopIteration:
-                if info['updated_list']:
-                    return
-                threshold = CONF.cells.instance_updated_at_threshold
-                updated_since = None
-                if threshold > 0:
-                    updated_since = timeutils.utcnow() - datetime.timedelta(
-                            seconds=threshold)
-                self.instances_to_heal = cells_utils.get_instances_to_sync(
-                        ctxt, updated_since=updated_since, shuffle=True,
-                        uuids_only=True)
-                info['updated_list'] = True
-                try:
-                    instance = self.instances_to_heal.next()
-                except StopIteration:
-                    return
-            return instance
+        if self.heal_watermark is None:
+            threshold = CONF.cells.instance_updated_at_threshold
+            updated_since = datetime.datetime.min
+            if threshold > 0:
+                updated_since = timeutils.utcnow() - datetime.timedelta(
+                        seconds=threshold)
+            self.heal_watermark = (updated_since, 0)
 
         rd_context = ctxt.elevated(read_deleted='yes')
+        instances = self.db.instance_get_all_after_watermark(rd_context,
+                self.heal_watermark,
+                CONF.cells.instance_update_num_instances)
+        for instance in instances:
+            # Yield to other greenthreads
+            time.sleep(0)
+            self._sync_instance(ctxt, instance)
+            self.heal_watermark = (instance['updated_at'], instance['id'])
+        if not instances and CONF.cells.instance_digest_interval == 0:
+            self.heal_watermark = None
+
+    @periodic_task.periodic_task(spacing=CONF.cells.instance_digest_interval)
+    def _verify_child_instances(self, ctxt):
+        """Periodic task run in the top level cell to find the instances
+        whose copies here differ from the child cell they are in, and
+        have the child cell sync them.
+
+        The instances are grouped in buckets by uuid.  The digest of every
+        bucket in a child cell is compared with the digest of our copies,
+        and only the entries of the buckets that differ are fetched to
+        find the instances to sync.  Instances updated in the last
+        _DIGEST_SETTLE_TIME seconds are left out, as their updates may
+        still be on their way here.  Only the instances of the child cells
+        themselves are compared, as they don't store the instances of
+        their own child cells.
+
+        Our copies of the instances a child cell doesn't have anymore are
+        destroyed.
+        """
+        if CONF.cells.instance_digest_interval == 0:
+            return
+        if self.state_manager.get_parent_cells():
+            # Only the top level cell has copies of all instances.
+            return
 
-        for i in xrange(CONF.cells.instance_update_num_instances):
-            while True:
-                # Yield to other greenthreads
-                time.sleep(0)
-                instance_uuid = _next_instance()
-                if not instance_uuid:
-                    return
+        updated_before = timeutils.isotime(timeutils.utcnow() -
+                datetime.timedelta(seconds=_DIGEST_SETTLE_TIME))
+        our_instances = self.db.instance_get_all_by_filters_light(ctxt,
+                {'deleted': False}, ['uuid', 'updated_at', 'cell_name'])
+
+        for cell in self.state_manager.get_child_cells():
+            cell_path = (CONF.cells.name + cells_utils._PATH_CELL_SEP +
+                         cell.name)
+            cell_instances = [instance for instance in our_instances
+                              if instance['cell_name'] == cell_path]
+            our_entries = cells_utils.get_instances_digest_entries(
+                    cell_instances, timeutils.normalize_time(
+                            timeutils.parse_isotime(updated_before)))
+            our_digest = cells_utils.get_instances_digest(our_entries)
+            try:
+                response = self.msg_runner.get_instances_digest(ctxt, cell,
+                        updated_before)
+                their_digest = response.value_or_raise()
+                buckets = [bucket for bucket
+                           in set(our_digest) | set(their_digest)
+                           if our_digest.get(bucket) !=
+                              their_digest.get(bucket)]
+                if not buckets:
+                    continue
+                response = self.msg_runner.get_instances_digest_entries(
+                        ctxt, cell, updated_before, buckets)
+                their_entries = response.value_or_raise()
+            except Exception:
+                LOG.exception(_("Failed to compare instances with cell "
+                                "%s"), cell.name)
+                continue
+
+            instance_uuids = set()
+            for bucket in buckets:
+                entries = set(our_entries.get(bucket, []))
+                entries ^= set(tuple(entry)
+                               for entry in their_entries.get(bucket, []))
+                instance_uuids.update(entry[0] for entry in entries)
+            LOG.info(_("%(count)d instances differ from cell %(cell)s, "
+                       "asking it to sync them"),
+                     {'count': len(instance_uuids), 'cell': cell.name})
+            try:
+                response = self.msg_runner.sync_instances_by_uuid(ctxt,
+                        cell, sorted(instance_uuids))
+                missing_uuids = response.value_or_raise()
+            except Exception:
+                LOG.exception(_("Failed to sync instances with cell %s"),
+                              cell.name)
+                continue
+
+            # Only destroy our copies of the instances in this cell itself
+            cell_uuids = set(instance['uuid'] for instance in cell_instances)
+            for instance_uuid in missing_uuids:
+                if instance_uuid not in cell_uuids:
+                    continue
+                LOG.info(_("Instance is gone from cell %s, destroying it"),
+                         cell.name, instance_uuid=instance_uuid)
                 try:
-                    instance = self.db.instance_get_by_uuid(rd_context,
-                            instance_uuid)
+                    self.db.instance_destroy(ctxt, instance_uuid,
+                                             update_cells=False)
                 except exception.InstanceNotFound:
-                    continue
-                self._sync_instance(ctxt, instance)
-                break
+                    pass
 
     def _sync_instance(self, ctxt, instance):
         """Broadcast an instance_update or instance_destroy message up to
@@ -175,6 +309,9 @@ class CellsManager(manager.Manager):
         if instance['deleted']:
             self.instance_destroy_at_top(ctxt, instance)
         else:
+            # Heal with the full instance, in case parent cells missed
+            # an update we sent
+            self.sent_instance_updates.pop(instance['uuid'], None)
             self.instance_update_at_top(ctxt, instance)
 
     def schedule_run_instance(self, ctxt, host_sched_kwargs):
@@ -208,11 +345,23 @@ class CellsManager(manager.Manager):
             return response.value_or_raise()
 
     def instance_update_at_top(self, ctxt, instance):
-        """Update an instance at the top level cell."""
-        self.msg_runner.instance_update_at_top(ctxt, instance)
+        """Update an instance at the top level cell.  The update is
+        buffered if CONF.cells.instance_update_coalesce_window is set,
+        merging it with other updates to the same instance.
+        """
+        if CONF.cells.instance_update_coalesce_window <= 0:
+            self.msg_runner.instance_update_at_top(ctxt, instance)
+            return
+        instance = jsonutils.to_primitive(instance)
+        pending = self.pending_instance_updates.setdefault(instance['uuid'],
+                                                           {})
+        pending.update(instance)
 
     def instance_destroy_at_top(self, ctxt, instance):
         """Destroy an instance at the top level cell."""
+        if CONF.cells.instance_update_coalesce_window > 0:
+            self.pending_instance_updates.pop(instance['uuid'], None)
+            self.sent_instance_updates.pop(instance['uuid'], None)
         self.msg_runner.instance_destroy_at_top(ctxt, instance)
 
     def instance_delete_everywhere(self, ctxt, instance, delete_type):
@@ -238,12 +387,23 @@ class CellsManager(manager.Manager):
         self.msg_runner.sync_instances(ctxt, project_id, updated_since,
                                        deleted)
 
+    def _responses_in_time(self, responses):
+        """Leave out the responses of cells that timed out, so listings
+        across cells show the cells that did respond.
+        """
+        for response in responses:
+            if response.timed_out():
+                LOG.warn(_("Cell %s timed out, leaving it out of the "
+                           "results"), response.cell_name)
+                continue
+            yield response
+
     def service_get_all(self, ctxt, filters):
         """Return services in this cell and in all child cells."""
         responses = self.msg_runner.service_get_all(ctxt, filters)
         ret_services = []
         # 1 response per cell.  Each response is a list of services.
-        for response in responses:
+        for response in self._responses_in_time(responses):
             services = response.value_or_raise()
             for service in services:
                 cells_utils.add_cell_to_service(service, response.cell_name)
@@ -313,7 +473,7 @@ class CellsManager(manager.Manager):
         # 1 response per cell.  Each response is a list of task log
         # entries.
         ret_task_logs = []
-        for response in responses:
+        for response in self._responses_in_time(responses):
             task_logs = response.value_or_raise()
             for task_log in task_logs:
                 cells_utils.add_cell_to_task_log(task_log,
@@ -338,7 +498,7 @@ class CellsManager(manager.Manager):
         # 1 response per cell.  Each response is a list of compute_node
         # entries.
         ret_nodes = []
-        for response in responses:
+        for response in self._responses_in_time(responses):
             nodes = response.value_or_raise()
             for node in nodes:
                 cells_utils.add_cell_to_compute_node(node,
@@ -350,7 +510,7 @@ class CellsManager(manager.Manager):
         """Return compute node stats totals from all cells."""
         responses = self.msg_runner.compute_node_stats(ctxt)
         totals = {}
-        for response in responses:
+        for response in self._responses_in_time(responses):
             data = response.value_or_raise()
             for key, val in data.iteritems():
                 totals.setdefault(key, 0)
@@ -23,6 +23,7 @@ reached.
 The interface into this module is the MessageRunner class.
 """
 import sys
+import time
 
 from eventlet import queue
 from oslo.config import cfg
@@ -53,7 +54,14 @@ cell_messaging_opts = [
             help='Maximum number of hops for cells routing.'),
     cfg.StrOpt('scheduler',
             default='nova.cells.scheduler.CellsScheduler',
-            help='Cells scheduler to use')]
+            help='Cells scheduler to use'),
+    cfg.FloatOpt('broadcast_hop_timeout_ratio',
+            default=0.8,
+            help='Fraction of the time a cell waits for responses to a '
+                 'broadcast that the cells it forwards the broadcast to '
+                 'wait for.  Cells that have not responded in time are '
+                 'reported as timed out along with the responses of the '
+                 'cells that have')]
 
 CONF = cfg.CONF
 CONF.import_opt('name', 'nova.cells.opts', group='cells')
@@ -447,13 +455,18 @@ class _BroadcastMessage(_BaseMessage):
     message_type = 'broadcast'
 
     def __init__(self, msg_runner, ctxt, method_name, method_kwargs,
-            direction, run_locally=True, **kwargs):
+            direction, run_locally=True, timeout=None, **kwargs):
         super(_BroadcastMessage, self).__init__(msg_runner, ctxt,
                 method_name, method_kwargs, direction, **kwargs)
         # The local cell creating this message has the option
         # to be able to process the message locally or not.
         self.run_locally = run_locally
         self.is_broadcast = True
+        # Seconds this hop waits for responses from its neighbors
+        if timeout is None:
+            timeout = CONF.cells.call_timeout
+        self.timeout = timeout
+        self.base_attrs_to_json.append('timeout')
 
     def _get_next_hops(self):
         """Set the next hops and return the number of hops.  The next
@@ -471,6 +484,49 @@ class _BroadcastMessage(_BaseMessage):
         for cell in target_cells:
             cell.send_message(self)
 
+    def _wait_for_neighbor_responses(self, next_hops, timeout):
+        """Wait up to 'timeout' seconds in total for the responses of
+        next_hops and return them.  Neighbors that haven't responded by
+        then get a CellTimeout failure response in the list instead.
+
+        Destroy the eventlet queue when done.
+        """
+        responses = []
+        deadline = time.time() + timeout
+        try:
+            for x in xrange(len(next_hops)):
+                wait_time = max(0, deadline - time.time())
+                json_responses = self.resp_queue.get(timeout=wait_time)
+                responses.extend(json_responses)
+        except queue.Empty:
+            responses.extend(self._timed_out_responses(next_hops, responses))
+        finally:
+            self._cleanup_response_queue()
+        return responses
+
+    def _timed_out_responses(self, next_hops, json_responses):
+        """Return a CellTimeout failure response for each of next_hops
+        that none of json_responses came from.
+        """
+        cell_names = set(Response.from_json(json_response).cell_name
+                         for json_response in json_responses)
+        try:
+            raise exception.CellTimeout()
+        except exception.CellTimeout:
+            exc_info = sys.exc_info()
+        responses = []
+        for cell in next_hops:
+            cell_name = self.routing_path + _PATH_CELL_SEP + cell.name
+            prefix = cell_name + _PATH_CELL_SEP
+            if any(name == cell_name or name.startswith(prefix)
+                   for name in cell_names):
+                continue
+            LOG.warn(_("Timed out waiting for responses from cell "
+                       "%(cell_name)s to %(message)s"),
+                     {'cell_name': cell_name, 'message': self})
+            responses.append(Response(cell_name, exc_info, True).to_json())
+        return responses
+
     def _send_json_responses(self, json_responses):
         """Responses to broadcast messages always need to go to the
         neighbor cell from which we received this message.  That
@@ -497,6 +553,12 @@ class _BroadcastMessage(_BaseMessage):
         When the source is reached, a list of Response instances are
         returned to the caller.
 
+        Each hop waits for responses for 'timeout' seconds at most, and
+        forwards the message with a shorter timeout so that neighbors
+        give up on their own neighbors first.  Neighbors that don't
+        respond in time get a CellTimeout failure response, and the
+        responses of the others are still returned.
+
         All exceptions for processing the message across the whole
         routing path are caught and encoded within the Response and
         returned to the caller.  It is possible to get a mix of
@@ -520,6 +582,8 @@ class _BroadcastMessage(_BaseMessage):
 
         # We'll need to aggregate all of the responses (from ourself
         # and our sibling cells) into 1 response
+        wait_time = self.timeout
+        self.timeout = wait_time * CONF.cells.broadcast_hop_timeout_ratio
         try:
             self._setup_response_queue()
             self._send_to_cells(next_hops)
@@ -539,8 +603,8 @@ class _BroadcastMessage(_BaseMessage):
             local_response = None
 
         try:
-            remote_responses = self._wait_for_json_responses(
-                    num_responses=len(next_hops))
+            remote_responses = self._wait_for_neighbor_responses(next_hops,
+                                                                 wait_time)
         except Exception as exc:
             # Error waiting for responses, most likely a timeout.
             # Send a single response back with the failure.
@@ -628,6 +692,12 @@ class _BaseMessageMethods(base.Base):
                                              state=state)
         return jsonutils.to_primitive(task_logs)
 
+    def _sync_instance(self, ctxt, instance):
+        if instance['deleted']:
+            self.msg_runner.instance_destroy_at_top(ctxt, instance)
+        else:
+            self.msg_runner.instance_update_at_top(ctxt, instance)
+
 
 class _ResponseMessageMethods(_BaseMessageMethods):
     """Methods that are called from a ResponseMessage.  There's only
@@ -713,6 +783,48 @@ class _TargetedMessageMethods(_BaseMessageMethods):
         """
         self.msg_runner.tell_parents_our_capacities(message.ctxt)
 
+    def _get_instances_digest_entries(self, ctxt, updated_before):
+        updated_before = timeutils.normalize_time(
+                timeutils.parse_isotime(updated_before))
+        instances = self.db.instance_get_all_by_filters_light(ctxt,
+                {'deleted': False}, ['uuid', 'updated_at'])
+        return cells_utils.get_instances_digest_entries(instances,
+                                                        updated_before)
+
+    def get_instances_digest(self, message, updated_before):
+        """Return the digest of every uuid bucket of our instances that
+        were updated before updated_before.
+        """
+        buckets = self._get_instances_digest_entries(message.ctxt,
+                                                     updated_before)
+        return cells_utils.get_instances_digest(buckets)
+
+    def get_instances_digest_entries(self, message, updated_before,
+                                     buckets):
+        """Return the digest entries of our instances in the given uuid
+        buckets that were updated before updated_before.
+        """
+        entries = self._get_instances_digest_entries(message.ctxt,
+                                                     updated_before)
+        return dict((bucket, entries.get(bucket, [])) for bucket in buckets)
+
+    def sync_instances_by_uuid(self, message, instance_uuids):
+        """Send the current state of some instances up to the top level
+        cell.  Returns the uuids of the instances we don't have, as only
+        the top level cell knows if they were ours.
+        """
+        rd_context = message.ctxt.elevated(read_deleted='yes')
+        missing_uuids = []
+        for instance_uuid in instance_uuids:
+            try:
+                instance = self.db.instance_get_by_uuid(rd_context,
+                                                        instance_uuid)
+            except exception.InstanceNotFound:
+                missing_uuids.append(instance_uuid)
+                continue
+            self._sync_instance(message.ctxt, instance)
+        return missing_uuids
+
     def service_get_by_compute_host(self, message, host_name):
         """Return the service entry for a compute host."""
         service = self.db.service_get_by_compute_host(message.ctxt,
@@ -790,10 +902,11 @@ class _BroadcastMessageMethods(_BaseMessageMethods):
         """Are we the API level?"""
         return not self.state_manager.get_parent_cells()
 
-    def instance_update_at_top(self, message, instance, **kwargs):
-        """Update an instance in the DB if we're a top level cell."""
-        if not self._at_the_top():
-            return
+    def _instance_update_values(self, message, instance):
+        """Turn an instance update received from a child cell into the
+        values to update the instance with in our DB.  Returns the
+        instance values and its info_cache values, if any.
+        """
         instance_uuid = instance['uuid']
 
         # Remove things that we can't update in the top level cells.
@@ -837,7 +950,10 @@ class _BroadcastMessageMethods(_BaseMessageMethods):
                 instance.get('vm_state'))
         if expected_vm_states:
                 instance['expected_vm_state'] = expected_vm_states
+        return instance, info_cache
 
+    def _instance_update(self, message, instance, info_cache):
+        instance_uuid = instance['uuid']
         # It's possible due to some weird condition that the instance
         # was already set as deleted... so we'll attempt to update
         # it with permissions that allows us to read deleted.
@@ -858,6 +974,46 @@ class _BroadcastMessageMethods(_BaseMessageMethods):
                 # network information.
                 pass
 
+    def instance_update_at_top(self, message, instance, **kwargs):
+        """Update an instance in the DB if we're a top level cell."""
+        if not self._at_the_top():
+            return
+        instance, info_cache = self._instance_update_values(message,
+                                                            instance)
+        self._instance_update(message, instance, info_cache)
+
+    def instance_update_batch_at_top(self, message, instances, **kwargs):
+        """Update a batch of instances in the DB in one transaction if
+        we're a top level cell.  Instances only need to contain the
+        fields that changed, plus their 'uuid', so the cell is asked to
+        sync the instances we don't know about rather than creating them
+        from the changes.
+        """
+        if not self._at_the_top():
+            return
+        updates = []
+        for instance in instances:
+            instance, info_cache = self._instance_update_values(message,
+                                                                instance)
+            if info_cache:
+                instance['info_cache'] = info_cache
+            updates.append(instance)
+        with utils.temporary_mutation(message.ctxt, read_deleted="yes"):
+            not_found = self.db.instance_update_batch(message.ctxt, updates)
+        if not not_found:
+            return
+        cell_name = _reverse_path(message.routing_path)
+        instance_uuids = [update['uuid'] for update in not_found]
+        LOG.info(_("Got updates for %(count)d unknown instances, asking "
+                   "cell %(cell_name)s to sync them"),
+                 {'count': len(instance_uuids), 'cell_name': cell_name})
+        try:
+            self.msg_runner.sync_instances_by_uuid(message.ctxt, cell_name,
+                                                   instance_uuids)
+        except Exception:
+            LOG.exception(_("Failed to ask cell %s to sync instances"),
+                          cell_name)
+
     def instance_destroy_at_top(self, message, instance, **kwargs):
         """Destroy an instance from the DB if we're a top level cell."""
         if not self._at_the_top():
@@ -903,12 +1059,6 @@ class _BroadcastMessageMethods(_BaseMessageMethods):
             return
         self.db.bw_usage_update(message.ctxt, **bw_update_info)
 
-    def _sync_instance(self, ctxt, instance):
-        if instance['deleted']:
-            self.msg_runner.instance_destroy_at_top(ctxt, instance)
-        else:
-            self.msg_runner.instance_update_at_top(ctxt, instance)
-
     def sync_instances(self, message, project_id, updated_since, deleted,
                        **kwargs):
         projid_str = project_id is None and "<all>" or project_id
@@ -1159,6 +1309,14 @@ class MessageRunner(object):
                                     run_locally=False)
         message.process()
 
+    def instance_update_batch_at_top(self, ctxt, instances):
+        """Update a batch of instances at the top level cell."""
+        message = _BroadcastMessage(self, ctxt,
+                                    'instance_update_batch_at_top',
+                                    dict(instances=instances), 'up',
+                                    run_locally=False)
+        message.process()
+
     def instance_destroy_at_top(self, ctxt, instance):
         """Destroy an instance at the top level cell."""
         message = _BroadcastMessage(self, ctxt, 'instance_destroy_at_top',
@@ -1205,6 +1363,38 @@ class MessageRunner(object):
                                     run_locally=False)
         message.process()
 
+    def get_instances_digest(self, ctxt, cell_name, updated_before):
+        """Get the digest of every uuid bucket of the instances in a cell
+        that were updated before updated_before.
+        """
+        method_kwargs = dict(updated_before=updated_before)
+        message = _TargetedMessage(self, ctxt, 'get_instances_digest',
+                                   method_kwargs, 'down', cell_name,
+                                   need_response=True)
+        return message.process()
+
+    def get_instances_digest_entries(self, ctxt, cell_name, updated_before,
+                                     buckets):
+        """Get the digest entries of the instances in some uuid buckets
+        of a cell that were updated before updated_before.
+        """
+        method_kwargs = dict(updated_before=updated_before, buckets=buckets)
+        message = _TargetedMessage(self, ctxt,
+                                   'get_instances_digest_entries',
+                                   method_kwargs, 'down', cell_name,
+                                   need_response=True)
+        return message.process()
+
+    def sync_instances_by_uuid(self, ctxt, cell_name, instance_uuids):
+        """Ask a cell to sync some instances up to the top level cell.
+        The response is the uuids of the instances the cell doesn't have.
+        """
+        method_kwargs = dict(instance_uuids=instance_uuids)
+        message = _TargetedMessage(self, ctxt, 'sync_instances_by_uuid',
+                                   method_kwargs, 'down', cell_name,
+                                   need_response=True)
+        return message.process()
+
     def service_get_all(self, ctxt, filters=None):
         method_kwargs = dict(filters=filters)
         message = _BroadcastMessage(self, ctxt, 'service_get_all',
@@ -1377,6 +1567,11 @@ class Response(object):
             _dict['value'] = resp_value
         return cls(**_dict)
 
+    def timed_out(self):
+        """Did the cell time out responding?"""
+        return self.failure and isinstance(self.value,
+                                           exception.CellTimeout)
+
     def value_or_raise(self):
         if self.failure:
             if isinstance(self.value, (tuple, list)):
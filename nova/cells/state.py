@@ -26,10 +26,13 @@ from nova.cells import rpc_driver
 from nova import context
 from nova.db import base
 from nova import exception
+from nova.openstack.common import importutils
 from nova.openstack.common import log as logging
 from nova.openstack.common import timeutils
 from nova import utils
 
+numpy = importutils.try_import('numpy')
+
 cell_state_manager_opts = [
         cfg.IntOpt('db_check_interval',
                 default=60,
@@ -46,6 +49,31 @@ CONF.import_opt('reserve_percent', 'nova.cells.opts', group='cells')
 CONF.register_opts(cell_state_manager_opts, group='cells')
 
 
+def _free_units(totals, frees, sizes, reserve_level):
+    """Return, for each host, the number of units of every size that fit
+    in its free resource once reserve_level of its total is held in
+    reserve.  Units of size 0 are never counted.
+    """
+    if not totals or not sizes:
+        return [[0] * len(sizes) for total in totals]
+    if numpy is not None:
+        free = numpy.maximum(0, numpy.array(frees, dtype=float) -
+                             numpy.array(totals, dtype=float) * reserve_level)
+        per_inst = numpy.array(sizes, dtype=float)
+        units = numpy.zeros((len(totals), len(sizes)), dtype=int)
+        nonzero = per_inst != 0
+        units[:, nonzero] = numpy.floor(free[:, numpy.newaxis] /
+                                        per_inst[nonzero])
+        return units.tolist()
+
+    units = []
+    for total, free in zip(totals, frees):
+        free = max(0, free - total * reserve_level)
+        units.append([int(free / size) if size else 0
+                      for size in sizes])
+    return units
+
+
 class CellState(object):
     """Holds information for a particular cell."""
     def __init__(self, cell_name, is_me=False):
@@ -119,6 +147,13 @@ class CellStateManager(base.Base):
         self.parent_cells = {}
         self.child_cells = {}
         self.last_cell_db_check = datetime.datetime.min
+        # Units of every size free on each compute host, and their sums,
+        # kept between capacity updates so only changed hosts are
+        # recounted
+        self._units_key = None
+        self._host_units = {}
+        self._ram_units = []
+        self._disk_units = []
         self._cell_db_sync()
         my_cell_capabs = {}
         for cap in CONF.cells.capabilities:
@@ -196,62 +231,86 @@ class CellStateManager(base.Base):
 
         NOTE(comstud): Perhaps we should only report a single number
         available per instance_type.
+
+        The units free on every host are kept between runs, so only hosts
+        whose resources changed since the last run are recounted.
         """
 
         reserve_level = CONF.cells.reserve_percent / 100.0
         compute_hosts = {}
+        total_ram_mb_free = 0
+        total_disk_mb_free = 0
+
+        for compute in self.db.compute_node_get_all(context):
+            service = compute['service']
+            if not service or service['disabled']:
+                continue
+            compute_hosts[service['host']] = (
+                    compute['memory_mb'], compute['free_ram_mb'],
+                    compute['local_gb'] * 1024,
+                    compute['free_disk_gb'] * 1024)
+            total_ram_mb_free += compute['free_ram_mb']
+            total_disk_mb_free += compute['free_disk_gb'] * 1024
 
-        def _get_compute_hosts():
-            compute_nodes = self.db.compute_node_get_all(context)
-            for compute in compute_nodes:
-                service = compute['service']
-                if not service or service['disabled']:
-                    continue
-                host = service['host']
-                compute_hosts[host] = {
-                        'free_ram_mb': compute['free_ram_mb'],
-                        'free_disk_mb': compute['free_disk_gb'] * 1024,
-                        'total_ram_mb': compute['memory_mb'],
-                        'total_disk_mb': compute['local_gb'] * 1024}
-
-        _get_compute_hosts()
         if not compute_hosts:
+            self._host_units = {}
             self.my_cell_state.update_capacities({})
             return
 
-        ram_mb_free_units = {}
-        disk_mb_free_units = {}
-        total_ram_mb_free = 0
-        total_disk_mb_free = 0
-
-        def _free_units(total, free, per_inst):
-            if per_inst:
-                min_free = total * reserve_level
-                free = max(0, free - min_free)
-                return int(free / per_inst)
-            else:
-                return 0
-
-        def _update_from_values(values, instance_type):
+        # Number of instance types of every unit size
+        ram_mb_types = {}
+        disk_mb_types = {}
+        for instance_type in self.db.instance_type_get_all(context):
             memory_mb = instance_type['memory_mb']
             disk_mb = (instance_type['root_gb'] +
                     instance_type['ephemeral_gb']) * 1024
-            ram_mb_free_units.setdefault(str(memory_mb), 0)
-            disk_mb_free_units.setdefault(str(disk_mb), 0)
-            ram_free_units = _free_units(compute_values['total_ram_mb'],
-                    compute_values['free_ram_mb'], memory_mb)
-            disk_free_units = _free_units(compute_values['total_disk_mb'],
-                    compute_values['free_disk_mb'], disk_mb)
-            ram_mb_free_units[str(memory_mb)] += ram_free_units
-            disk_mb_free_units[str(disk_mb)] += disk_free_units
-
-        instance_types = self.db.instance_type_get_all(context)
-
-        for compute_values in compute_hosts.values():
-            total_ram_mb_free += compute_values['free_ram_mb']
-            total_disk_mb_free += compute_values['free_disk_mb']
-            for instance_type in instance_types:
-                _update_from_values(compute_values, instance_type)
+            ram_mb_types[memory_mb] = ram_mb_types.get(memory_mb, 0) + 1
+            disk_mb_types[disk_mb] = disk_mb_types.get(disk_mb, 0) + 1
+        ram_sizes = sorted(ram_mb_types)
+        disk_sizes = sorted(disk_mb_types)
+
+        units_key = (reserve_level, ram_sizes, disk_sizes)
+        if units_key != self._units_key:
+            # Every host's units need recounting
+            self._units_key = units_key
+            self._host_units = {}
+            self._ram_units = [0] * len(ram_sizes)
+            self._disk_units = [0] * len(disk_sizes)
+
+        def _add_units(units, host_units, sign):
+            for i, host_unit in enumerate(host_units):
+                units[i] += sign * host_unit
+
+        # Only recount the units of hosts whose resources changed
+        changed_hosts = [host for host, values in compute_hosts.iteritems()
+                         if self._host_units.get(host, (None,))[0] != values]
+        gone_hosts = [host for host in self._host_units
+                      if host not in compute_hosts]
+        for host in changed_hosts + gone_hosts:
+            if host in self._host_units:
+                _values, ram_units, disk_units = self._host_units.pop(host)
+                _add_units(self._ram_units, ram_units, -1)
+                _add_units(self._disk_units, disk_units, -1)
+
+        values = [compute_hosts[host] for host in changed_hosts]
+        ram_units = _free_units([v[0] for v in values],
+                                [v[1] for v in values],
+                                ram_sizes, reserve_level)
+        disk_units = _free_units([v[2] for v in values],
+                                 [v[3] for v in values],
+                                 disk_sizes, reserve_level)
+        for i, host in enumerate(changed_hosts):
+            self._host_units[host] = (values[i], ram_units[i], disk_units[i])
+            _add_units(self._ram_units, ram_units[i], 1)
+            _add_units(self._disk_units, disk_units[i], 1)
+
+        # Instance types of the same size each count the units again
+        ram_mb_free_units = dict(
+                (str(size), ram_mb_types[size] * self._ram_units[i])
+                for i, size in enumerate(ram_sizes))
+        disk_mb_free_units = dict(
+                (str(size), disk_mb_types[size] * self._disk_units[i])
+                for i, size in enumerate(disk_sizes))
 
         capacities = {'ram_free': {'total_mb': total_ram_mb_free,
                                    'units_by_mb': ram_mb_free_units},
@@ -16,15 +16,22 @@
 """
 Cells Utility Methods
 """
+import hashlib
 import random
 
 from nova import db
+from nova.openstack.common import timeutils
 
 # Separator used between cell names for the 'full cell name' and routing
 # path
 _PATH_CELL_SEP = '!'
 # Separator used between cell name and item
 _CELL_ITEM_SEP = '@'
+# Number of leading uuid characters that pick an instance's digest bucket
+_DIGEST_BUCKET_CHARS = 2
+# Precision instance update times are compared at in digests.  Parent
+# cells may only store them to the second.
+_DIGEST_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
 
 
 def get_instances_to_sync(context, updated_since=None, project_id=None,
@@ -54,6 +61,37 @@ def get_instances_to_sync(context, updated_since=None, project_id=None,
             yield instance
 
 
+def get_instances_digest_entries(instances, updated_before=None):
+    """Return the (uuid, updated_at) digest entries of instances, grouped
+    by uuid bucket.  If updated_before is set, instances updated since
+    then are left out, as their updates may still be on their way to
+    parent cells.
+    """
+    buckets = {}
+    for instance in instances:
+        updated_at = instance['updated_at']
+        if updated_at is not None:
+            if updated_before is not None and updated_at >= updated_before:
+                continue
+            updated_at = timeutils.strtime(updated_at, _DIGEST_TIME_FORMAT)
+        bucket = instance['uuid'][:_DIGEST_BUCKET_CHARS]
+        buckets.setdefault(bucket, []).append((instance['uuid'], updated_at))
+    return buckets
+
+
+def get_instances_digest(buckets):
+    """Return the digest of every bucket of digest entries.  Two cells
+    agree on the instances in a bucket if its digests match.
+    """
+    digests = {}
+    for bucket, entries in buckets.iteritems():
+        digest = hashlib.sha1()
+        for entry in sorted(entries):
+            digest.update('%s %s\n' % entry)
+        digests[bucket] = digest.hexdigest()
+    return digests
+
+
 def cell_with_item(cell_name, item):
     """Turn cell_name and item into <cell_name>@<item>."""
     if cell_name is None:
@@ -0,0 +1,87 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Compact report of the images cached on a compute host.
+
+Compute hosts with a local image cache report the images in it as a bloom
+filter in the 'cached_images' compute node stat, which the scheduler tests
+requested images against.  Images are identified by the SHA1 hex digest of
+their id, the same fingerprint the libvirt image cache names base files by.
+"""
+
+import base64
+import hashlib
+
+STAT_KEY = 'cached_images'
+
+# Compute node stat values are limited to 255 characters, which the base64
+# encoding of NUM_BITS bits has to fit in
+NUM_BITS = 1024
+NUM_HASHES = 3
+
+
+def fingerprint(image_id):
+    """Return the fingerprint of an image id."""
+    return hashlib.sha1(str(image_id)).hexdigest()
+
+
+class CachedImages(object):
+    """Bloom filter of image fingerprints.
+
+    Membership tests may give false positives, never false negatives.
+    """
+
+    def __init__(self, bits=None):
+        if bits is None:
+            bits = bytearray(NUM_BITS // 8)
+        self.bits = bits
+
+    @staticmethod
+    def _positions(fingerprint):
+        # Fingerprints are SHA1 digests already, so slices of them are as
+        # good as running more hash functions
+        for i in xrange(NUM_HASHES):
+            yield int(fingerprint[i * 8:(i + 1) * 8], 16) % NUM_BITS
+
+    def add(self, fingerprint):
+        for position in self._positions(fingerprint):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, fingerprint):
+        for position in self._positions(fingerprint):
+            if not self.bits[position // 8] & (1 << (position % 8)):
+                return False
+        return True
+
+    def encode(self):
+        """Return the filter as a compute node stat value."""
+        return base64.b64encode(str(self.bits))
+
+    @classmethod
+    def decode(cls, value):
+        """Return the filter a compute node stat value encodes.
+
+        :raises: ValueError if value is not an encoded filter
+        """
+        try:
+            bits = bytearray(base64.b64decode(value))
+        except TypeError:
+            raise ValueError(_('Invalid cached images value'))
+        if len(bits) != NUM_BITS // 8:
+            raise ValueError(_('Invalid cached images value'))
+        return cls(bits)
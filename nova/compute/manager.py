@@ -29,6 +29,7 @@ terminating it.
 
 import base64
 import contextlib
+import datetime
 import functools
 import socket
 import sys
@@ -105,6 +106,18 @@ compute_opts = [
                 default=False,
                 help='Whether to start guests that were running before the '
                      'host rebooted'),
+    cfg.IntOpt('image_prefetch_count',
+               default=5,
+               help='Number of the most booted images to pre-fetch into '
+                    'the local image cache'),
+    cfg.IntOpt('image_prefetch_window',
+               default=86400,
+               help='Only instances booted within this many seconds count '
+                    'towards how popular an image is'),
+    cfg.IntOpt('image_prefetch_max_mb',
+               default=10240,
+               help='Disk space in MB that pre-fetched images may take up '
+                    'in the local image cache'),
     ]
 
 interval_opts = [
@@ -126,6 +139,13 @@ interval_opts = [
                default=2400,
                help='Number of seconds to wait between runs of the image '
                         'cache manager'),
+    cfg.IntOpt('image_prefetch_interval',
+               default=0,
+               help='Number of seconds between pre-fetching the most booted '
+                    'images into the local image cache. Set to 0 to '
+                    'disable. Only works with auth_strategy=noauth, as '
+                    'periodic tasks have no token to fetch images from '
+                    'glance with.'),
     cfg.IntOpt('reclaim_instance_interval',
                default=0,
                help='Interval in seconds for reclaiming deleted instances'),
@@ -183,6 +203,7 @@ CONF.import_opt('my_ip', 'nova.netconf')
 CONF.import_opt('vnc_enabled', 'nova.vnc')
 CONF.import_opt('enabled', 'nova.spice', group='spice')
 CONF.import_opt('enable', 'nova.cells.opts', group='cells')
+CONF.import_opt('auth_strategy', 'nova.api.auth')
 
 LOG = logging.getLogger(__name__)
 
@@ -1120,8 +1141,8 @@ class ComputeManager(manager.SchedulerDependentManager):
 
         filters = {'vm_state': vm_states.BUILDING,
                    'host': self.host}
-        building_insts = self.conductor_api.instance_get_all_by_filters(
-            context, filters, columns_to_join=[])
+        building_insts = self.conductor_api.instance_get_all_by_filters_light(
+            context, filters, ['uuid', 'created_at'])
 
         for instance in building_insts:
             if timeutils.is_older_than(instance['created_at'], timeout):
@@ -3784,26 +3805,28 @@ class ComputeManager(manager.SchedulerDependentManager):
                 return
 
             refreshed = timeutils.utcnow()
+            uuids = list(set(bw_ctr['uuid'] for bw_ctr in bw_counters))
+            usages = self._get_bw_usages_by_mac(context, uuids, start_time)
+            prev_usages = None
+            updates = []
             for bw_ctr in bw_counters:
-                # Allow switching of greenthreads between queries.
-                greenthread.sleep(0)
                 bw_in = 0
                 bw_out = 0
                 last_ctr_in = None
                 last_ctr_out = None
-                usage = self.conductor_api.bw_usage_get(context,
-                                                        bw_ctr['uuid'],
-                                                        start_time,
-                                                        bw_ctr['mac_address'])
+                key = (bw_ctr['uuid'], bw_ctr['mac_address'])
+                usage = usages.get(key)
                 if usage:
                     bw_in = usage['bw_in']
                     bw_out = usage['bw_out']
                     last_ctr_in = usage['last_ctr_in']
                     last_ctr_out = usage['last_ctr_out']
                 else:
-                    usage = self.conductor_api.bw_usage_get(
-                        context, bw_ctr['uuid'], prev_time,
-                        bw_ctr['mac_address'])
+                    if prev_usages is None:
+                        prev_usages = self._get_bw_usages_by_mac(context,
+                                                                 uuids,
+                                                                 prev_time)
+                    usage = prev_usages.get(key)
                     if usage:
                         last_ctr_in = usage['last_ctr_in']
                         last_ctr_out = usage['last_ctr_out']
@@ -3822,15 +3845,27 @@ class ComputeManager(manager.SchedulerDependentManager):
                     else:
                         bw_out += (bw_ctr['bw_out'] - last_ctr_out)
 
-                self.conductor_api.bw_usage_update(context,
-                                                   bw_ctr['uuid'],
-                                                   bw_ctr['mac_address'],
-                                                   start_time,
-                                                   bw_in,
-                                                   bw_out,
-                                                   bw_ctr['bw_in'],
-                                                   bw_ctr['bw_out'],
-                                                   last_refreshed=refreshed)
+                updates.append({'uuid': bw_ctr['uuid'],
+                                'mac': bw_ctr['mac_address'],
+                                'bw_in': bw_in,
+                                'bw_out': bw_out,
+                                'last_ctr_in': bw_ctr['bw_in'],
+                                'last_ctr_out': bw_ctr['bw_out']})
+
+            if updates:
+                self.conductor_api.bw_usage_update_batch(
+                    context, start_time, updates, last_refreshed=refreshed)
+
+    def _get_bw_usages_by_mac(self, context, uuids, start_period):
+        """Return the bandwidth usages of the instances in a given audit
+        period, by (uuid, mac).
+        """
+        if not uuids:
+            return {}
+        usages = self.conductor_api.bw_usage_get_by_uuids(context, uuids,
+                                                          start_period)
+        return dict(((usage['uuid'], usage['mac']), usage)
+                    for usage in usages)
 
     def _get_host_volume_bdms(self, context, host):
         """Return all block device mappings on a compute host."""
@@ -4268,3 +4303,29 @@ class ComputeManager(manager.SchedulerDependentManager):
             context, filters, columns_to_join=[])
 
         self.driver.manage_image_cache(context, filtered_instances)
+
+    @periodic_task.periodic_task(spacing=CONF.image_prefetch_interval)
+    def _prefetch_popular_images(self, context):
+        """Pre-fetch the images booted most across the deployment."""
+
+        if not self.driver.capabilities["has_imagecache"]:
+            return
+        if CONF.image_prefetch_interval == 0:
+            return
+        if CONF.auth_strategy == 'keystone' and not context.auth_token:
+            # NOTE: periodic tasks run with an admin context without a
+            # token, which glance would refuse every image to
+            LOG.warn(_('Not pre-fetching images, periodic tasks have no '
+                       'token to fetch them from glance with when '
+                       'auth_strategy is keystone'))
+            return
+
+        # The database counts the boots, so only the popular image refs
+        # come back instead of a row per instance in the deployment
+        created_since = timeutils.utcnow() - datetime.timedelta(
+            seconds=CONF.image_prefetch_window)
+        popular = self.conductor_api.instance_get_popular_image_refs(
+            context, created_since, CONF.image_prefetch_count)
+        if popular:
+            max_bytes = CONF.image_prefetch_max_mb * 1024 * 1024
+            self.driver.prefetch_images(context, popular, max_bytes)
@@ -21,6 +21,7 @@ model.
 
 from oslo.config import cfg
 
+from nova.compute import cached_images
 from nova.compute import claims
 from nova.compute import flavors
 from nova.compute import task_states
@@ -31,6 +32,7 @@ from nova import exception
 from nova.openstack.common import importutils
 from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
+from nova.scheduler import rpcapi as scheduler_rpcapi
 from nova import utils
 
 resource_tracker_opts = [
@@ -40,7 +42,13 @@ resource_tracker_opts = [
                help='Amount of memory in MB to reserve for the host'),
     cfg.StrOpt('compute_stats_class',
                default='nova.compute.stats.Stats',
-               help='Class that will manage stats for the local compute host')
+               help='Class that will manage stats for the local compute host'),
+    cfg.BoolOpt('push_compute_node_updates',
+                default=False,
+                help='Push compute node resource updates to the schedulers, '
+                     'so that schedulers running with '
+                     'scheduler_host_state_cache see them before their '
+                     'next sync'),
 ]
 
 CONF = cfg.CONF
@@ -60,10 +68,14 @@ class ResourceTracker(object):
         self.driver = driver
         self.nodename = nodename
         self.compute_node = None
+        # Compute node values and stats as of the last DB update, so that
+        # only changes are sent
+        self.reported_values = None
         self.stats = importutils.import_object(CONF.compute_stats_class)
         self.tracked_instances = {}
         self.tracked_migrations = {}
         self.conductor_api = conductor.API()
+        self.scheduler_rpcapi = scheduler_rpcapi.SchedulerAPI()
 
     @utils.synchronized(COMPUTE_RESOURCE_SEMAPHORE)
     def instance_claim(self, context, instance_ref, limits=None):
@@ -274,6 +286,8 @@ class ResourceTracker(object):
         orphans = self._find_orphaned_instances()
         self._update_usage_from_orphans(resources, orphans)
 
+        self._update_cached_images(resources)
+
         self._report_final_resource_view(resources)
 
         self._sync_compute_node(context, resources)
@@ -292,6 +306,7 @@ class ResourceTracker(object):
                 for cn in compute_node_refs:
                     if cn.get('hypervisor_hostname') == self.nodename:
                         self.compute_node = cn
+                        self.reported_values = None
                         break
 
         if not self.compute_node:
@@ -312,6 +327,7 @@ class ResourceTracker(object):
         # initialize load stats from existing instances:
         self.compute_node = self.conductor_api.compute_node_create(context,
                                                                    values)
+        self._set_reported_values(self.compute_node)
 
     def _get_service(self, context):
         try:
@@ -353,12 +369,67 @@ class ResourceTracker(object):
         else:
             LOG.audit(_("Free VCPU information unavailable"))
 
+    @staticmethod
+    def _stats_dict(stats):
+        """Return stats, either a dict or a list of ComputeNodeStats, as a
+        dict of the string values by key, as they are stored in the DB.
+        """
+        if isinstance(stats, dict):
+            items = stats.iteritems()
+        else:
+            items = ((stat['key'], stat['value']) for stat in stats)
+        return dict((key, unicode(value)) for (key, value) in items)
+
+    def _set_reported_values(self, compute_node):
+        reported_values = dict(compute_node)
+        reported_values['stats'] = self._stats_dict(
+                compute_node.get('stats') or [])
+        self.reported_values = reported_values
+
+    def _get_changed_values(self, values, prune_stats):
+        """Return the values and stats which changed since the last update
+        and whether stats need to be pruned.
+        """
+        if self.reported_values is None:
+            return values, prune_stats
+
+        reported_values = self.reported_values
+        changed = {}
+        for key, value in values.iteritems():
+            if key == 'stats':
+                continue
+            if key not in reported_values or reported_values[key] != value:
+                changed[key] = value
+
+        if 'stats' in values or prune_stats:
+            stats = self._stats_dict(values.get('stats') or {})
+            reported_stats = reported_values['stats']
+            if prune_stats and set(reported_stats) - set(stats):
+                # Send all of the stats so the removed ones get pruned
+                changed['stats'] = stats
+                return changed, True
+            changed_stats = dict((key, value)
+                                 for (key, value) in stats.iteritems()
+                                 if reported_stats.get(key) != value)
+            if changed_stats:
+                changed['stats'] = changed_stats
+        return changed, False
+
     def _update(self, context, values, prune_stats=False):
-        """Persist the compute node updates to the DB."""
+        """Persist the compute node updates to the DB.
+
+        Only the values and stats which changed since the last update are
+        sent.  If nothing changed, the update only refreshes updated_at.
+        """
         if "service" in self.compute_node:
             del self.compute_node['service']
+        values, prune_stats = self._get_changed_values(values, prune_stats)
         self.compute_node = self.conductor_api.compute_node_update(
             context, self.compute_node, values, prune_stats)
+        self._set_reported_values(self.compute_node)
+        if CONF.push_compute_node_updates:
+            self.scheduler_rpcapi.update_compute_node(context,
+                                                      self.compute_node)
 
     def _update_usage(self, resources, usage, sign=1):
         resources['memory_mb_used'] += sign * usage['memory_mb']
@@ -512,6 +583,20 @@ class ResourceTracker(object):
             else:
                 self._update_usage_from_instance(resources, instance)
 
+    def _update_cached_images(self, resources):
+        """Report the images in the local image cache of the virt driver
+        to the scheduler, as a bloom filter in the compute node stats.
+        """
+        fingerprints = self.driver.get_cached_images()
+        if not fingerprints:
+            return
+
+        images = cached_images.CachedImages()
+        for fingerprint in fingerprints:
+            images.add(fingerprint)
+        self.stats[cached_images.STAT_KEY] = images.encode()
+        resources['stats'] = self.stats
+
     def _find_orphaned_instances(self):
         """Given the set of instances and migrations already account for
         by resource tracker, sanity check the hypervisor to determine
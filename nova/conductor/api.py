@@ -90,6 +90,20 @@ class LocalAPI(object):
                                                          sort_dir,
                                                          columns_to_join)
 
+    def instance_get_all_by_filters_light(self, context, filters, columns,
+                                          sort_key='created_at',
+                                          sort_dir='desc'):
+        return self._manager.instance_get_all_by_filters_light(context,
+                                                               filters,
+                                                               columns,
+                                                               sort_key,
+                                                               sort_dir)
+
+    def instance_get_popular_image_refs(self, context, created_since, limit):
+        return self._manager.instance_get_popular_image_refs(context,
+                                                             created_since,
+                                                             limit)
+
     def instance_get_active_by_window_joined(self, context, begin, end=None,
                                              project_id=None, host=None):
         return self._manager.instance_get_active_by_window_joined(
@@ -168,6 +182,15 @@ class LocalAPI(object):
                                              last_ctr_in, last_ctr_out,
                                              last_refreshed)
 
+    def bw_usage_get_by_uuids(self, context, uuids, start_period):
+        return self._manager.bw_usage_get_by_uuids(context, uuids,
+                                                   start_period)
+
+    def bw_usage_update_batch(self, context, start_period, usages,
+                              last_refreshed=None):
+        return self._manager.bw_usage_update_batch(context, start_period,
+                                                   usages, last_refreshed)
+
     def security_group_get_by_instance(self, context, instance):
         return self._manager.security_group_get_by_instance(context, instance)
 
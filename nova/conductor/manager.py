@@ -67,7 +67,7 @@ class ConductorManager(manager.Manager):
     namespace.  See the ComputeTaskManager class for details.
     """
 
-    RPC_API_VERSION = '1.51'
+    RPC_API_VERSION = '1.54'
 
     def __init__(self, *args, **kwargs):
         super(ConductorManager, self).__init__(service_name='conductor',
@@ -232,6 +232,15 @@ class ConductorManager(manager.Manager):
         usage = self.db.bw_usage_get(context, uuid, start_period, mac)
         return jsonutils.to_primitive(usage)
 
+    def bw_usage_get_by_uuids(self, context, uuids, start_period):
+        usages = self.db.bw_usage_get_by_uuids(context, uuids, start_period)
+        return jsonutils.to_primitive(usages)
+
+    def bw_usage_update_batch(self, context, start_period, usages,
+                              last_refreshed=None):
+        self.db.bw_usage_update_batch(context, start_period, usages,
+                                      last_refreshed)
+
     # NOTE(russellb) This method can be removed in 2.0 of this API.  It is
     # deprecated in favor of the method in the base API.
     def get_backdoor_port(self, context):
@@ -297,6 +306,12 @@ class ConductorManager(manager.Manager):
             columns_to_join=columns_to_join)
         return jsonutils.to_primitive(result)
 
+    def instance_get_all_by_filters_light(self, context, filters, columns,
+                                          sort_key, sort_dir):
+        result = self.db.instance_get_all_by_filters_light(
+            context, filters, columns, sort_key, sort_dir)
+        return jsonutils.to_primitive(result)
+
     # NOTE(hanlind): This method can be removed in v2.0 of the RPC API.
     def instance_get_all_hung_in_rebooting(self, context, timeout):
         result = self.db.instance_get_all_hung_in_rebooting(context, timeout)
@@ -309,6 +324,10 @@ class ConductorManager(manager.Manager):
                                                        project_id, host)
         return jsonutils.to_primitive(result)
 
+    def instance_get_popular_image_refs(self, context, created_since, limit):
+        return self.db.instance_get_popular_image_refs(context, created_since,
+                                                       limit)
+
     def instance_get_active_by_window_joined(self, context, begin, end=None,
                                              project_id=None, host=None):
         result = self.db.instance_get_active_by_window_joined(
@@ -92,6 +92,9 @@ class ConductorAPI(nova.openstack.common.rpc.proxy.RpcProxy):
     1.50 - Added object_action() and object_class_action()
     1.51 - Added the 'legacy' argument to
            block_device_mapping_get_all_by_instance
+    1.52 - Added instance_get_all_by_filters_light
+    1.53 - Added bw_usage_get_by_uuids and bw_usage_update_batch
+    1.54 - Added instance_get_popular_image_refs
     """
 
     BASE_RPC_API_VERSION = '1.0'
@@ -204,6 +207,18 @@ class ConductorAPI(nova.openstack.common.rpc.proxy.RpcProxy):
                             last_refreshed=last_refreshed)
         return self.call(context, msg, version='1.5')
 
+    def bw_usage_get_by_uuids(self, context, uuids, start_period):
+        msg = self.make_msg('bw_usage_get_by_uuids', uuids=uuids,
+                            start_period=start_period)
+        return self.call(context, msg, version='1.53')
+
+    def bw_usage_update_batch(self, context, start_period, usages,
+                              last_refreshed=None):
+        msg = self.make_msg('bw_usage_update_batch',
+                            start_period=start_period, usages=usages,
+                            last_refreshed=last_refreshed)
+        return self.call(context, msg, version='1.53')
+
     def security_group_get_by_instance(self, context, instance):
         instance_p = jsonutils.to_primitive(instance)
         msg = self.make_msg('security_group_get_by_instance',
@@ -257,6 +272,18 @@ class ConductorAPI(nova.openstack.common.rpc.proxy.RpcProxy):
                             sort_dir=sort_dir, columns_to_join=columns_to_join)
         return self.call(context, msg, version='1.47')
 
+    def instance_get_all_by_filters_light(self, context, filters, columns,
+                                          sort_key, sort_dir):
+        msg = self.make_msg('instance_get_all_by_filters_light',
+                            filters=filters, columns=columns,
+                            sort_key=sort_key, sort_dir=sort_dir)
+        return self.call(context, msg, version='1.52')
+
+    def instance_get_popular_image_refs(self, context, created_since, limit):
+        msg = self.make_msg('instance_get_popular_image_refs',
+                            created_since=created_since, limit=limit)
+        return self.call(context, msg, version='1.54')
+
     def instance_get_active_by_window_joined(self, context, begin, end=None,
                                              project_id=None, host=None):
         msg = self.make_msg('instance_get_active_by_window_joined',
@@ -182,6 +182,11 @@ def compute_node_get_all(context):
     return IMPL.compute_node_get_all(context)
 
 
+def compute_node_get_all_updated_since(context, updated_since):
+    """Get computeNodes created, updated or deleted since a timestamp."""
+    return IMPL.compute_node_get_all_updated_since(context, updated_since)
+
+
 def compute_node_search_by_hypervisor(context, hypervisor_match):
     """Get computeNodes given a hypervisor hostname match string."""
     return IMPL.compute_node_search_by_hypervisor(context, hypervisor_match)
@@ -567,6 +572,12 @@ def virtual_interface_get_all(context):
     return IMPL.virtual_interface_get_all(context)
 
 
+def virtual_interface_get_all_addresses(context, fixed_address=None):
+    """Gets the fixed, floating and IPv6 network addresses of all vifs."""
+    return IMPL.virtual_interface_get_all_addresses(
+        context, fixed_address=fixed_address)
+
+
 ####################
 
 
@@ -618,6 +629,29 @@ def instance_get_all_by_filters(context, filters, sort_key='created_at',
                                             columns_to_join=columns_to_join)
 
 
+def instance_get_all_by_filters_light(context, filters, columns,
+                                      sort_key='created_at', sort_dir='desc',
+                                      limit=None, marker=None):
+    """Get the given columns of all instances that match all filters."""
+    return IMPL.instance_get_all_by_filters_light(context, filters, columns,
+                                                  sort_key, sort_dir,
+                                                  limit=limit, marker=marker)
+
+
+def instance_get_popular_image_refs(context, created_since, limit):
+    """Get the refs of up to limit images with the most live instances
+    created since a certain date/time, most booted first.
+    """
+    return IMPL.instance_get_popular_image_refs(context, created_since, limit)
+
+
+def instance_get_all_after_watermark(context, watermark, limit):
+    """Return up to limit instances updated after the watermark, the
+    (updated_at, id) of the last instance returned by a previous call.
+    """
+    return IMPL.instance_get_all_after_watermark(context, watermark, limit)
+
+
 def instance_get_active_by_window_joined(context, begin, end=None,
                                          project_id=None, host=None):
     """Get instances and joins active during a certain time window.
@@ -644,6 +678,14 @@ def instance_get_all_by_host_and_not_type(context, host, type_id=None):
     return IMPL.instance_get_all_by_host_and_not_type(context, host, type_id)
 
 
+def instance_get_hosts_by_uuids(context, uuids):
+    """Get the set of hosts running any of the given instances.
+
+    Only the host column is loaded, deleted instances are ignored.
+    """
+    return IMPL.instance_get_hosts_by_uuids(context, uuids)
+
+
 def instance_get_floating_address(context, instance_id):
     """Get the first floating ip address of an instance."""
     return IMPL.instance_get_floating_address(context, instance_id)
@@ -675,6 +717,15 @@ def instance_update(context, instance_uuid, values, update_cells=True):
     return rv
 
 
+def instance_update_batch(context, updates):
+    """Apply a list of instance updates in a single transaction.
+
+    Each update is a dict of values including the instance 'uuid'.
+    Returns the updates for instances that were not found.
+    """
+    return IMPL.instance_update_batch(context, updates)
+
+
 def instance_update_and_get_original(context, instance_uuid, values):
     """Set the given properties on an instance and update it. Return
     a shallow copy of the original instance reference, as well as the
@@ -1551,6 +1602,29 @@ def bw_usage_update(context, uuid, mac, start_period, bw_in, bw_out,
     return rv
 
 
+def bw_usage_update_batch(context, start_period, usages, last_refreshed=None,
+                          update_cells=True):
+    """Update cached bandwidth usage for many instance networks in one
+    transaction.  Each of usages is a dict with the uuid, mac, bw_in,
+    bw_out, last_ctr_in and last_ctr_out to update.  Creates new records
+    if needed.
+    """
+    rv = IMPL.bw_usage_update_batch(context, start_period, usages,
+                                    last_refreshed=last_refreshed)
+    if update_cells:
+        try:
+            cells_api = cells_rpcapi.CellsAPI()
+            for usage in usages:
+                cells_api.bw_usage_update_at_top(context,
+                        usage['uuid'], usage['mac'], start_period,
+                        usage['bw_in'], usage['bw_out'],
+                        usage['last_ctr_in'], usage['last_ctr_out'],
+                        last_refreshed)
+        except Exception:
+            LOG.exception(_("Failed to notify cells of bw_usage update"))
+    return rv
+
+
 ###################
 
 
@@ -1619,6 +1693,15 @@ def aggregate_metadata_get_by_host(context, host, key=None):
     return IMPL.aggregate_metadata_get_by_host(context, host, key)
 
 
+def aggregate_metadata_get_all_by_host(context):
+    """Get metadata for all aggregates, keyed by host.
+
+    Returns a dict of the same form as aggregate_metadata_get_by_host for
+    every host which belongs to an aggregate, using a single query.
+    """
+    return IMPL.aggregate_metadata_get_all_by_host(context)
+
+
 def aggregate_host_get_by_metadata_key(context, key):
     """Get hosts with a specific metadata key metadata for all aggregates.
 
@@ -472,6 +472,22 @@ def compute_node_get_all(context):
             all()
 
 
+@require_admin_context
+def compute_node_get_all_updated_since(context, updated_since):
+    """Return compute nodes created, updated or deleted since a timestamp.
+
+    Deleted nodes are included so that callers keeping a cache of compute
+    node data can drop them.
+    """
+    return model_query(context, models.ComputeNode, read_deleted="yes").\
+            options(joinedload('service')).\
+            options(joinedload('stats')).\
+            filter(or_(models.ComputeNode.updated_at >= updated_since,
+                       models.ComputeNode.created_at >= updated_since,
+                       models.ComputeNode.deleted_at >= updated_since)).\
+            all()
+
+
 @require_admin_context
 def compute_node_search_by_hypervisor(context, hypervisor_match):
     field = models.ComputeNode.hypervisor_hostname
@@ -509,8 +525,13 @@ def compute_node_create(context, values):
 
 def _update_stats(context, new_stats, compute_id, session, prune_stats=False):
 
-    existing = model_query(context, models.ComputeNodeStat, session=session,
-            read_deleted="no").filter_by(compute_node_id=compute_id).all()
+    query = model_query(context, models.ComputeNodeStat, session=session,
+            read_deleted="no").filter_by(compute_node_id=compute_id)
+    if not prune_stats:
+        # Only the stats being updated are needed
+        query = query.filter(
+                models.ComputeNodeStat.key.in_(new_stats.keys()))
+    existing = query.all()
     statmap = {}
     for stat in existing:
         key = stat['key']
@@ -550,7 +571,8 @@ def compute_node_update(context, compute_id, values, prune_stats=False):
 
     session = get_session()
     with session.begin():
-        _update_stats(context, stats, compute_id, session, prune_stats)
+        if stats or prune_stats:
+            _update_stats(context, stats, compute_id, session, prune_stats)
         compute_ref = _compute_node_get(context, compute_id, session=session)
         # Always update this, even if there's going to be no other
         # changes in data.  This ensures that we invalidate the
@@ -1403,6 +1425,72 @@ def virtual_interface_get_all(context):
     return vif_refs
 
 
+@require_context
+def virtual_interface_get_all_addresses(context, fixed_address=None):
+    """Get the addresses of all vifs with a single query.
+
+    :param fixed_address: if present, only return the vifs this fixed ip
+                          is allocated to
+    :returns: a list of dicts with the instance_uuid, MAC address,
+              network_id and network cidr_v6 of each vif, and its
+              fixed_ips as dicts with the fixed ip address and the
+              addresses of its floating_ips
+    """
+    query = model_query(context, models.VirtualInterface.id,
+                        models.VirtualInterface.instance_uuid,
+                        models.VirtualInterface.address,
+                        models.VirtualInterface.network_id,
+                        models.Network.cidr_v6,
+                        models.FixedIp.address,
+                        models.FloatingIp.address,
+                        base_model=models.VirtualInterface,
+                        read_deleted="yes").\
+                outerjoin((models.Network,
+                           and_(models.Network.id ==
+                                models.VirtualInterface.network_id,
+                                models.Network.deleted == 0))).\
+                outerjoin((models.FixedIp,
+                           and_(models.FixedIp.virtual_interface_id ==
+                                models.VirtualInterface.id,
+                                models.FixedIp.deleted == 0))).\
+                outerjoin((models.FloatingIp,
+                           and_(models.FloatingIp.fixed_ip_id ==
+                                models.FixedIp.id,
+                                models.FloatingIp.deleted == 0)))
+    if fixed_address is not None:
+        query = query.filter(models.FixedIp.address == fixed_address)
+    query = query.order_by(models.VirtualInterface.id,
+                           models.FixedIp.id,
+                           models.FloatingIp.id)
+
+    try:
+        rows = query.all()
+    except DataError:
+        # Postgres refuses to compare an inet column with an invalid address
+        return []
+
+    vifs = []
+    fixed_ips = {}
+    for (vif_id, instance_uuid, address, network_id, cidr_v6,
+         fixed_ip, floating_ip) in rows:
+        if not vifs or vifs[-1]['id'] != vif_id:
+            vifs.append({'id': vif_id,
+                         'instance_uuid': instance_uuid,
+                         'address': address,
+                         'network_id': network_id,
+                         'cidr_v6': cidr_v6,
+                         'fixed_ips': []})
+            fixed_ips = {}
+        if fixed_ip is None:
+            continue
+        if fixed_ip not in fixed_ips:
+            fixed_ips[fixed_ip] = {'address': fixed_ip, 'floating_ips': []}
+            vifs[-1]['fixed_ips'].append(fixed_ips[fixed_ip])
+        if floating_ip is not None:
+            fixed_ips[fixed_ip]['floating_ips'].append(floating_ip)
+    return vifs
+
+
 ###################
 
 
@@ -1694,8 +1782,6 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
                          vm_state is SOFT_DELETED.
     """
 
-    sort_fn = {'desc': desc, 'asc': asc}
-
     if not session:
         session = get_session()
 
@@ -1709,6 +1795,83 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
     for column in columns_to_join:
         query_prefix = query_prefix.options(joinedload(column))
 
+    query_prefix = _instances_filter_query(context, query_prefix, filters,
+                                           sort_key, sort_dir, limit, marker,
+                                           session)
+
+    return _instances_fill_metadata(context, query_prefix.all(), manual_joins)
+
+
+@require_context
+def instance_get_all_by_filters_light(context, filters, columns,
+                                      sort_key='created_at', sort_dir='desc',
+                                      limit=None, marker=None):
+    """Return the given columns of the instances that match all filters,
+    as a list of dicts.
+
+    The filters are the same as for instance_get_all_by_filters, but only
+    the columns are selected, no instance objects are built and nothing is
+    joined.
+    """
+    session = get_session()
+    query_prefix = session.query(*[getattr(models.Instance, column)
+                                   for column in columns])
+    query_prefix = _instances_filter_query(context, query_prefix, filters,
+                                           sort_key, sort_dir, limit, marker,
+                                           session)
+    return [dict(zip(columns, row)) for row in query_prefix.all()]
+
+
+@require_context
+def instance_get_popular_image_refs(context, created_since, limit):
+    """Return the refs of up to limit images with the most live instances
+    created since created_since, most booted first.
+    """
+    boots = func.count(models.Instance.id)
+    rows = model_query(context, models.Instance.image_ref, boots,
+                       base_model=models.Instance, read_deleted="no").\
+                filter(models.Instance.created_at >= created_since).\
+                filter(models.Instance.image_ref != None).\
+                filter(models.Instance.image_ref != '').\
+                group_by(models.Instance.image_ref).\
+                order_by(desc(boots), asc(models.Instance.image_ref)).\
+                limit(limit).\
+                all()
+    return [row[0] for row in rows]
+
+
+@require_context
+def instance_get_all_after_watermark(context, watermark, limit):
+    """Return up to limit instances updated after the watermark, in order
+    of their update.
+
+    The watermark is the (updated_at, id) of the last instance returned
+    by a previous call, or None to start with the oldest update.
+    Instances that were never updated are not returned.
+    """
+    query = _build_instance_get(context).\
+                filter(models.Instance.updated_at != None)
+    if watermark is not None:
+        updated_at, instance_id = watermark
+        updated_at = timeutils.normalize_time(updated_at)
+        query = query.filter(or_(
+                models.Instance.updated_at > updated_at,
+                and_(models.Instance.updated_at == updated_at,
+                     models.Instance.id > instance_id)))
+    return query.order_by(asc(models.Instance.updated_at),
+                          asc(models.Instance.id)).\
+                 limit(limit).\
+                 all()
+
+
+def _instances_filter_query(context, query_prefix, filters, sort_key,
+                            sort_dir, limit, marker, session):
+    """Apply the filters, sorting and pagination of
+    instance_get_all_by_filters to an instances query.
+    """
+
+    sort_fn = {'desc': desc, 'asc': asc}
+
     query_prefix = query_prefix.order_by(sort_fn[sort_dir](
             getattr(models.Instance, sort_key)))
 
@@ -1771,14 +1934,12 @@ def instance_get_all_by_filters(context, filters, sort_key, sort_dir,
             marker = _instance_get_by_uuid(context, marker, session=session)
         except exception.InstanceNotFound:
             raise exception.MarkerNotFound(marker)
-    query_prefix = sqlalchemyutils.paginate_query(query_prefix,
+    return sqlalchemyutils.paginate_query(query_prefix,
                            models.Instance, limit,
                            [sort_key, 'created_at', 'id'],
                            marker=marker,
                            sort_dir=sort_dir)
 
-    return _instances_fill_metadata(context, query_prefix.all(), manual_joins)
-
 
 def tag_filter(query, model, tag_model, tag_model_col, filters):
     """Applies tag filtering to a query.
@@ -1856,9 +2017,39 @@ def tag_filter(query, model, tag_model, tag_model_col, filters):
     return query
 
 
+def _regex_to_literal(regex):
+    """Return (literal, anchored_start, anchored_end) if regex only matches
+    a literal string, optionally anchored with ^ and $, else None.
+    """
+    anchored_start = regex.startswith('^')
+    if anchored_start:
+        regex = regex[1:]
+    anchored_end = regex.endswith('$') and not regex.endswith('\\$')
+    if anchored_end:
+        regex = regex[:-1]
+
+    literal = []
+    chars = iter(regex)
+    for char in chars:
+        if char == '\\':
+            char = next(chars, None)
+            # \d, \w and the like are character classes
+            if char is None or char.isalnum():
+                return None
+        elif char in '.^$*+?{}[]|()':
+            return None
+        literal.append(char)
+    return ''.join(literal), anchored_start, anchored_end
+
+
 def regex_filter(query, model, filters):
     """Applies regular expression filtering to a query.
 
+    Regular expressions which only match a literal string are applied as
+    an equality or LIKE match instead, which unlike REGEXP can use the
+    indexes of the column.  Databases without a regular expression
+    operator apply the filters as LIKE patterns, unchanged.
+
     Returns the updated query.
 
     :param query: query to apply filters to
@@ -1881,8 +2072,28 @@ def regex_filter(query, model, filters):
             continue
         if 'property' == type(column_attr).__name__:
             continue
-        query = query.filter(column_attr.op(db_regexp_op)(
-                                    str(filters[filter_name])))
+        regex = str(filters[filter_name])
+        literal = None
+        if db_regexp_op != 'LIKE':
+            literal = _regex_to_literal(regex)
+        if literal is not None:
+            value, anchored_start, anchored_end = literal
+            if anchored_start and anchored_end:
+                query = query.filter(column_attr == value)
+                continue
+            # NOTE: LIKE is case insensitive on sqlite, unlike its REGEXP
+            if (db_string != 'sqlite' and
+                    isinstance(column_attr.property.columns[0].type,
+                               String)):
+                pattern = value.replace('\\', '\\\\').replace(
+                        '%', '\\%').replace('_', '\\_')
+                if not anchored_start:
+                    pattern = '%' + pattern
+                if not anchored_end:
+                    pattern = pattern + '%'
+                query = query.filter(column_attr.like(pattern, escape='\\'))
+                continue
+        query = query.filter(column_attr.op(db_regexp_op)(regex))
     return query
 
 
@@ -1955,6 +2166,17 @@ def instance_get_all_by_host_and_not_type(context, host, type_id=None):
                    filter(models.Instance.instance_type_id != type_id).all())
 
 
+@require_context
+def instance_get_hosts_by_uuids(context, uuids):
+    if not uuids:
+        return set()
+    rows = model_query(context, models.Instance.host,
+                       base_model=models.Instance, project_only=True).\
+                filter(models.Instance.uuid.in_(uuids)).\
+                all()
+    return set(row.host for row in rows if row.host is not None)
+
+
 # NOTE(jkoelker) This is only being left here for compat with floating
 #                ips. Currently the network_api doesn't return floaters
 #                in network_info. Once it starts return the model. This
@@ -2076,58 +2298,104 @@ def _instance_update(context, instance_uuid, values, copy_old_instance=False):
     with session.begin():
         instance_ref = _instance_get_by_uuid(context, instance_uuid,
                                              session=session)
-        if "expected_task_state" in values:
-            # it is not a db column so always pop out
-            expected = values.pop("expected_task_state")
-            if not isinstance(expected, (tuple, list, set)):
-                expected = (expected,)
-            actual_state = instance_ref["task_state"]
-            if actual_state not in expected:
-                raise exception.UnexpectedTaskStateError(actual=actual_state,
-                                                         expected=expected)
-        if "expected_vm_state" in values:
-            expected = values.pop("expected_vm_state")
-            if not isinstance(expected, (tuple, list, set)):
-                expected = (expected,)
-            actual_state = instance_ref["vm_state"]
-            if actual_state not in expected:
-                raise exception.UnexpectedVMStateError(actual=actual_state,
-                                                       expected=expected)
-
-        instance_hostname = instance_ref['hostname'] or ''
-        if ("hostname" in values and
-                values["hostname"].lower() != instance_hostname.lower()):
-                _validate_unique_server_name(context,
-                                             session,
-                                             values['hostname'])
-
         if copy_old_instance:
             old_instance_ref = copy.copy(instance_ref)
         else:
             old_instance_ref = None
 
-        metadata = values.get('metadata')
-        if metadata is not None:
-            _instance_metadata_update_in_place(context, instance_ref,
-                                               'metadata',
-                                               models.InstanceMetadata,
-                                               values.pop('metadata'),
-                                               session)
-
-        system_metadata = values.get('system_metadata')
-        if system_metadata is not None:
-            _instance_metadata_update_in_place(context, instance_ref,
-                                               'system_metadata',
-                                               models.InstanceSystemMetadata,
-                                               values.pop('system_metadata'),
-                                               session)
-
-        instance_ref.update(values)
-        instance_ref.save(session=session)
+        _instance_ref_update(context, instance_ref, values, session)
 
     return (old_instance_ref, instance_ref)
 
 
+def _instance_ref_update(context, instance_ref, values, session):
+    """Check the expected states in values and update instance_ref with
+    the rest of them.  Nothing is written if a check fails.
+    """
+    if "expected_task_state" in values:
+        # it is not a db column so always pop out
+        expected = values.pop("expected_task_state")
+        if not isinstance(expected, (tuple, list, set)):
+            expected = (expected,)
+        actual_state = instance_ref["task_state"]
+        if actual_state not in expected:
+            raise exception.UnexpectedTaskStateError(actual=actual_state,
+                                                     expected=expected)
+    if "expected_vm_state" in values:
+        expected = values.pop("expected_vm_state")
+        if not isinstance(expected, (tuple, list, set)):
+            expected = (expected,)
+        actual_state = instance_ref["vm_state"]
+        if actual_state not in expected:
+            raise exception.UnexpectedVMStateError(actual=actual_state,
+                                                   expected=expected)
+
+    instance_hostname = instance_ref['hostname'] or ''
+    if ("hostname" in values and
+            values["hostname"].lower() != instance_hostname.lower()):
+            _validate_unique_server_name(context,
+                                         session,
+                                         values['hostname'])
+
+    metadata = values.get('metadata')
+    if metadata is not None:
+        _instance_metadata_update_in_place(context, instance_ref,
+                                           'metadata',
+                                           models.InstanceMetadata,
+                                           values.pop('metadata'),
+                                           session)
+
+    system_metadata = values.get('system_metadata')
+    if system_metadata is not None:
+        _instance_metadata_update_in_place(context, instance_ref,
+                                           'system_metadata',
+                                           models.InstanceSystemMetadata,
+                                           values.pop('system_metadata'),
+                                           session)
+
+    instance_ref.update(values)
+    instance_ref.save(session=session)
+
+
+@require_context
+def instance_update_batch(context, updates):
+    """Apply a list of instance updates in a single transaction.
+
+    Each update is a dict of the values to set, including the instance
+    'uuid' and optionally the instance's 'info_cache' values.  Updates
+    failing their expected state checks are skipped.  Returns the
+    updates for instances that were not found.
+    """
+    not_found = []
+    session = get_session()
+    with session.begin():
+        for update in updates:
+            values = update.copy()
+            instance_uuid = values.pop('uuid')
+            info_cache = values.pop('info_cache', None)
+            try:
+                instance_ref = _instance_get_by_uuid(context, instance_uuid,
+                                                     session=session)
+            except exception.InstanceNotFound:
+                not_found.append(update)
+                continue
+            try:
+                _instance_ref_update(context, instance_ref, values, session)
+            except (exception.UnexpectedTaskStateError,
+                    exception.UnexpectedVMStateError,
+                    exception.InstanceExists) as e:
+                LOG.debug(_("Skipping instance update: %s"), e,
+                          instance_uuid=instance_uuid)
+                continue
+            if info_cache:
+                try:
+                    _instance_info_cache_update(context, instance_uuid,
+                                                info_cache, session)
+                except exception.InstanceInfoCacheNotFound:
+                    pass
+    return not_found
+
+
 def instance_add_security_group(context, instance_uuid, security_group_id):
     """Associate the given security group with the given instance."""
     sec_group_ref = models.SecurityGroupInstanceAssociation()
@@ -2170,20 +2438,24 @@ def instance_info_cache_update(context, instance_uuid, values):
     """
     session = get_session()
     with session.begin():
-        info_cache = model_query(context, models.InstanceInfoCache,
-                                 session=session).\
-                         filter_by(instance_uuid=instance_uuid).\
-                         first()
-        if info_cache and info_cache['deleted']:
-            raise exception.InstanceInfoCacheNotFound(
-                    instance_uuid=instance_uuid)
-        elif not info_cache:
-            # NOTE(tr3buchet): just in case someone blows away an instance's
-            #                  cache entry, re-create it.
-            info_cache = models.InstanceInfoCache()
-            values['instance_uuid'] = instance_uuid
-        info_cache.update(values)
+        return _instance_info_cache_update(context, instance_uuid, values,
+                                           session)
+
 
+def _instance_info_cache_update(context, instance_uuid, values, session):
+    info_cache = model_query(context, models.InstanceInfoCache,
+                             session=session).\
+                     filter_by(instance_uuid=instance_uuid).\
+                     first()
+    if info_cache and info_cache['deleted']:
+        raise exception.InstanceInfoCacheNotFound(
+                instance_uuid=instance_uuid)
+    elif not info_cache:
+        # NOTE(tr3buchet): just in case someone blows away an instance's
+        #                  cache entry, re-create it.
+        info_cache = models.InstanceInfoCache()
+        values['instance_uuid'] = instance_uuid
+    info_cache.update(values)
     return info_cache
 
 
@@ -4384,6 +4656,41 @@ def bw_usage_update(context, uuid, mac, start_period, bw_in, bw_out,
         bwusage.save(session=session)
 
 
+@require_context
+@_retry_on_deadlock
+def bw_usage_update_batch(context, start_period, usages, last_refreshed=None):
+    if last_refreshed is None:
+        last_refreshed = timeutils.utcnow()
+
+    session = get_session()
+    with session.begin():
+        uuids = list(set(usage['uuid'] for usage in usages))
+        bwusages = {}
+        if uuids:
+            rows = model_query(context, models.BandwidthUsage,
+                               session=session, read_deleted="yes").\
+                           filter(models.BandwidthUsage.uuid.in_(uuids)).\
+                           filter_by(start_period=start_period).\
+                           all()
+            for bwusage in rows:
+                bwusages[(bwusage.uuid, bwusage.mac)] = bwusage
+
+        for usage in usages:
+            bwusage = bwusages.get((usage['uuid'], usage['mac']))
+            if bwusage is None:
+                bwusage = models.BandwidthUsage()
+                bwusage.start_period = start_period
+                bwusage.uuid = usage['uuid']
+                bwusage.mac = usage['mac']
+                session.add(bwusage)
+                bwusages[(usage['uuid'], usage['mac'])] = bwusage
+            bwusage.last_refreshed = last_refreshed
+            bwusage.bw_in = usage['bw_in']
+            bwusage.bw_out = usage['bw_out']
+            bwusage.last_ctr_in = usage['last_ctr_in']
+            bwusage.last_ctr_out = usage['last_ctr_out']
+
+
 ####################
 
 
@@ -4635,6 +4942,21 @@ def aggregate_metadata_get_by_host(context, host, key=None):
     return dict(metadata)
 
 
+@require_admin_context
+def aggregate_metadata_get_all_by_host(context):
+    query = model_query(context, models.Aggregate).\
+            options(joinedload('_hosts')).\
+            options(joinedload('_metadata'))
+    metadata = collections.defaultdict(lambda: collections.defaultdict(set))
+    for agg in query.all():
+        for agghost in agg._hosts:
+            host_metadata = metadata[agghost.host]
+            for kv in agg._metadata:
+                host_metadata[kv['key']].add(kv['value'])
+    return dict((host, dict(host_metadata))
+                for host, host_metadata in metadata.iteritems())
+
+
 @require_admin_context
 def aggregate_host_get_by_metadata_key(context, key):
     query = model_query(context, models.Aggregate).join(
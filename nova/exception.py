@@ -1106,6 +1106,11 @@ class CouldNotFetchImage(NovaException):
     message = _("Could not fetch image %(image_id)s")
 
 
+class ImageChecksumMismatch(CouldNotFetchImage):
+    message = _("Checksum of image %(image_id)s does not match: expected "
+                "%(expected)s, got %(actual)s")
+
+
 class CouldNotUploadImage(NovaException):
     message = _("Could not upload image %(image_id)s")
 
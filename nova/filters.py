@@ -17,6 +17,8 @@
 Filter support
 """
 
+import time
+
 from nova import loadables
 from nova.openstack.common import log as logging
 
@@ -50,18 +52,29 @@ class BaseFilterHandler(loadables.BaseLoader):
     """
 
     def get_filtered_objects(self, filter_classes, objs,
-            filter_properties):
+            filter_properties, filter_stats=None):
+        """Return the objects passing all filter_classes, in order.
+
+        If filter_stats is given, its record() method is called after each
+        filter with the filter class, the number of objects it was given,
+        the number it returned and the time it took.
+        """
         list_objs = list(objs)
         LOG.debug("Starting with %d host(s)", len(list_objs))
         for filter_cls in filter_classes:
             cls_name = filter_cls.__name__
+            start = time.time()
             objs = filter_cls().filter_all(list_objs,
                                            filter_properties)
             if objs is None:
                 LOG.debug("Filter %(cls_name)s says to stop filtering",
                           {'cls_name': cls_name})
                 return
+            num_objs = len(list_objs)
             list_objs = list(objs)
+            if filter_stats is not None:
+                filter_stats.record(filter_cls, num_objs, len(list_objs),
+                                    time.time() - start)
             LOG.debug("Filter %(cls_name)s returned %(obj_len)d host(s)",
                       {'cls_name': cls_name, 'obj_len': len(list_objs)})
             if len(list_objs) == 0:
@@ -20,6 +20,7 @@
 from __future__ import absolute_import
 
 import copy
+import hashlib
 import itertools
 import random
 import shutil
@@ -64,6 +65,12 @@ glance_opts = [
                 help='A list of url scheme that can be downloaded directly '
                      'via the direct_url.  Currently supported schemes: '
                      '[file].'),
+    cfg.BoolOpt('glance_verify_checksum',
+                default=True,
+                help='Verify the checksum of images downloaded from glance '
+                     'in several attempts against the one glance recorded '
+                     'for them. glanceclient verifies the images downloaded '
+                     'in one attempt itself'),
     ]
 
 LOG = logging.getLogger(__name__)
@@ -195,6 +202,49 @@ class GlanceClientWrapper(object):
                 time.sleep(1)
 
 
+class _ImageStreamInterrupted(Exception):
+    """Reading an image stream from glance failed part way through."""
+
+    def __init__(self, exc_info):
+        super(_ImageStreamInterrupted, self).__init__(str(exc_info[1]))
+        self.exc_info = exc_info
+        self.reason = exc_info[1]
+
+
+class _ImageDataWriter(object):
+    """Writes image chunks to a file object, checksumming as it goes.
+
+    Keeps count of the bytes written, so that when a stream is interrupted
+    and the download retried, the bytes the new stream sends again from
+    the start of the image are skipped rather than written twice.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+        self.checksum = hashlib.md5()
+
+    def write_from(self, image_chunks):
+        skip = self.offset
+        chunks = iter(image_chunks)
+        while True:
+            try:
+                chunk = chunks.next()
+            except StopIteration:
+                return
+            except (glanceclient.exc.CommunicationError, IOError):
+                raise _ImageStreamInterrupted(sys.exc_info())
+            if skip:
+                if len(chunk) <= skip:
+                    skip -= len(chunk)
+                    continue
+                chunk = chunk[skip:]
+                skip = 0
+            self.data.write(chunk)
+            self.checksum.update(chunk)
+            self.offset += len(chunk)
+
+
 class GlanceImageService(object):
     """Provides storage and retrieval of disk image objects within Glance."""
 
@@ -280,9 +330,43 @@ class GlanceImageService(object):
 
         if data is None:
             return image_chunks
-        else:
-            for chunk in image_chunks:
-                data.write(chunk)
+
+        # NOTE: glanceclient checks the checksum of a whole stream
+        # itself, so only images written from several streams need to be
+        # checked against the checksum glance recorded
+        writer = _ImageDataWriter(data)
+        num_attempts = 1 + CONF.glance_num_retries
+        for attempt in xrange(1, num_attempts + 1):
+            try:
+                writer.write_from(image_chunks)
+                break
+            except _ImageStreamInterrupted as e:
+                if attempt == num_attempts:
+                    exc_info = e.exc_info
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                LOG.warn(_("Download of image %(image_id)s interrupted "
+                           "after %(offset)d bytes, retrying: %(reason)s"),
+                         {'image_id': image_id, 'offset': writer.offset,
+                          'reason': e.reason})
+                time.sleep(1)
+            try:
+                image_chunks = self._client.call(context, 1, 'data',
+                                                 image_id)
+            except Exception:
+                _reraise_translated_image_exception(image_id)
+
+        if attempt == 1 or not CONF.glance_verify_checksum:
+            return
+        try:
+            image = self._client.call(context, 1, 'get', image_id)
+        except Exception:
+            _reraise_translated_image_exception(image_id)
+        expected_checksum = getattr(image, 'checksum', None)
+        actual_checksum = writer.checksum.hexdigest()
+        if expected_checksum and actual_checksum != expected_checksum:
+            raise exception.ImageChecksumMismatch(image_id=image_id,
+                                                  expected=expected_checksum,
+                                                  actual=actual_checksum)
 
     def create(self, context, image_meta, data=None):
         """Store the image data and return the new image object."""
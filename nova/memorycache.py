@@ -0,0 +1,184 @@
+# Copyright (c) 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""In process cache used when no memcached servers are configured.
+
+Unlike the client in nova.openstack.common.memorycache it does not walk the
+whole cache to expire keys, and it can be bounded in size.
+"""
+
+import heapq
+
+from oslo.config import cfg
+
+from nova.openstack.common import timeutils
+
+memorycache_opts = [
+    cfg.IntOpt('memorycache_max_entries',
+               default=0,
+               help='Maximum number of keys kept by the in process cache. '
+                    'The least recently used keys are evicted beyond it. '
+                    '0 means no limit.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(memorycache_opts)
+CONF.import_opt('memcached_servers', 'nova.openstack.common.memorycache')
+
+
+def get_client(memcached_servers=None):
+    client_cls = Client
+
+    if not memcached_servers:
+        memcached_servers = CONF.memcached_servers
+    if memcached_servers:
+        try:
+            import memcache
+            client_cls = memcache.Client
+        except ImportError:
+            pass
+
+    return client_cls(memcached_servers, debug=0)
+
+
+class Client(object):
+    """Replicates a tiny subset of memcached client interface.
+
+    Keys with a timeout are kept in a heap ordered by timeout, and when
+    the cache is bounded keys are kept in a heap ordered by their last use,
+    so that expiring keys and evicting the least recently used ones does
+    not require walking the whole cache.  Entries of keys which were used,
+    set again or deleted since are skipped when popped from the heaps.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Ignores the passed in args."""
+        self.cache = {}
+        self.max_entries = CONF.memorycache_max_entries
+        # (timeout, key) for the keys set with a timeout
+        self._timeouts = []
+        # (use, key) for the uses of the keys, and the last use of each
+        self._uses = []
+        self._last_uses = {}
+        self._use_count = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _forget(self, key):
+        del self.cache[key]
+        self._last_uses.pop(key, None)
+
+    def _expire(self):
+        """Expunges expired keys."""
+        now = timeutils.utcnow_ts()
+        while self._timeouts and now >= self._timeouts[0][0]:
+            timeout, key = heapq.heappop(self._timeouts)
+            if key in self.cache and self.cache[key][0] == timeout:
+                self._forget(key)
+                self.expirations += 1
+
+    def _compact(self, heap, live_entries):
+        # Drop the entries of keys used, set again or deleted since once
+        # they outnumber the live ones
+        if len(heap) <= 2 * len(self.cache) + 64:
+            return heap
+        heap = list(live_entries())
+        heapq.heapify(heap)
+        return heap
+
+    def _push_timeout(self, key, timeout):
+        heapq.heappush(self._timeouts, (timeout, key))
+        self._timeouts = self._compact(self._timeouts, lambda: (
+            (timeout, key) for (key, (timeout, _value))
+            in self.cache.iteritems() if timeout))
+
+    def _use(self, key):
+        """Mark the key as the most recently used."""
+        if self.max_entries <= 0:
+            return
+        self._use_count += 1
+        self._last_uses[key] = self._use_count
+        heapq.heappush(self._uses, (self._use_count, key))
+        self._uses = self._compact(self._uses, lambda: (
+            (use, key) for (key, use) in self._last_uses.iteritems()))
+
+    def _evict(self):
+        """Evicts the least recently used keys beyond max_entries."""
+        while len(self.cache) > self.max_entries and self._uses:
+            use, key = heapq.heappop(self._uses)
+            if self._last_uses.get(key) == use:
+                self._forget(key)
+                self.evictions += 1
+
+    def get(self, key):
+        """Retrieves the value for a key or None.
+
+        this expunges expired keys during each get"""
+
+        self._expire()
+        entry = self.cache.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._use(key)
+        return entry[1]
+
+    def set(self, key, value, time=0, min_compress_len=0):
+        """Sets the value for a key."""
+        timeout = 0
+        if time != 0:
+            timeout = timeutils.utcnow_ts() + time
+        self.cache[key] = (timeout, value)
+        if timeout:
+            self._push_timeout(key, timeout)
+        if self.max_entries > 0:
+            self._use(key)
+            self._evict()
+        return True
+
+    def add(self, key, value, time=0, min_compress_len=0):
+        """Sets the value for a key if it doesn't exist."""
+        if self.get(key) is not None:
+            return False
+        return self.set(key, value, time, min_compress_len)
+
+    def incr(self, key, delta=1):
+        """Increments the value for a key."""
+        value = self.get(key)
+        if value is None:
+            return None
+        new_value = int(value) + delta
+        self.cache[key] = (self.cache[key][0], str(new_value))
+        return new_value
+
+    def delete(self, key, time=0):
+        """Deletes the value associated with a key."""
+        if key in self.cache:
+            self._forget(key)
+
+    def get_stats(self):
+        """Returns the cache statistics, in the format of the memcached
+        client's get_stats().
+        """
+        self._expire()
+        stats = {'curr_items': len(self.cache),
+                 'get_hits': self.hits,
+                 'get_misses': self.misses,
+                 'evictions': self.evictions,
+                 'expired': self.expirations}
+        return [('memorycache', stats)]
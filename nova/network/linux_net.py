@@ -122,6 +122,15 @@ linux_net_opts = [
                default='DROP',
                help=('The table that iptables to jump to when a packet is '
                      'to be dropped.')),
+    cfg.BoolOpt('iptables_incremental_apply',
+                default=False,
+                help='Only rewrite the wrapped chains that changed since '
+                     'the last apply, using iptables-restore --noflush, '
+                     'when no shared chain has changed'),
+    cfg.IntOpt('iptables_full_apply_interval',
+               default=600,
+               help='Number of seconds after which the next apply rewrites '
+                    'all of the tables even if only wrapped chains changed'),
     ]
 
 CONF = cfg.CONF
@@ -183,6 +192,24 @@ class IptablesTable(object):
         self.chains = set()
         self.unwrapped_chains = set()
         self.remove_chains = set()
+        # Changes since the last apply: the wrapped chains that changed,
+        # whether any unwrapped chain or rule changed, and the wrapped
+        # chains that were applied
+        self.dirty_chains = set()
+        self.unwrapped_dirty = True
+        self.applied_chains = set()
+
+    def _mark_dirty(self, chain, wrap):
+        if wrap:
+            self.dirty_chains.add(chain)
+        else:
+            self.unwrapped_dirty = True
+
+    def mark_applied(self):
+        """Record that the current rules have been applied."""
+        self.dirty_chains.clear()
+        self.unwrapped_dirty = False
+        self.applied_chains = set(self.chains)
 
     def add_chain(self, name, wrap=True):
         """Adds a named chain to the table.
@@ -200,6 +227,7 @@ class IptablesTable(object):
             self.chains.add(name)
         else:
             self.unwrapped_chains.add(name)
+        self._mark_dirty(name, wrap)
 
     def remove_chain(self, name, wrap=True):
         """Remove named chain.
@@ -225,6 +253,7 @@ class IptablesTable(object):
         if not wrap:
             self.remove_chains.add(name)
         chain_set.remove(name)
+        self._mark_dirty(name, wrap)
         if not wrap:
             self.remove_rules += filter(lambda r: r.chain == name, self.rules)
         self.rules = filter(lambda r: r.chain != name, self.rules)
@@ -234,9 +263,11 @@ class IptablesTable(object):
         else:
             jump_snippet = '-j %s' % (name,)
 
+        jump_rules = filter(lambda r: jump_snippet in r.rule, self.rules)
         if not wrap:
-            self.remove_rules += filter(lambda r: jump_snippet in r.rule,
-                                        self.rules)
+            self.remove_rules += jump_rules
+        for rule in jump_rules:
+            self._mark_dirty(rule.chain, rule.wrap)
         self.rules = filter(lambda r: jump_snippet not in r.rule, self.rules)
 
     def add_rule(self, chain, rule, wrap=True, top=False):
@@ -257,6 +288,7 @@ class IptablesTable(object):
             rule = ' '.join(map(self._wrap_target_chain, rule.split(' ')))
 
         self.rules.append(IptablesRule(chain, rule, wrap, top))
+        self._mark_dirty(chain, wrap)
 
     def _wrap_target_chain(self, s):
         if s.startswith('$'):
@@ -275,6 +307,7 @@ class IptablesTable(object):
             self.rules.remove(IptablesRule(chain, rule, wrap, top))
             if not wrap:
                 self.remove_rules.append(IptablesRule(chain, rule, wrap, top))
+            self._mark_dirty(chain, wrap)
         except ValueError:
             LOG.warn(_('Tried to remove rule that was not there:'
                        ' %(chain)r %(rule)r %(wrap)r %(top)r'),
@@ -286,6 +319,9 @@ class IptablesTable(object):
         if isinstance(regex, basestring):
             regex = re.compile(regex)
         num_rules = len(self.rules)
+        for rule in self.rules:
+            if regex.match(str(rule)):
+                self._mark_dirty(rule.chain, rule.wrap)
         self.rules = filter(lambda r: not regex.match(str(r)), self.rules)
         return num_rules - len(self.rules)
 
@@ -295,6 +331,8 @@ class IptablesTable(object):
                               if rule.chain == chain and rule.wrap == wrap]
         for rule in chained_rules:
             self.rules.remove(rule)
+        if chained_rules:
+            self._mark_dirty(chain, wrap)
 
 
 class IptablesManager(object):
@@ -332,6 +370,7 @@ class IptablesManager(object):
         self.ipv6 = {'filter': IptablesTable()}
 
         self.iptables_apply_deferred = False
+        self._last_full_apply = None
 
         # Add a nova-filter-top chain. It's intended to be shared
         # among the various nova components. It sits at the very top
@@ -404,11 +443,41 @@ class IptablesManager(object):
         same component of Nova, and replace them with our current set of
         rules. This happens atomically, thanks to iptables-restore.
 
+        With iptables_incremental_apply, only the wrapped chains changed
+        since the last apply are rewritten, unless an unwrapped chain or
+        rule changed or the last full apply is older than
+        iptables_full_apply_interval.
+
         """
         s = [('iptables', self.ipv4)]
         if CONF.use_ipv6:
             s += [('ip6tables', self.ipv6)]
 
+        if self._can_apply_dirty_chains(s):
+            try:
+                self._apply_dirty_chains(s)
+            except processutils.ProcessExecutionError:
+                LOG.exception(_("Failed to apply the changed iptables "
+                                "chains, applying all rules instead"))
+                self._apply_all(s)
+        else:
+            self._apply_all(s)
+        LOG.debug(_("IPTablesManager.apply completed with success"))
+
+    def _can_apply_dirty_chains(self, s):
+        if not CONF.iptables_incremental_apply:
+            return False
+        if (self._last_full_apply is None or
+                timeutils.is_older_than(self._last_full_apply,
+                                        CONF.iptables_full_apply_interval)):
+            return False
+        for cmd, tables in s:
+            for table in tables.itervalues():
+                if table.unwrapped_dirty:
+                    return False
+        return True
+
+    def _apply_all(self, s):
         for cmd, tables in s:
             all_tables, _err = self.execute('%s-save' % (cmd,), '-c',
                                                 run_as_root=True,
@@ -421,7 +490,59 @@ class IptablesManager(object):
             self.execute('%s-restore' % (cmd,), '-c', run_as_root=True,
                          process_input='\n'.join(all_lines),
                          attempts=5)
-        LOG.debug(_("IPTablesManager.apply completed with success"))
+            for table in tables.itervalues():
+                table.mark_applied()
+        self._last_full_apply = timeutils.utcnow()
+
+    def _apply_dirty_chains(self, s):
+        for cmd, tables in s:
+            all_lines = []
+            for table_name, table in tables.iteritems():
+                all_lines += self._modify_chains(table, table_name)
+            if all_lines:
+                self.execute('%s-restore' % (cmd,), '-c', '--noflush',
+                             run_as_root=True,
+                             process_input='\n'.join(all_lines))
+            for table in tables.itervalues():
+                table.mark_applied()
+
+    def _modify_chains(self, table, table_name):
+        """Return the iptables-restore --noflush input rewriting the
+        wrapped chains of the table changed since the last apply.
+
+        Declaring a chain flushes it, so each changed chain is declared and
+        refilled, and chains removed since the last apply are then deleted.
+        """
+        removed_chains = table.applied_chains - table.chains
+        dirty_chains = (table.dirty_chains & table.chains) | removed_chains
+        if not dirty_chains:
+            return []
+
+        top_rules = []
+        bottom_rules = []
+        for rule in table.rules:
+            if rule.wrap and rule.chain in dirty_chains:
+                if rule.top:
+                    top_rules.append(str(rule))
+                else:
+                    bottom_rules.append(str(rule))
+
+        # As in _modify_rules, the last occurrence of a rule wins
+        seen_lines = set()
+        rule_lines = []
+        for line in reversed(top_rules + bottom_rules):
+            if line not in seen_lines:
+                seen_lines.add(line)
+                rule_lines.append(line)
+        rule_lines.reverse()
+
+        return (['*%s' % table_name] +
+                [':%s-%s - [0:0]' % (binary_name, chain)
+                 for chain in sorted(dirty_chains)] +
+                rule_lines +
+                ['-X %s-%s' % (binary_name, chain)
+                 for chain in sorted(removed_chains)] +
+                ['COMMIT'])
 
     def _find_table(self, lines, table_name):
         if len(lines) < 3:
@@ -449,27 +570,25 @@ class IptablesManager(object):
             current_lines = fake_table
 
         # Remove any trace of our rules
-        new_filter = filter(lambda line: binary_name not in line,
-                            current_lines)
+        new_filter = [line for line in current_lines
+                      if binary_name not in line]
 
         top_rules = []
         bottom_rules = []
 
         if CONF.iptables_top_regex:
             regex = re.compile(CONF.iptables_top_regex)
-            temp_filter = filter(lambda line: regex.search(line), new_filter)
-            for rule_str in temp_filter:
-                new_filter = filter(lambda s: s.strip() != rule_str.strip(),
-                                    new_filter)
-            top_rules = temp_filter
+            top_rules = [line for line in new_filter if regex.search(line)]
+            top_rule_lines = set(line.strip() for line in top_rules)
+            new_filter = [line for line in new_filter
+                          if line.strip() not in top_rule_lines]
 
         if CONF.iptables_bottom_regex:
             regex = re.compile(CONF.iptables_bottom_regex)
-            temp_filter = filter(lambda line: regex.search(line), new_filter)
-            for rule_str in temp_filter:
-                new_filter = filter(lambda s: s.strip() != rule_str.strip(),
-                    new_filter)
-            bottom_rules = temp_filter
+            bottom_rules = [line for line in new_filter if regex.search(line)]
+            bottom_rule_lines = set(line.strip() for line in bottom_rules)
+            new_filter = [line for line in new_filter
+                          if line.strip() not in bottom_rule_lines]
 
         seen_chains = False
         rules_index = 0
@@ -484,41 +603,52 @@ class IptablesManager(object):
         if not seen_chains:
             rules_index = 2
 
-        our_rules = top_rules
-        bot_rules = []
+        # rule.top == True means we want this rule to be at the top.
+        # Further down, we weed out duplicates from the bottom of the
+        # list, so here we remove the dupes ahead of time.
+
+        # We don't want to remove an entry if it has non-zero
+        # [packet:byte] counts and replace it with [0:0], so let's
+        # go look for a duplicate, and over-ride our table rule if
+        # found.
+        top_rule_strs = []
         for rule in rules:
-            rule_str = str(rule)
             if rule.top:
-                # rule.top == True means we want this rule to be at the top.
-                # Further down, we weed out duplicates from the bottom of the
-                # list, so here we remove the dupes ahead of time.
-
-                # We don't want to remove an entry if it has non-zero
-                # [packet:byte] counts and replace it with [0:0], so let's
-                # go look for a duplicate, and over-ride our table rule if
-                # found.
-
+                rule_str = str(rule)
                 # ignore [packet:byte] counts at beginning of line
                 if rule_str.startswith('['):
                     rule_str = rule_str.split(']', 1)[1]
-                dup_filter = filter(lambda s: rule_str.strip() in s.strip(),
-                                    new_filter)
-
-                new_filter = filter(lambda s:
-                                    rule_str.strip() not in s.strip(),
-                                    new_filter)
-                # if no duplicates, use original rule
-                if dup_filter:
-                    # grab the last entry, if there is one
-                    dup = dup_filter[-1]
-                    rule_str = str(dup)
+                top_rule_strs.append(rule_str.strip())
+
+        # A line is a duplicate of the first top rule it contains, and the
+        # last duplicate of a rule replaces it. Lines containing our
+        # binary name are already gone, so wrapped rules have none.
+        dup_rule_strs = [(index, top_rule_str)
+                         for index, top_rule_str in enumerate(top_rule_strs)
+                         if binary_name not in top_rule_str]
+        dups = {}
+        if dup_rule_strs:
+            unique_lines = []
+            for line in new_filter:
+                stripped = line.strip()
+                for index, rule_str in dup_rule_strs:
+                    if rule_str in stripped:
+                        dups[index] = line
+                        break
                 else:
-                    rule_str = str(rule)
-                rule_str.strip()
+                    unique_lines.append(line)
+            new_filter = unique_lines
 
-                our_rules += [rule_str]
+        our_rules = top_rules
+        bot_rules = []
+        top_index = 0
+        for rule in rules:
+            if rule.top:
+                # if no duplicates, use original rule
+                our_rules.append(dups.get(top_index, str(rule)))
+                top_index += 1
             else:
-                bot_rules += [rule_str]
+                bot_rules.append(str(rule))
 
         our_rules += bot_rules
 
@@ -545,6 +675,10 @@ class IptablesManager(object):
                 seen_lines.add(line)
                 return True
 
+        # ignore [packet:byte] counts at beginning of rules
+        remove_rule_strs = set(str(rule).split(' ', 1)[1].strip()
+                               for rule in remove_rules)
+
         def _weed_out_removes(line):
             # We need to find exact matches here
             if line.startswith(':'):
@@ -553,23 +687,18 @@ class IptablesManager(object):
                 line = line.split(':')[1]
                 line = line.split('- [')[0]
                 line = line.strip()
-                for chain in remove_chains:
-                    if chain == line:
-                        remove_chains.remove(chain)
-                        return False
+                if line in remove_chains:
+                    remove_chains.remove(line)
+                    return False
             elif line.startswith('['):
                 # it's a rule
                 # ignore [packet:byte] counts at beginning of lines
                 line = line.split(']', 1)[1]
                 line = line.strip()
-                for rule in remove_rules:
-                    # ignore [packet:byte] counts at beginning of rules
-                    rule_str = str(rule)
-                    rule_str = rule_str.split(' ', 1)[1]
-                    rule_str = rule_str.strip()
-                    if rule_str == line:
-                        remove_rules.remove(rule)
-                        return False
+                # Duplicates are already weeded out, so each rule matches
+                # at most one line
+                if line in remove_rule_strs:
+                    return False
 
             # Leave it alone
             return True
@@ -578,18 +707,66 @@ class IptablesManager(object):
         # precendence.  We also filter out anything in the "remove"
         # lists.
         new_filter.reverse()
-        new_filter = filter(_weed_out_duplicates, new_filter)
-        new_filter = filter(_weed_out_removes, new_filter)
+        new_filter = [line for line in new_filter
+                      if _weed_out_duplicates(line) and
+                      _weed_out_removes(line)]
         new_filter.reverse()
 
         # flush lists, just in case we didn't find something
         remove_chains.clear()
-        for rule in remove_rules:
-            remove_rules.remove(rule)
+        del remove_rules[:]
 
         return new_filter
 
 
+class IpsetManager(object):
+    """Wrapper for ipset.
+
+    Keeps the members of the hash:ip sets it manages, so that updating a
+    set only adds and deletes the addresses that changed.
+
+    """
+
+    def __init__(self, execute=None):
+        if not execute:
+            self.execute = _execute
+        else:
+            self.execute = execute
+
+        self.sets = {}
+
+    @utils.synchronized('ipset', external=True)
+    def set_members(self, name, family, members):
+        """Make the named set hold exactly the given addresses.
+
+        The set is created if needed. A set this manager has not seen
+        before is flushed, as it may be left over from a previous run.
+
+        """
+        members = set(members)
+        current = self.sets.get(name)
+        lines = []
+        if current is None:
+            lines.append('create %s hash:ip family %s' % (name, family))
+            lines.append('flush %s' % (name,))
+            current = set()
+        lines += ['del %s %s' % (name, address)
+                  for address in sorted(current - members)]
+        lines += ['add %s %s' % (name, address)
+                  for address in sorted(members - current)]
+        if lines:
+            self.execute('ipset', '-exist', 'restore', run_as_root=True,
+                         process_input='\n'.join(lines) + '\n')
+        self.sets[name] = members
+
+    @utils.synchronized('ipset', external=True)
+    def destroy(self, name):
+        """Destroy the named set, which must no longer be referenced."""
+        if self.sets.pop(name, None) is not None:
+            self.execute('ipset', 'destroy', name, run_as_root=True,
+                         check_exit_code=False)
+
+
 # NOTE(jkoelker) This is just a nice little stub point since mocking
 #                builtins with mox is a nightmare
 def write_to_file(file, data, mode='w'):
@@ -396,52 +396,52 @@ class NetworkManager(manager.Manager):
 
     def get_instance_uuids_by_ip_filter(self, context, filters):
         fixed_ip_filter = filters.get('fixed_ip')
-        ip_filter = re.compile(str(filters.get('ip')))
-        ipv6_filter = re.compile(str(filters.get('ip6')))
-
-        # NOTE(jkoelker) Should probably figure out a better way to do
-        #                this. But for now it "works", this could suck on
-        #                large installs.
-
-        vifs = self.db.virtual_interface_get_all(context)
+        ip_filter = None
+        if filters.get('ip') is not None:
+            ip_filter = re.compile(str(filters['ip']))
+        ipv6_filter = None
+        if filters.get('ip6') is not None:
+            ipv6_filter = re.compile(str(filters['ip6']))
+
+        # The addresses of all vifs come back from a single query. When
+        # only an exact fixed ip is asked for, it is looked up by the
+        # database instead of scanning every vif.
+        fixed_address = None
+        if ip_filter is None and ipv6_filter is None:
+            if fixed_ip_filter is None:
+                return []
+            fixed_address = fixed_ip_filter
+        vifs = self.db.virtual_interface_get_all_addresses(
+                context, fixed_address=fixed_address)
         results = []
 
         for vif in vifs:
             if vif['instance_uuid'] is None:
                 continue
 
-            network = self._get_network_by_id(context, vif['network_id'])
-            fixed_ipv6 = None
-            if network['cidr_v6'] is not None:
-                fixed_ipv6 = ipv6.to_global(network['cidr_v6'],
+            if ipv6_filter is not None and vif['cidr_v6'] is not None:
+                fixed_ipv6 = ipv6.to_global(vif['cidr_v6'],
                                             vif['address'],
                                             context.project_id)
+                if ipv6_filter.match(fixed_ipv6):
+                    results.append({'instance_uuid': vif['instance_uuid'],
+                                    'ip': fixed_ipv6})
 
-            if fixed_ipv6 and ipv6_filter.match(fixed_ipv6):
-                results.append({'instance_uuid': vif['instance_uuid'],
-                                'ip': fixed_ipv6})
-
-            vif_id = vif['id']
-            fixed_ips = self.db.fixed_ips_by_virtual_interface(context,
-                                                               vif_id)
-            for fixed_ip in fixed_ips:
-                if not fixed_ip or not fixed_ip['address']:
+            for fixed_ip in vif['fixed_ips']:
+                if not fixed_ip['address']:
                     continue
-                if fixed_ip['address'] == fixed_ip_filter:
+                if (fixed_ip['address'] == fixed_ip_filter or
+                        (ip_filter is not None and
+                         ip_filter.match(fixed_ip['address']))):
                     results.append({'instance_uuid': vif['instance_uuid'],
                                     'ip': fixed_ip['address']})
                     continue
-                if ip_filter.match(fixed_ip['address']):
-                    results.append({'instance_uuid': vif['instance_uuid'],
-                                    'ip': fixed_ip['address']})
+                if ip_filter is None:
                     continue
-                for floating_ip in fixed_ip.get('floating_ips', []):
-                    if not floating_ip or not floating_ip['address']:
-                        continue
-                    if ip_filter.match(floating_ip['address']):
+                for floating_ip in fixed_ip['floating_ips']:
+                    if floating_ip and ip_filter.match(floating_ip):
                         results.append({'instance_uuid': vif['instance_uuid'],
-                                        'ip': floating_ip['address']})
-                        continue
+                                        'ip': floating_ip})
 
         return results
 
@@ -131,6 +131,14 @@ class Scheduler(object):
         self.host_manager.update_service_capabilities(service_name,
                 host, capabilities)
 
+    def update_compute_node(self, compute_node):
+        """Process a compute node update pushed by a compute host."""
+        self.host_manager.update_compute_node(compute_node)
+
+    def get_filter_stats(self):
+        """Return the host filter statistics of the host manager."""
+        return self.host_manager.get_filter_stats()
+
     def hosts_up(self, context, topic):
         """Return the list of hosts that have a running service for topic."""
 
@@ -143,8 +151,8 @@ class Scheduler(object):
         """Return the list of hosts that have VM's from the group."""
 
         # The system_metadata 'group' will be filtered
-        members = db.instance_get_all_by_filters(context,
-                {'deleted': False, 'group': group})
+        members = db.instance_get_all_by_filters_light(context,
+                {'deleted': False, 'group': group}, ['host'])
         return [member['host']
                 for member in members
                 if member.get('host') is not None]
@@ -19,9 +19,11 @@ You can customize this scheduler by specifying your own Host Filters and
 Weighing Functions.
 """
 
+import heapq
 import random
 
 from oslo.config import cfg
+import six
 
 from nova.compute import flavors
 from nova import exception
@@ -29,6 +31,7 @@ from nova.openstack.common import log as logging
 from nova.openstack.common.notifier import api as notifier
 from nova.scheduler import driver
 from nova.scheduler import scheduler_options
+from nova.scheduler import weights
 
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
@@ -43,7 +46,15 @@ filter_scheduler_opts = [
                     'chosen from. A value of 1 chooses the '
                     'first host returned by the weighing functions. '
                     'This value must be at least 1. Any value less than 1 '
-                    'will be ignored, and 1 will be used instead')
+                    'will be ignored, and 1 will be used instead'),
+    cfg.BoolOpt('scheduler_batch_placement',
+                default=False,
+                help='When scheduling several instances in one request, '
+                     'filter and weigh the hosts once and then only '
+                     're-evaluate the host chosen for each instance, '
+                     'instead of filtering and weighing all hosts again '
+                     'for every instance. Requires weighers which weigh '
+                     'each host independently'),
 ]
 
 CONF.register_opts(filter_scheduler_opts)
@@ -340,11 +351,54 @@ class FilterScheduler(driver.Scheduler):
         # are being scanned in a filter or weighing function.
         hosts = self.host_manager.get_all_host_states(elevated)
 
-        selected_hosts = []
         if instance_uuids:
             num_instances = len(instance_uuids)
         else:
             num_instances = request_spec.get('num_instances', 1)
+        return self._select_hosts(hosts, filter_properties,
+                                  instance_properties, num_instances,
+                                  update_group_hosts)
+
+    def _can_weigh_incrementally(self, filter_properties):
+        """Return whether hosts can be filtered and weighed one at a time
+        after the resources of a chosen host were consumed, with the same
+        result as filtering and weighing all of the hosts again.
+        """
+        # Forced hosts skip filtering altogether
+        if (filter_properties.get('force_hosts') or
+                filter_properties.get('force_nodes')):
+            return False
+        # Weighers weighing all objects together can't be applied to a
+        # single host after it was chosen
+        base_weigh_objects = six.get_unbound_function(
+                weights.BaseHostWeigher.weigh_objects)
+        for weigher_cls in self.host_manager.weight_classes:
+            weigh_objects = six.get_unbound_function(
+                    weigher_cls.weigh_objects)
+            if weigh_objects is not base_weigh_objects:
+                return False
+        return True
+
+    def _get_host_subset_size(self, num_hosts):
+        scheduler_host_subset_size = CONF.scheduler_host_subset_size
+        if scheduler_host_subset_size > num_hosts:
+            scheduler_host_subset_size = num_hosts
+        if scheduler_host_subset_size < 1:
+            scheduler_host_subset_size = 1
+        return scheduler_host_subset_size
+
+    def _select_hosts(self, hosts, filter_properties, instance_properties,
+                      num_instances, update_group_hosts):
+        """Filter and weigh hosts once per instance, virtually consuming
+        the resources of each chosen host.  Returns the list of chosen
+        WeighedHosts.
+        """
+        if (CONF.scheduler_batch_placement and num_instances > 1 and
+                self._can_weigh_incrementally(filter_properties)):
+            return self._select_hosts_batch(hosts, filter_properties,
+                    instance_properties, num_instances, update_group_hosts)
+
+        selected_hosts = []
         for num in xrange(num_instances):
             # Filter local hosts based on requirements ...
             hosts = self.host_manager.get_filtered_hosts(hosts,
@@ -360,11 +414,8 @@ class FilterScheduler(driver.Scheduler):
 
             LOG.debug(_("Weighed %(hosts)s"), {'hosts': weighed_hosts})
 
-            scheduler_host_subset_size = CONF.scheduler_host_subset_size
-            if scheduler_host_subset_size > len(weighed_hosts):
-                scheduler_host_subset_size = len(weighed_hosts)
-            if scheduler_host_subset_size < 1:
-                scheduler_host_subset_size = 1
+            scheduler_host_subset_size = self._get_host_subset_size(
+                    len(weighed_hosts))
 
             chosen_host = random.choice(
                 weighed_hosts[0:scheduler_host_subset_size])
@@ -377,6 +428,99 @@ class FilterScheduler(driver.Scheduler):
                 filter_properties['group_hosts'].append(chosen_host.obj.host)
         return selected_hosts
 
+    def _select_hosts_batch(self, hosts, filter_properties,
+                            instance_properties, num_instances,
+                            update_group_hosts):
+        """Choose hosts for several instances, filtering and weighing all
+        of the hosts only once.
+
+        The passing hosts are kept in a heap ordered like the weighed host
+        list.  After each instance, only the host chosen for it, whose
+        resources were consumed, is filtered and weighed again, along with
+        the other nodes of that host when group_hosts is updated.  The hosts
+        chosen are the same as with _select_hosts' loop over all hosts.
+        """
+        hosts = self.host_manager.get_filtered_hosts(hosts,
+                filter_properties)
+        if not hosts:
+            return []
+        hosts = list(hosts)
+
+        LOG.debug(_("Filtered %(hosts)s"), {'hosts': hosts})
+
+        weighed_hosts = self.host_manager.get_weighed_hosts(hosts,
+                filter_properties)
+
+        LOG.debug(_("Weighed %(hosts)s"), {'hosts': weighed_hosts})
+
+        # Equal weights are ordered by position in the filtered host list,
+        # as the weigh handler's stable sort does
+        positions = {}
+        nodes_by_host = {}
+        for position, host_state in enumerate(hosts):
+            key = (host_state.host, host_state.nodename)
+            positions[key] = position
+            nodes_by_host.setdefault(host_state.host, []).append(key)
+
+        heap = []
+        for weighed_host in weighed_hosts:
+            host_state = weighed_host.obj
+            position = positions[(host_state.host, host_state.nodename)]
+            heap.append((-weighed_host.weight, position, weighed_host))
+        heapq.heapify(heap)
+        num_hosts = len(heap)
+        # Hosts whose filter results may have changed since they were
+        # pushed, re-filtered when they reach the top of the heap
+        stale = set()
+
+        selected_hosts = []
+        for num in xrange(num_instances):
+            scheduler_host_subset_size = self._get_host_subset_size(
+                    num_hosts)
+            best = []
+            while heap and len(best) < scheduler_host_subset_size:
+                entry = heapq.heappop(heap)
+                host_state = entry[2].obj
+                key = (host_state.host, host_state.nodename)
+                if key in stale:
+                    stale.discard(key)
+                    if not self.host_manager.get_filtered_hosts(
+                            [host_state], filter_properties):
+                        num_hosts -= 1
+                        continue
+                best.append(entry)
+            if not best:
+                # Can't get any more locally.
+                break
+
+            chosen = random.choice(best)
+            for entry in best:
+                if entry is not chosen:
+                    heapq.heappush(heap, entry)
+            chosen_host = chosen[2]
+            selected_hosts.append(chosen_host)
+
+            # Now consume the resources so the filter/weights
+            # will change for the next instance.
+            host_state = chosen_host.obj
+            host_state.consume_from_instance(instance_properties)
+            if update_group_hosts is True:
+                filter_properties['group_hosts'].append(host_state.host)
+                stale.update(nodes_by_host[host_state.host])
+            stale.discard((host_state.host, host_state.nodename))
+
+            if self.host_manager.get_filtered_hosts([host_state],
+                    filter_properties):
+                weighed_host = self.host_manager.get_weighed_hosts(
+                        [host_state], filter_properties)[0]
+                heapq.heappush(heap, (-weighed_host.weight, chosen[1],
+                                      weighed_host))
+            else:
+                num_hosts -= 1
+
+        LOG.debug(_("Selected %(hosts)s"), {'hosts': selected_hosts})
+        return selected_hosts
+
     def _assert_compute_node_has_enough_memory(self, context,
                                               instance_ref, dest):
         """Checks if destination host has enough memory for live migration.
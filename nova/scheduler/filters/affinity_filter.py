@@ -18,6 +18,7 @@
 import netaddr
 
 from nova.compute import api as compute
+from nova import db
 from nova.openstack.common import log as logging
 from nova.scheduler import filters
 
@@ -29,41 +30,62 @@ class AffinityFilter(filters.BaseHostFilter):
         self.compute_api = compute.API()
 
 
-class DifferentHostFilter(AffinityFilter):
-    '''Schedule the instance on a different host from a set of instances.'''
+class _InstanceHostsFilter(AffinityFilter):
+    """Base class for filters checking hosts against the hosts of the
+    instances listed in a scheduler hint.
 
-    def host_passes(self, host_state, filter_properties):
-        context = filter_properties['context']
-        scheduler_hints = filter_properties.get('scheduler_hints') or {}
+    A new filter object is used for each filtering pass, so the hosts are
+    looked up once per pass rather than once per host.
+    """
+
+    # Scheduler hint holding the instance uuids
+    hint_key = None
 
-        affinity_uuids = scheduler_hints.get('different_host', [])
+    def __init__(self):
+        super(_InstanceHostsFilter, self).__init__()
+        self._instance_hosts = None
+
+    def _get_instance_hosts(self, filter_properties):
+        """Return the set of hosts running the instances listed in the
+        hint, or None if the hint is not set.
+        """
+        scheduler_hints = filter_properties.get('scheduler_hints') or {}
+        affinity_uuids = scheduler_hints.get(self.hint_key, [])
         if isinstance(affinity_uuids, basestring):
             affinity_uuids = [affinity_uuids]
-        if affinity_uuids:
-            return not self.compute_api.get_all(context,
-                                                {'host': host_state.host,
-                                                 'uuid': affinity_uuids,
-                                                 'deleted': False})
+        if not affinity_uuids:
+            return None
+        if self._instance_hosts is None:
+            context = filter_properties['context']
+            self._instance_hosts = db.instance_get_hosts_by_uuids(
+                    context, affinity_uuids)
+        return self._instance_hosts
+
+
+class DifferentHostFilter(_InstanceHostsFilter):
+    '''Schedule the instance on a different host from a set of instances.'''
+
+    hint_key = 'different_host'
+
+    def host_passes(self, host_state, filter_properties):
+        instance_hosts = self._get_instance_hosts(filter_properties)
+        if instance_hosts is not None:
+            return host_state.host not in instance_hosts
         # With no different_host key
         return True
 
 
-class SameHostFilter(AffinityFilter):
+class SameHostFilter(_InstanceHostsFilter):
     '''Schedule the instance on the same host as another instance in a set of
     of instances.
     '''
 
-    def host_passes(self, host_state, filter_properties):
-        context = filter_properties['context']
-        scheduler_hints = filter_properties.get('scheduler_hints') or {}
+    hint_key = 'same_host'
 
-        affinity_uuids = scheduler_hints.get('same_host', [])
-        if isinstance(affinity_uuids, basestring):
-            affinity_uuids = [affinity_uuids]
-        if affinity_uuids:
-            return self.compute_api.get_all(context, {'host': host_state.host,
-                                                      'uuid': affinity_uuids,
-                                                      'deleted': False})
+    def host_passes(self, host_state, filter_properties):
+        instance_hosts = self._get_instance_hosts(filter_properties)
+        if instance_hosts is not None:
+            return host_state.host in instance_hosts
         # With no same_host key
         return True
 
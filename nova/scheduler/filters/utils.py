@@ -0,0 +1,33 @@
+# Copyright (c) 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Utility methods for scheduler filters."""
+
+from nova import db
+
+
+def aggregate_metadata_get_by_host(host_state, filter_properties, key=None):
+    """Return the metadata of the aggregates host_state belongs to.
+
+    The metadata is read from the aggregate metadata index of the current
+    scheduling pass, falling back to the db for host states which were not
+    loaded by the HostManager.
+    """
+    index = getattr(host_state, 'aggregate_metadata_index', None)
+    if index is not None:
+        return index.get_by_host(host_state.host, key=key)
+    context = filter_properties['context'].elevated()
+    return db.aggregate_metadata_get_by_host(context, host_state.host,
+                                             key=key)
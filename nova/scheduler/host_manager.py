@@ -17,10 +17,13 @@
 Manage hosts in the current zone.
 """
 
+import collections
+import datetime
 import UserDict
 
 from oslo.config import cfg
 
+from nova.compute import cached_images
 from nova.compute import task_states
 from nova.compute import vm_states
 from nova import db
@@ -51,13 +54,41 @@ host_manager_opts = [
     cfg.ListOpt('scheduler_weight_classes',
                 default=['nova.scheduler.weights.all_weighers'],
                 help='Which weight class names to use for weighing hosts'),
+    cfg.BoolOpt('scheduler_host_state_cache',
+                default=False,
+                help='Keep a resident cache of host states which is only '
+                     'refreshed from compute nodes updated since the last '
+                     'sync, instead of reloading every compute node for '
+                     'each scheduling request'),
+    cfg.IntOpt('scheduler_host_state_full_sync_interval',
+               default=300,
+               help='Number of seconds between full resyncs of the host '
+                    'state cache. Only used if scheduler_host_state_cache '
+                    'is enabled'),
+    cfg.IntOpt('scheduler_filter_stats_window',
+               default=100,
+               help='Number of recent runs of each filter class to keep '
+                    'wall time and rejection statistics for. 0 disables '
+                    'filter statistics'),
+    cfg.BoolOpt('scheduler_reorder_filters',
+                default=False,
+                help='Run filters in order of their measured cost per '
+                     'rejected host, so that cheap and selective filters '
+                     'run first, instead of in the configured order. '
+                     'Requires scheduler_filter_stats_window'),
     ]
 
 CONF = cfg.CONF
 CONF.register_opts(host_manager_opts)
+CONF.import_opt('compute_topic', 'nova.compute.rpcapi')
 
 LOG = logging.getLogger(__name__)
 
+# Incremental host state syncs look back this many seconds past the previous
+# sync, so that rows committed late by a slow transaction are not missed.
+# HostState.update_from_compute_node() ignores rows it has already seen.
+HOST_STATE_SYNC_OVERLAP = 5
+
 
 class ReadOnlyDict(UserDict.IterableUserDict):
     """A read-only dict."""
@@ -91,6 +122,92 @@ class ReadOnlyDict(UserDict.IterableUserDict):
             raise TypeError()
 
 
+class AggregateMetadataIndex(object):
+    """Metadata of all host aggregates, indexed by host.
+
+    The index is loaded with a single query the first time it is used, so
+    that aggregate aware filters don't query the db once per host, and
+    scheduling passes without such filters don't query it at all.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self._metadata = None
+
+    def get_by_host(self, host, key=None):
+        """Return the metadata of the aggregates host belongs to, in the
+        form returned by db.aggregate_metadata_get_by_host().
+        """
+        if self._metadata is None:
+            self._metadata = db.aggregate_metadata_get_all_by_host(
+                    self.context)
+        metadata = self._metadata.get(host, {})
+        if key is None:
+            return metadata
+        if key in metadata:
+            return {key: metadata[key]}
+        return {}
+
+
+class FilterStatistics(object):
+    """Rolling wall time and rejection statistics of filter classes.
+
+    A window of the most recent runs is kept per filter class, each run
+    being the number of hosts the filter was given, the number it rejected
+    and the time it took.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._runs = {}
+
+    def record(self, filter_cls, num_hosts, num_passed, elapsed):
+        if self.window <= 0:
+            return
+        runs = self._runs.get(filter_cls.__name__)
+        if runs is None:
+            runs = collections.deque(maxlen=self.window)
+            self._runs[filter_cls.__name__] = runs
+        runs.append((num_hosts, num_hosts - num_passed, elapsed))
+
+    def get_stats(self):
+        """Return a dict of statistics by filter class name."""
+        stats = {}
+        for cls_name, runs in self._runs.iteritems():
+            hosts = sum(run[0] for run in runs)
+            rejected = sum(run[1] for run in runs)
+            elapsed = sum(run[2] for run in runs)
+            stats[cls_name] = {
+                'runs': len(runs),
+                'hosts': hosts,
+                'rejected': rejected,
+                'rejection_rate': float(rejected) / hosts if hosts else 0.0,
+                'time': elapsed,
+                'time_per_host': elapsed / hosts if hosts else 0.0,
+            }
+        return stats
+
+    def order(self, filter_classes):
+        """Sort filter classes by their time per rejected host, so that
+        cheap filters rejecting many hosts run first.
+
+        Filters without statistics yet run first so that they get some,
+        and filters which never rejected a host run last.  Ties keep the
+        given order.
+        """
+        stats = self.get_stats()
+
+        def _cost(filter_cls):
+            cls_stats = stats.get(filter_cls.__name__)
+            if not cls_stats or not cls_stats['hosts']:
+                return 0.0
+            if not cls_stats['rejected']:
+                return float('inf')
+            return cls_stats['time'] / cls_stats['rejected']
+
+        return sorted(filter_classes, key=_cost)
+
+
 class HostState(object):
     """Mutable and immutable information tracked for a host.
     This is an attempt to remove the ad-hoc data structures
@@ -123,10 +240,17 @@ class HostState(object):
         self.num_instances_by_project = {}
         self.num_instances_by_os_type = {}
         self.num_io_ops = 0
+        # CachedImages bloom filter of the images cached on the host, None
+        # if the host does not report them
+        self.cached_images = None
 
         # Resource oversubscription values for the compute host:
         self.limits = {}
 
+        # AggregateMetadataIndex of the current scheduling pass, set by
+        # HostManager.get_all_host_states()
+        self.aggregate_metadata_index = None
+
         self.updated = None
 
     def update_capabilities(self, capabilities=None, service=None):
@@ -196,6 +320,15 @@ class HostState(object):
 
         self.num_io_ops = int(statmap.get('io_workload', 0))
 
+        self.cached_images = None
+        if cached_images.STAT_KEY in statmap:
+            try:
+                self.cached_images = cached_images.CachedImages.decode(
+                        statmap[cached_images.STAT_KEY])
+            except ValueError:
+                LOG.warn(_('Ignoring invalid cached images of host %s'),
+                         self.host)
+
     def consume_from_instance(self, instance):
         """Incrementally update host state from an instance."""
         disk_mb = (instance['root_gb'] + instance['ephemeral_gb']) * 1024
@@ -260,7 +393,14 @@ class HostManager(object):
         # { (host, hypervisor_hostname) : { <service> : { cap k : v }}}
         self.service_states = {}
         self.host_state_map = {}
+        # { compute_node_id : (host, hypervisor_hostname) }, used to find
+        # the cached host state of compute nodes deleted between syncs
+        self.compute_node_keys = {}
+        self.last_sync = None
+        self.last_full_sync = None
         self.filter_handler = filters.HostFilterHandler()
+        self.filter_stats = FilterStatistics(
+                CONF.scheduler_filter_stats_window)
         self.filter_classes = self.filter_handler.get_matching_classes(
                 CONF.scheduler_available_filters)
         self.weight_handler = weights.HostWeightHandler()
@@ -341,6 +481,8 @@ class HostManager(object):
             LOG.debug(msg % forced_nodes_str)
 
         filter_classes = self._choose_host_filters(filter_class_names)
+        if CONF.scheduler_reorder_filters:
+            filter_classes = self.filter_stats.order(filter_classes)
         ignore_hosts = filter_properties.get('ignore_hosts', [])
         force_hosts = filter_properties.get('force_hosts', [])
         force_nodes = filter_properties.get('force_nodes', [])
@@ -365,7 +507,13 @@ class HostManager(object):
             hosts = name_to_cls_map.itervalues()
 
         return self.filter_handler.get_filtered_objects(filter_classes,
-                hosts, filter_properties)
+                hosts, filter_properties, filter_stats=self.filter_stats)
+
+    def get_filter_stats(self):
+        """Return the wall time and rejection statistics of the filters
+        over their recent runs, by filter class name.
+        """
+        return self.filter_stats.get_stats()
 
     def get_weighed_hosts(self, hosts, weight_properties):
         """Weigh the hosts."""
@@ -388,35 +536,122 @@ class HostManager(object):
         capab_copy["timestamp"] = timeutils.utcnow()  # Reported time
         self.service_states[state_key] = capab_copy
 
+    def update_compute_node(self, compute):
+        """Update the cached host state from a compute node pushed by a
+        compute host's resource tracker.
+        """
+        if not CONF.scheduler_host_state_cache:
+            return
+        if compute.get('deleted'):
+            self._remove_compute_node(compute['id'])
+            return
+        compute = dict(compute)
+        if isinstance(compute.get('updated_at'), basestring):
+            compute['updated_at'] = timeutils.parse_strtime(
+                    compute['updated_at'])
+        self._update_host_state_from_compute_node(compute)
+
+    def _update_host_state_from_compute_node(self, compute):
+        """Create or update the HostState for a compute node.  Returns the
+        (host, node) key of the host state, or None if the compute node has
+        no service.
+        """
+        service = compute['service']
+        if not service:
+            LOG.warn(_("No service for compute ID %s") % compute['id'])
+            return None
+        host = service['host']
+        node = compute.get('hypervisor_hostname')
+        state_key = (host, node)
+        capabilities = self.service_states.get(state_key, None)
+        host_state = self.host_state_map.get(state_key)
+        if host_state:
+            host_state.update_capabilities(capabilities,
+                                           dict(service.iteritems()))
+        else:
+            host_state = self.host_state_cls(host, node,
+                    capabilities=capabilities,
+                    service=dict(service.iteritems()))
+            self.host_state_map[state_key] = host_state
+        host_state.update_from_compute_node(compute)
+        self.compute_node_keys[compute['id']] = state_key
+        return state_key
+
+    def _remove_compute_node(self, compute_id):
+        state_key = self.compute_node_keys.pop(compute_id, None)
+        if state_key and self.host_state_map.pop(state_key, None):
+            host, node = state_key
+            LOG.info(_("Removing deleted compute node %(host)s:%(node)s "
+                       "from scheduler") % {'host': host, 'node': node})
+
+    def _full_sync_due(self, now):
+        if self.last_full_sync is None:
+            return True
+        interval = datetime.timedelta(
+                seconds=CONF.scheduler_host_state_full_sync_interval)
+        return now - self.last_full_sync >= interval
+
+    def _sync_host_states(self, context):
+        """Apply compute nodes changed since the last sync to the cached
+        host states, and refresh the cached service records so that service
+        liveness stays current.
+        """
+        since = self.last_sync - datetime.timedelta(
+                seconds=HOST_STATE_SYNC_OVERLAP)
+        compute_nodes = db.compute_node_get_all_updated_since(context, since)
+        for compute in compute_nodes:
+            if compute['deleted']:
+                self._remove_compute_node(compute['id'])
+            else:
+                self._update_host_state_from_compute_node(compute)
+
+        services = dict((service['host'], service)
+                        for service in db.service_get_all(context)
+                        if service['topic'] == CONF.compute_topic)
+        for (host, node), host_state in self.host_state_map.items():
+            service = services.get(host)
+            if not service:
+                continue
+            capabilities = self.service_states.get((host, node), None)
+            host_state.update_capabilities(capabilities,
+                                           dict(service.iteritems()))
+
     def get_all_host_states(self, context):
         """Returns a list of HostStates that represents all the hosts
         the HostManager knows about. Also, each of the consumable resources
         in HostState are pre-populated and adjusted based on data in the db.
+
+        If scheduler_host_state_cache is enabled, only compute nodes which
+        changed since the last call are loaded, except every
+        scheduler_host_state_full_sync_interval seconds when all of them are.
         """
+        if not CONF.scheduler_host_state_cache:
+            self._get_all_host_states(context)
+        else:
+            now = timeutils.utcnow()
+            if self._full_sync_due(now):
+                self._get_all_host_states(context)
+                self.last_full_sync = now
+            else:
+                self._sync_host_states(context)
+            self.last_sync = now
+
+        aggregate_metadata_index = AggregateMetadataIndex(context)
+        for host_state in self.host_state_map.itervalues():
+            host_state.aggregate_metadata_index = aggregate_metadata_index
+        return self.host_state_map.itervalues()
+
+    def _get_all_host_states(self, context):
+        """Reload the host states of all compute nodes from the db."""
 
         # Get resource usage across the available compute nodes:
         compute_nodes = db.compute_node_get_all(context)
         seen_nodes = set()
+        self.compute_node_keys = {}
         for compute in compute_nodes:
-            service = compute['service']
-            if not service:
-                LOG.warn(_("No service for compute ID %s") % compute['id'])
-                continue
-            host = service['host']
-            node = compute.get('hypervisor_hostname')
-            state_key = (host, node)
-            capabilities = self.service_states.get(state_key, None)
-            host_state = self.host_state_map.get(state_key)
-            if host_state:
-                host_state.update_capabilities(capabilities,
-                                               dict(service.iteritems()))
-            else:
-                host_state = self.host_state_cls(host, node,
-                        capabilities=capabilities,
-                        service=dict(service.iteritems()))
-                self.host_state_map[state_key] = host_state
-            host_state.update_from_compute_node(compute)
-            seen_nodes.add(state_key)
+            state_key = self._update_host_state_from_compute_node(compute)
+            if state_key:
+                seen_nodes.add(state_key)
 
         # remove compute nodes from host_state_map if they are not active
         dead_nodes = set(self.host_state_map.keys()) - seen_nodes
@@ -425,5 +660,3 @@ class HostManager(object):
             LOG.info(_("Removing dead compute node %(host)s:%(node)s "
                        "from scheduler") % locals())
             del self.host_state_map[state_key]
-
-        return self.host_state_map.itervalues()
@@ -59,7 +59,7 @@ QUOTAS = quota.QUOTAS
 class SchedulerManager(manager.Manager):
     """Chooses a host to run instances on."""
 
-    RPC_API_VERSION = '2.6'
+    RPC_API_VERSION = '2.8'
 
     def __init__(self, scheduler_driver=None, *args, **kwargs):
         if not scheduler_driver:
@@ -86,6 +86,10 @@ class SchedulerManager(manager.Manager):
             self.driver.update_service_capabilities(service_name, host,
                                                     capability)
 
+    def update_compute_node(self, context, compute_node):
+        """Process a compute node update pushed by a compute host."""
+        self.driver.update_compute_node(compute_node)
+
     def create_volume(self, context, volume_id, snapshot_id,
                       reservations=None, image_id=None):
         #function removed in RPC API 2.3
@@ -315,3 +319,9 @@ class SchedulerManager(manager.Manager):
         hosts = self.driver.select_hosts(context, request_spec,
             filter_properties)
         return jsonutils.to_primitive(hosts)
+
+    def get_filter_stats(self, context):
+        """Returns the recent wall time and rejection statistics of the
+        host filters, by filter class name.
+        """
+        return self.driver.get_filter_stats()
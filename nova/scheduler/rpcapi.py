@@ -58,6 +58,8 @@ class SchedulerAPI(nova.openstack.common.rpc.proxy.RpcProxy):
                 - accepts a list of capabilities
         2.5 - Add get_backdoor_port()
         2.6 - Add select_hosts()
+        2.7 - Add update_compute_node()
+        2.8 - Add get_filter_stats()
     '''
 
     #
@@ -113,8 +115,18 @@ class SchedulerAPI(nova.openstack.common.rpc.proxy.RpcProxy):
                 capabilities=capabilities),
                 version='2.4')
 
+    def update_compute_node(self, ctxt, compute_node):
+        compute_node_p = jsonutils.to_primitive(compute_node)
+        self.fanout_cast(ctxt, self.make_msg('update_compute_node',
+                compute_node=compute_node_p),
+                version='2.7')
+
     def select_hosts(self, ctxt, request_spec, filter_properties):
         return self.call(ctxt, self.make_msg('select_hosts',
                 request_spec=request_spec,
                 filter_properties=filter_properties),
                 version='2.6')
+
+    def get_filter_stats(self, ctxt):
+        return self.call(ctxt, self.make_msg('get_filter_stats'),
+                version='2.8')
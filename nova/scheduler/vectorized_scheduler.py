@@ -0,0 +1,248 @@
+# Copyright (c) 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+A FilterScheduler which evaluates the simple resource filters and weighers
+over NumPy arrays of host resources.
+
+The RamFilter, CoreFilter, DiskFilter, IoOpsFilter and NumInstancesFilter
+and the RAMWeigher are evaluated as array operations over all hosts.  Any
+other configured filters and weighers run once per host.  When placing
+several instances, only the host chosen for the previous instance has its
+resources consumed, so only that host is re-evaluated instead of filtering
+and weighing the whole host list again.
+
+NumPy is required to use this scheduler.
+"""
+
+import random
+
+from oslo.config import cfg
+
+from nova.openstack.common import importutils
+from nova.openstack.common import log as logging
+from nova.scheduler import filter_scheduler
+from nova.scheduler import weights
+from nova.scheduler.weights import ram
+
+numpy = importutils.try_import('numpy')
+
+CONF = cfg.CONF
+CONF.import_opt('ram_allocation_ratio', 'nova.scheduler.filters.ram_filter')
+CONF.import_opt('cpu_allocation_ratio', 'nova.scheduler.filters.core_filter')
+CONF.import_opt('disk_allocation_ratio',
+                'nova.scheduler.filters.disk_filter')
+CONF.import_opt('max_io_ops_per_host', 'nova.scheduler.filters.io_ops_filter')
+CONF.import_opt('max_instances_per_host',
+                'nova.scheduler.filters.num_instances_filter')
+
+LOG = logging.getLogger(__name__)
+
+# HostState attributes loaded into the resource arrays
+HOST_RESOURCES = ('free_ram_mb', 'total_usable_ram_mb', 'free_disk_mb',
+                  'total_usable_disk_gb', 'vcpus_total', 'vcpus_used',
+                  'num_io_ops', 'num_instances')
+
+
+def _ram_filter(res, instance_type):
+    memory_mb_limit = res['total_usable_ram_mb'] * CONF.ram_allocation_ratio
+    used_ram_mb = res['total_usable_ram_mb'] - res['free_ram_mb']
+    return memory_mb_limit - used_ram_mb >= instance_type['memory_mb']
+
+
+def _core_filter(res, instance_type):
+    vcpus_total = res['vcpus_total'] * CONF.cpu_allocation_ratio
+    enough = vcpus_total - res['vcpus_used'] >= instance_type['vcpus']
+    # Hosts not reporting VCPUs always pass, as in CoreFilter
+    return numpy.logical_or(enough, res['vcpus_total'] == 0)
+
+
+def _disk_filter(res, instance_type):
+    requested_disk = 1024 * (instance_type['root_gb'] +
+                             instance_type['ephemeral_gb'])
+    total_usable_disk_mb = res['total_usable_disk_gb'] * 1024
+    disk_mb_limit = total_usable_disk_mb * CONF.disk_allocation_ratio
+    used_disk_mb = total_usable_disk_mb - res['free_disk_mb']
+    return disk_mb_limit - used_disk_mb >= requested_disk
+
+
+def _io_ops_filter(res, instance_type):
+    return res['num_io_ops'] < CONF.max_io_ops_per_host
+
+
+def _num_instances_filter(res, instance_type):
+    return res['num_instances'] < CONF.max_instances_per_host
+
+
+# Filter class name : function returning the mask of hosts passing it
+VECTORIZED_FILTERS = {
+    'RamFilter': _ram_filter,
+    'CoreFilter': _core_filter,
+    'DiskFilter': _disk_filter,
+    'IoOpsFilter': _io_ops_filter,
+    'NumInstancesFilter': _num_instances_filter,
+}
+
+# Weigher class : HostState attribute it weighs by
+VECTORIZED_WEIGHERS = {
+    ram.RAMWeigher: 'free_ram_mb',
+}
+
+
+class HostResourceArrays(object):
+    """Resources of a list of hosts, one NumPy array per HostState
+    attribute in HOST_RESOURCES.
+    """
+
+    def __init__(self, hosts):
+        self.hosts = hosts
+        self.resources = dict(
+                (attr, numpy.array([getattr(host, attr, 0) or 0
+                                    for host in hosts], dtype=float))
+                for attr in HOST_RESOURCES)
+
+    def update(self, index):
+        """Reload the resources of the host at index from its HostState."""
+        host = self.hosts[index]
+        for attr in HOST_RESOURCES:
+            self.resources[attr][index] = getattr(host, attr, 0) or 0
+
+
+class VectorizedFilterScheduler(filter_scheduler.FilterScheduler):
+    """FilterScheduler evaluating resource filters and weighers as array
+    operations.
+    """
+
+    def __init__(self, *args, **kwargs):
+        if numpy is None:
+            raise ImportError('numpy module not found')
+        super(VectorizedFilterScheduler, self).__init__(*args, **kwargs)
+
+    def _can_vectorize(self, filter_properties):
+        if not filter_properties.get('instance_type'):
+            return False
+        return self._can_weigh_incrementally(filter_properties)
+
+    def _weigh_host(self, weighers, host_state, weight_properties):
+        return sum(weigher._weight_multiplier() *
+                   weigher._weigh_object(host_state, weight_properties)
+                   for weigher in weighers)
+
+    def _set_limits(self, host_state, filter_names):
+        """Set the oversubscription limits the vectorized filters would
+        have set on a host passing them.
+        """
+        if 'RamFilter' in filter_names:
+            host_state.limits['memory_mb'] = (host_state.total_usable_ram_mb *
+                                              CONF.ram_allocation_ratio)
+        if 'DiskFilter' in filter_names:
+            disk_mb_limit = (host_state.total_usable_disk_gb * 1024 *
+                             CONF.disk_allocation_ratio)
+            host_state.limits['disk_gb'] = disk_mb_limit / 1024
+        if 'CoreFilter' in filter_names:
+            vcpus_total = host_state.vcpus_total * CONF.cpu_allocation_ratio
+            if vcpus_total > 0:
+                host_state.limits['vcpu'] = vcpus_total
+
+    def _select_hosts(self, hosts, filter_properties, instance_properties,
+                      num_instances, update_group_hosts):
+        if not self._can_vectorize(filter_properties):
+            return super(VectorizedFilterScheduler, self)._select_hosts(
+                    hosts, filter_properties, instance_properties,
+                    num_instances, update_group_hosts)
+
+        filter_names = CONF.scheduler_default_filters
+        vector_filters = [VECTORIZED_FILTERS[name] for name in filter_names
+                          if name in VECTORIZED_FILTERS]
+        object_filter_names = [name for name in filter_names
+                               if name not in VECTORIZED_FILTERS]
+        vector_weighers = []
+        object_weighers = []
+        for weigher_cls in self.host_manager.weight_classes:
+            if weigher_cls in VECTORIZED_WEIGHERS:
+                vector_weighers.append(weigher_cls())
+            else:
+                object_weighers.append(weigher_cls())
+
+        # The object filters also take care of ignore_hosts
+        hosts = self.host_manager.get_filtered_hosts(hosts,
+                filter_properties, object_filter_names)
+        if not hosts:
+            return []
+        hosts = list(hosts)
+        arrays = HostResourceArrays(hosts)
+        res = arrays.resources
+        instance_type = filter_properties['instance_type']
+
+        nodes_by_host = {}
+        for index, host_state in enumerate(hosts):
+            nodes_by_host.setdefault(host_state.host, []).append(index)
+
+        passes = numpy.ones(len(hosts), dtype=bool)
+        object_weights = numpy.array([self._weigh_host(object_weighers,
+                                                       host, filter_properties)
+                                      for host in hosts], dtype=float)
+
+        selected_hosts = []
+        for num in xrange(num_instances):
+            for vector_filter in vector_filters:
+                passes &= vector_filter(res, instance_type)
+            candidates = numpy.flatnonzero(passes)
+            if not len(candidates):
+                break
+
+            host_weights = object_weights[candidates].copy()
+            for weigher in vector_weighers:
+                attr = VECTORIZED_WEIGHERS[weigher.__class__]
+                host_weights += (weigher._weight_multiplier() *
+                                 res[attr][candidates])
+
+            subset_size = self._get_host_subset_size(len(candidates))
+            if subset_size == 1:
+                best = [numpy.argmax(host_weights)]
+            else:
+                # Stable sort, so that ties keep the host order as the
+                # weight handler's sort does
+                order = numpy.argsort(-host_weights, kind='mergesort')
+                best = order[:subset_size]
+            chosen = random.choice(best)
+            index = candidates[chosen]
+            host_state = hosts[index]
+            self._set_limits(host_state, filter_names)
+            weighed_host = weights.WeighedHost(host_state,
+                                               float(host_weights[chosen]))
+            selected_hosts.append(weighed_host)
+
+            # Only the chosen node's resources change, but group_hosts
+            # names hosts, which affects every node of the chosen host.
+            # So all of them are run through the filters and weighers
+            # again.
+            host_state.consume_from_instance(instance_properties)
+            if update_group_hosts is True:
+                filter_properties['group_hosts'].append(host_state.host)
+            arrays.update(index)
+            node_indexes = nodes_by_host[host_state.host]
+            node_states = [hosts[i] for i in node_indexes]
+            filtered = self.host_manager.get_filtered_hosts(node_states,
+                    filter_properties, object_filter_names)
+            filtered_ids = set(id(node) for node in filtered)
+            for i, node in zip(node_indexes, node_states):
+                if id(node) not in filtered_ids:
+                    passes[i] = False
+                object_weights[i] = self._weigh_host(object_weighers,
+                        node, filter_properties)
+
+        LOG.debug(_("Selected %(hosts)s"), {'hosts': selected_hosts})
+        return selected_hosts
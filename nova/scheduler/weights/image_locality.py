@@ -0,0 +1,60 @@
+# Copyright (c) 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Image Locality Weigher.  Weigh hosts by whether their local image cache
+already holds the image of the instance being scheduled.
+
+Hosts report their cached images as a bloom filter, so now and then a host
+gets the weight without holding the image.  The weight is added to the
+others, such as the free RAM in MB the RAMWeigher weighs by, so the
+'image_locality_weight_multiplier' option is how much free RAM in MB a host
+holding the image is worth.  It is 0 by default, which disables the
+weigher.
+"""
+
+from oslo.config import cfg
+
+from nova.compute import cached_images
+from nova.scheduler import weights
+
+image_locality_weight_opts = [
+        cfg.FloatOpt('image_locality_weight_multiplier',
+                     default=0.0,
+                     help='Weight of hosts which already cache the image of '
+                          'an instance, in units of the RAMWeigher (MB of '
+                          'free RAM).  0 disables the weigher.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(image_locality_weight_opts)
+
+
+class ImageLocalityWeigher(weights.BaseHostWeigher):
+    def _weight_multiplier(self):
+        """Override the weight multiplier."""
+        return CONF.image_locality_weight_multiplier
+
+    def _weigh_object(self, host_state, weight_properties):
+        """1 for hosts which cache the requested image, 0 otherwise."""
+        if host_state.cached_images is None:
+            return 0
+        request_spec = weight_properties.get('request_spec') or {}
+        instance_properties = request_spec.get('instance_properties') or {}
+        image_ref = instance_properties.get('image_ref')
+        if not image_ref:
+            return 0
+        if cached_images.fingerprint(image_ref) in host_state.cached_images:
+            return 1
+        return 0
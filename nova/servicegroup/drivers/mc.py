@@ -21,8 +21,8 @@ from oslo.config import cfg
 
 from nova import conductor
 from nova import context
+from nova import memorycache
 from nova.openstack.common import log as logging
-from nova.openstack.common import memorycache
 from nova.openstack.common import timeutils
 from nova.servicegroup import api
 
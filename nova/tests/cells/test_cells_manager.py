@@ -18,11 +18,13 @@ Tests For CellsManager
 import copy
 import datetime
 
+import mox
 from oslo.config import cfg
 
 from nova.cells import messaging
 from nova.cells import utils as cells_utils
 from nova import context
+from nova import exception
 from nova.openstack.common import rpc
 from nova.openstack.common import timeutils
 from nova import test
@@ -157,6 +159,49 @@ class CellsManagerClassTestCase(test.TestCase):
         self.cells_manager.instance_update_at_top(self.ctxt,
                                                   instance='fake-instance')
 
+    def test_instance_update_at_top_coalesced(self):
+        self.flags(instance_update_coalesce_window=1, group='cells')
+        self.mox.StubOutWithMock(self.msg_runner, 'instance_update_at_top')
+        self.mox.StubOutWithMock(self.msg_runner,
+                                 'instance_update_batch_at_top')
+        self.mox.StubOutWithMock(context, 'get_admin_context')
+
+        context.get_admin_context().AndReturn(self.ctxt)
+        self.msg_runner.instance_update_batch_at_top(self.ctxt,
+                [{'uuid': 'uuid1', 'vm_state': 'active', 'host': 'fake'}])
+        context.get_admin_context().AndReturn(self.ctxt)
+        self.msg_runner.instance_update_batch_at_top(self.ctxt,
+                [{'uuid': 'uuid1', 'task_state': 'rebooting'}])
+        self.mox.ReplayAll()
+
+        self.cells_manager.instance_update_at_top(self.ctxt,
+                dict(uuid='uuid1', vm_state='building', host='fake'))
+        self.cells_manager.instance_update_at_top(self.ctxt,
+                dict(uuid='uuid1', vm_state='active'))
+        self.cells_manager._flush_instance_updates()
+        # Nothing changed, nothing to send
+        self.cells_manager.instance_update_at_top(self.ctxt,
+                dict(uuid='uuid1', vm_state='active', host='fake'))
+        self.cells_manager._flush_instance_updates()
+        self.cells_manager.instance_update_at_top(self.ctxt,
+                dict(uuid='uuid1', vm_state='active', task_state='rebooting'))
+        self.cells_manager._flush_instance_updates()
+        self.cells_manager._flush_instance_updates()
+
+    def test_instance_destroy_at_top_drops_buffered_update(self):
+        self.flags(instance_update_coalesce_window=1, group='cells')
+        instance = dict(uuid='uuid1', vm_state='active')
+        self.mox.StubOutWithMock(self.msg_runner, 'instance_destroy_at_top')
+        self.mox.StubOutWithMock(self.msg_runner,
+                                 'instance_update_batch_at_top')
+        self.msg_runner.instance_destroy_at_top(self.ctxt, instance)
+        self.mox.ReplayAll()
+
+        self.cells_manager.instance_update_at_top(self.ctxt, instance)
+        self.cells_manager.instance_destroy_at_top(self.ctxt, instance)
+        self.cells_manager._flush_instance_updates()
+        self.assertEqual({}, self.cells_manager.sent_instance_updates)
+
     def test_instance_destroy_at_top(self):
         self.mox.StubOutWithMock(self.msg_runner, 'instance_destroy_at_top')
         self.msg_runner.instance_destroy_at_top(self.ctxt, 'fake-instance')
@@ -205,51 +250,155 @@ class CellsManagerClassTestCase(test.TestCase):
         def utcnow():
             return stalled_time
 
-        call_info = {'get_instances': 0, 'sync_instances': []}
+        call_info = {'watermarks': [], 'sync_instances': []}
 
-        instances = ['instance1', 'instance2', 'instance3']
+        instances = [dict(id=i, updated_at=stalled_time, deleted=False)
+                     for i in xrange(1, 4)]
 
-        def get_instances_to_sync(context, **kwargs):
-            self.assertEqual(context, fake_context)
-            call_info['shuffle'] = kwargs.get('shuffle')
-            call_info['project_id'] = kwargs.get('project_id')
-            call_info['updated_since'] = kwargs.get('updated_since')
-            call_info['get_instances'] += 1
-            return iter(instances)
-
-        def instance_get_by_uuid(context, uuid):
-            return instances[int(uuid[-1]) - 1]
+        def instance_get_all_after_watermark(context, watermark, limit):
+            self.assertEqual('yes', context.read_deleted)
+            self.assertEqual(2, limit)
+            call_info['watermarks'].append(watermark)
+            return [instance for instance in instances
+                    if instance['id'] > watermark[1]][:limit]
 
         def sync_instance(context, instance):
             self.assertEqual(context, fake_context)
             call_info['sync_instances'].append(instance)
 
-        self.stubs.Set(cells_utils, 'get_instances_to_sync',
-                get_instances_to_sync)
-        self.stubs.Set(self.cells_manager.db, 'instance_get_by_uuid',
-                instance_get_by_uuid)
+        self.stubs.Set(self.cells_manager.db,
+                'instance_get_all_after_watermark',
+                instance_get_all_after_watermark)
         self.stubs.Set(self.cells_manager, '_sync_instance',
                 sync_instance)
         self.stubs.Set(timeutils, 'utcnow', utcnow)
 
         self.cells_manager._heal_instances(fake_context)
-        self.assertEqual(call_info['shuffle'], True)
-        self.assertEqual(call_info['project_id'], None)
-        self.assertEqual(call_info['updated_since'], updated_since)
-        self.assertEqual(call_info['get_instances'], 1)
+        self.assertEqual([(updated_since, 0)], call_info['watermarks'])
         # Only first 2
-        self.assertEqual(call_info['sync_instances'],
-                instances[:2])
+        self.assertEqual(instances[:2], call_info['sync_instances'])
+
+        call_info['sync_instances'] = []
+        self.cells_manager._heal_instances(fake_context)
+        self.assertEqual((stalled_time, 2), call_info['watermarks'][-1])
+        # Only the ones after the watermark
+        self.assertEqual(instances[2:], call_info['sync_instances'])
 
         call_info['sync_instances'] = []
         self.cells_manager._heal_instances(fake_context)
-        self.assertEqual(call_info['shuffle'], True)
-        self.assertEqual(call_info['project_id'], None)
-        self.assertEqual(call_info['updated_since'], updated_since)
-        self.assertEqual(call_info['get_instances'], 2)
-        # Now the last 1 and the first 1
-        self.assertEqual(call_info['sync_instances'],
-                [instances[-1], instances[0]])
+        self.assertEqual((stalled_time, 3), call_info['watermarks'][-1])
+        self.assertEqual([], call_info['sync_instances'])
+
+    def _heal_lost_update(self):
+        self.flags(instance_updated_at_threshold=1000,
+                   instance_update_num_instances=1,
+                   group='cells')
+
+        fake_context = context.RequestContext('fake', 'fake')
+        stalled_time = timeutils.utcnow()
+        instance = dict(id=1, uuid='fake-uuid', updated_at=stalled_time,
+                        deleted=False)
+        sent_updates = []
+
+        def instance_get_all_after_watermark(context, watermark, limit):
+            return [i for i in [instance] if i['id'] > watermark[1]]
+
+        def instance_update_at_top(context, instance):
+            sent_updates.append(instance)
+
+        self.stubs.Set(self.cells_manager.db,
+                'instance_get_all_after_watermark',
+                instance_get_all_after_watermark)
+        self.stubs.Set(self.msg_runner, 'instance_update_at_top',
+                instance_update_at_top)
+        self.stubs.Set(timeutils, 'utcnow', lambda: stalled_time)
+
+        # The update sent on the first run is lost on its way to the
+        # parent cell, and we caught up with the watermark on the second
+        for i in xrange(4):
+            self.cells_manager._heal_instances(fake_context)
+        return sent_updates, instance
+
+    def test_heal_instances_lost_update(self):
+        # Nothing compares digests by default, so the instance is healed
+        # by sending it again
+        sent_updates, instance = self._heal_lost_update()
+        self.assertEqual([instance, instance], sent_updates)
+
+    def test_heal_instances_lost_update_with_digest(self):
+        # The top level cell finds the lost update by comparing digests
+        self.flags(instance_digest_interval=60, group='cells')
+        sent_updates, instance = self._heal_lost_update()
+        self.assertEqual([instance], sent_updates)
+
+    def test_verify_child_instances(self):
+        self.flags(instance_digest_interval=60, name='api-cell', group='cells')
+        cells_manager = fakes.get_cells_manager('api-cell')
+        msg_runner = cells_manager.msg_runner
+        child_cell = cells_manager.state_manager.get_child_cell('child-cell1')
+        now = timeutils.utcnow().replace(microsecond=0)
+        old = now - datetime.timedelta(seconds=3600)
+        updated_before = timeutils.isotime(
+                now - datetime.timedelta(seconds=60))
+        cell_name = 'api-cell!child-cell1'
+        our_instances = [
+                dict(uuid='aa-same', updated_at=old, cell_name=cell_name),
+                dict(uuid='ab-stale', updated_at=old, cell_name=cell_name),
+                dict(uuid='ab-gone', updated_at=old, cell_name=cell_name),
+                # The child cell doesn't store its own child's instances
+                dict(uuid='af-grandchild', updated_at=old,
+                     cell_name=cell_name + '!grandchild'),
+                dict(uuid='ac-new', updated_at=now, cell_name=cell_name),
+                dict(uuid='ad-other', updated_at=old,
+                     cell_name='api-cell!child-cell2')]
+        their_entries = {
+                'aa': [('aa-same', old)],
+                'ab': [('ab-stale', now - datetime.timedelta(seconds=61))],
+                'ae': [('ae-missing', None)]}
+        their_digest = cells_utils.get_instances_digest(
+                dict((bucket, [(uuid, updated_at and
+                                timeutils.strtime(updated_at,
+                                                  '%Y-%m-%dT%H:%M:%S'))
+                               for uuid, updated_at in entries])
+                     for bucket, entries in their_entries.iteritems()))
+        their_primitive_entries = {
+                'ab': [['ab-stale', timeutils.strtime(
+                        now - datetime.timedelta(seconds=61),
+                        '%Y-%m-%dT%H:%M:%S')]],
+                'ae': [['ae-missing', None]]}
+
+        self.stubs.Set(timeutils, 'utcnow', lambda: now)
+        self.mox.StubOutWithMock(cells_manager.db,
+                                 'instance_get_all_by_filters_light')
+        self.mox.StubOutWithMock(msg_runner, 'get_instances_digest')
+        self.mox.StubOutWithMock(msg_runner, 'get_instances_digest_entries')
+        self.mox.StubOutWithMock(msg_runner, 'sync_instances_by_uuid')
+        self.mox.StubOutWithMock(cells_manager.state_manager,
+                                 'get_child_cells')
+        self.mox.StubOutWithMock(cells_manager.db, 'instance_destroy')
+
+        cells_manager.db.instance_get_all_by_filters_light(self.ctxt,
+                {'deleted': False},
+                ['uuid', 'updated_at', 'cell_name']).AndReturn(our_instances)
+        cells_manager.state_manager.get_child_cells().AndReturn([child_cell])
+        msg_runner.get_instances_digest(self.ctxt, child_cell,
+                updated_before).AndReturn(
+                        messaging.Response(cell_name, their_digest, False))
+        msg_runner.get_instances_digest_entries(self.ctxt, child_cell,
+                updated_before, mox.SameElementsAs(['ab', 'ae'])).AndReturn(
+                        messaging.Response(cell_name,
+                                           their_primitive_entries, False))
+        # ae-missing was deleted from the child cell in the meantime, but
+        # we never had it
+        msg_runner.sync_instances_by_uuid(self.ctxt, child_cell,
+                ['ab-gone', 'ab-stale', 'ae-missing']).AndReturn(
+                        messaging.Response(cell_name,
+                                           ['ab-gone', 'ae-missing'], False))
+        cells_manager.db.instance_destroy(self.ctxt, 'ab-gone',
+                                          update_cells=False)
+        self.mox.ReplayAll()
+
+        cells_manager._verify_child_instances(self.ctxt)
 
     def test_sync_instances(self):
         self.mox.StubOutWithMock(self.msg_runner,
@@ -444,6 +593,31 @@ class CellsManagerClassTestCase(test.TestCase):
         response = self.cells_manager.compute_node_stats(self.ctxt)
         self.assertEqual(expected_resp, response)
 
+    def test_compute_node_stats_skips_timed_out_cells(self):
+        responses = [messaging.Response('cell1', {'key1': 1}, False),
+                     messaging.Response('cell2', exception.CellTimeout(),
+                                        True),
+                     messaging.Response('cell3', {'key1': 2}, False)]
+
+        self.mox.StubOutWithMock(self.msg_runner,
+                                 'compute_node_stats')
+        self.msg_runner.compute_node_stats(self.ctxt).AndReturn(responses)
+        self.mox.ReplayAll()
+        response = self.cells_manager.compute_node_stats(self.ctxt)
+        self.assertEqual({'key1': 3}, response)
+
+    def test_compute_node_stats_raises_other_failures(self):
+        responses = [messaging.Response('cell1', {'key1': 1}, False),
+                     messaging.Response('cell2', exception.CellNotFound(
+                             cell_name='cell2'), True)]
+
+        self.mox.StubOutWithMock(self.msg_runner,
+                                 'compute_node_stats')
+        self.msg_runner.compute_node_stats(self.ctxt).AndReturn(responses)
+        self.mox.ReplayAll()
+        self.assertRaises(exception.CellNotFound,
+                          self.cells_manager.compute_node_stats, self.ctxt)
+
     def test_compute_node_get(self):
         fake_cell = 'fake-cell'
         fake_response = messaging.Response(fake_cell,
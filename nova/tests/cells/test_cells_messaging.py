@@ -14,7 +14,9 @@
 """
 Tests For Cells Messaging module
 """
+import datetime
 
+import mox
 from oslo.config import cfg
 
 from nova.cells import messaging
@@ -569,6 +571,78 @@ class CellsMessageClassesTestCase(test.TestCase):
             self.assertTrue(response.failure)
             self.assertRaises(test.TestingException, response.value_or_raise)
 
+    def test_broadcast_routing_timeout_decays_per_hop(self):
+        self.flags(call_timeout=10, group='cells')
+        self.flags(broadcast_hop_timeout_ratio=0.5, group='cells')
+        method = 'our_fake_method'
+        method_kwargs = dict(arg1=1, arg2=2)
+        direction = 'down'
+
+        def our_fake_method(message, **kwargs):
+            return message.timeout
+
+        fakes.stub_bcast_methods(self, 'our_fake_method', our_fake_method)
+
+        bcast_message = messaging._BroadcastMessage(self.msg_runner,
+                                                    self.ctxt, method,
+                                                    method_kwargs,
+                                                    direction,
+                                                    run_locally=True,
+                                                    need_response=True)
+        responses = bcast_message.process()
+        self.assertEqual(len(responses), 8)
+        for response in responses:
+            # Each hop hands half of what it waits for to the next one
+            hops = response.cell_name.count(messaging._PATH_CELL_SEP)
+            self.assertEqual(10 * 0.5 ** (hops + 1),
+                             response.value_or_raise())
+
+    def test_broadcast_routing_with_timed_out_cell(self):
+        self.flags(call_timeout=0, group='cells')
+        method = 'our_fake_method'
+        method_kwargs = dict(arg1=1, arg2=2)
+        direction = 'down'
+
+        def our_fake_method(message, **kwargs):
+            return 'response-%s' % message.routing_path
+
+        fakes.stub_bcast_methods(self, 'our_fake_method', our_fake_method)
+
+        orig_send_message = fakes.FakeCellState.send_message
+
+        def send_message(cell_state, message):
+            # grandchild-cell3 never gets the broadcast
+            if (cell_state.name == 'grandchild-cell3' and
+                    isinstance(message, messaging._BroadcastMessage)):
+                return
+            orig_send_message(cell_state, message)
+
+        self.stubs.Set(fakes.FakeCellState, 'send_message', send_message)
+
+        bcast_message = messaging._BroadcastMessage(self.msg_runner,
+                                                    self.ctxt, method,
+                                                    method_kwargs,
+                                                    direction,
+                                                    run_locally=True,
+                                                    need_response=True)
+        responses = bcast_message.process()
+        self.assertEqual(len(responses), 8)
+        failure_responses = [resp for resp in responses if resp.failure]
+        success_responses = [resp for resp in responses if not resp.failure]
+        self.assertEqual(len(failure_responses), 1)
+        self.assertEqual(len(success_responses), 7)
+
+        for response in success_responses:
+            self.assertFalse(response.timed_out())
+            self.assertEqual('response-%s' % response.cell_name,
+                    response.value_or_raise())
+
+        response = failure_responses[0]
+        self.assertEqual('api-cell!child-cell3!grandchild-cell3',
+                         response.cell_name)
+        self.assertTrue(response.timed_out())
+        self.assertRaises(exception.CellTimeout, response.value_or_raise)
+
 
 class CellsTargetedMethodsTestCase(test.TestCase):
     """Test case for _TargetedMessageMethods class.  Most of these
@@ -757,6 +831,67 @@ class CellsTargetedMethodsTestCase(test.TestCase):
         result = response.value_or_raise()
         self.assertEqual('fake-service', result)
 
+    def _stub_instances_for_digest(self):
+        updated_at = datetime.datetime(2013, 5, 1, 12, 0, 0, 500)
+        fake_instances = [dict(uuid='aa-1', updated_at=updated_at),
+                          dict(uuid='ab-1', updated_at=None),
+                          dict(uuid='ab-2', updated_at=updated_at),
+                          dict(uuid='ac-1', updated_at=datetime.datetime(
+                                  2013, 5, 1, 12, 1, 0))]
+        self.mox.StubOutWithMock(self.tgt_db_inst,
+                                 'instance_get_all_by_filters_light')
+        self.tgt_db_inst.instance_get_all_by_filters_light(self.ctxt,
+                {'deleted': False}, ['uuid', 'updated_at']).AndReturn(
+                        fake_instances)
+        self.mox.ReplayAll()
+
+    def test_get_instances_digest(self):
+        self._stub_instances_for_digest()
+        expected_digest = cells_utils.get_instances_digest(
+                {'aa': [('aa-1', '2013-05-01T12:00:00')],
+                 'ab': [('ab-1', None), ('ab-2', '2013-05-01T12:00:00')]})
+
+        response = self.src_msg_runner.get_instances_digest(self.ctxt,
+                self.tgt_cell_name, '2013-05-01T12:01:00Z')
+        self.assertEqual(expected_digest, response.value_or_raise())
+
+    def test_get_instances_digest_entries(self):
+        self._stub_instances_for_digest()
+        expected_entries = {'ab': [['ab-1', None],
+                                   ['ab-2', '2013-05-01T12:00:00']],
+                            'ad': []}
+
+        response = self.src_msg_runner.get_instances_digest_entries(
+                self.ctxt, self.tgt_cell_name, '2013-05-01T12:01:00Z',
+                ['ab', 'ad'])
+        self.assertEqual(expected_entries, response.value_or_raise())
+
+    def test_sync_instances_by_uuid(self):
+        instance1 = dict(uuid='fake_uuid1', deleted=False)
+        instance2 = dict(uuid='fake_uuid2', deleted=True)
+
+        self.mox.StubOutWithMock(self.tgt_db_inst, 'instance_get_by_uuid')
+        self.mox.StubOutWithMock(self.tgt_msg_runner,
+                                 'instance_update_at_top')
+        self.mox.StubOutWithMock(self.tgt_msg_runner,
+                                 'instance_destroy_at_top')
+
+        self.tgt_db_inst.instance_get_by_uuid(mox.IgnoreArg(),
+                'fake_uuid1').AndReturn(instance1)
+        self.tgt_db_inst.instance_get_by_uuid(mox.IgnoreArg(),
+                'fake_uuid2').AndReturn(instance2)
+        self.tgt_db_inst.instance_get_by_uuid(mox.IgnoreArg(),
+                'fake_uuid3').AndRaise(
+                        exception.InstanceNotFound(instance_id='fake_uuid3'))
+        self.tgt_msg_runner.instance_update_at_top(self.ctxt, instance1)
+        self.tgt_msg_runner.instance_destroy_at_top(self.ctxt, instance2)
+        self.mox.ReplayAll()
+
+        response = self.src_msg_runner.sync_instances_by_uuid(self.ctxt,
+                self.tgt_cell_name,
+                ['fake_uuid1', 'fake_uuid2', 'fake_uuid3'])
+        self.assertEqual(['fake_uuid3'], response.value_or_raise())
+
     def test_service_update(self):
         binary = 'nova-compute'
         fake_service = dict(id=42, host='fake_host', binary='nova-compute',
@@ -1049,6 +1184,40 @@ class CellsBroadcastMethodsTestCase(test.TestCase):
 
         self.src_msg_runner.instance_update_at_top(self.ctxt, fake_instance)
 
+    def test_instance_update_batch_at_top(self):
+        fake_instances = [{'uuid': 'fake_uuid1',
+                           'name': 'fake',
+                           'info_cache': {'id': 1, 'other': 'moo'}},
+                          {'uuid': 'fake_uuid2',
+                           'other': 'meow'}]
+        expected_cell_name = 'api-cell!child-cell2!grandchild-cell1'
+        expected_updates = [{'uuid': 'fake_uuid1',
+                             'cell_name': expected_cell_name,
+                             'info_cache': {'other': 'moo'}},
+                            {'uuid': 'fake_uuid2',
+                             'cell_name': expected_cell_name,
+                             'other': 'meow'}]
+
+        # To show these should not be called in src/mid-level cell
+        self.mox.StubOutWithMock(self.src_db_inst, 'instance_update_batch')
+        self.mox.StubOutWithMock(self.mid_db_inst, 'instance_update_batch')
+
+        self.mox.StubOutWithMock(self.tgt_db_inst, 'instance_update_batch')
+        self.mox.StubOutWithMock(self.tgt_db_inst, 'instance_create')
+        self.mox.StubOutWithMock(self.tgt_msg_runner,
+                                 'sync_instances_by_uuid')
+        self.tgt_db_inst.instance_update_batch(
+                self.ctxt, expected_updates).AndReturn(
+                        [dict(expected_updates[1])])
+        # Unknown instances are not created from their changes, the cell
+        # is asked for them instead
+        self.tgt_msg_runner.sync_instances_by_uuid(self.ctxt,
+                expected_cell_name, ['fake_uuid2'])
+        self.mox.ReplayAll()
+
+        self.src_msg_runner.instance_update_batch_at_top(self.ctxt,
+                                                         fake_instances)
+
     def test_instance_update_at_top_with_building_state(self):
         fake_info_cache = {'id': 1,
                            'instance': 'fake_instance',
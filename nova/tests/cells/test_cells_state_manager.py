@@ -122,6 +122,31 @@ class TestCellsStateManager(test.TestCase):
         units = 2  # 2 on host 3
         self.assertEqual(units, cap['disk_free']['units_by_mb'][str(sz)])
 
+    def test_capacity_only_recounts_changed_hosts(self):
+        state_manager = self._get_state_manager(50.0)
+        computes = _fake_compute_node_get_all(None)
+        computes[2]['free_ram_mb'] = 512
+        del computes[3]
+        self.stubs.Set(db, 'compute_node_get_all', lambda context: computes)
+
+        counted = []
+        orig_free_units = state._free_units
+
+        def _free_units(totals, frees, sizes, reserve_level):
+            counted.append(frees)
+            return orig_free_units(totals, frees, sizes, reserve_level)
+
+        self.stubs.Set(state, '_free_units', _free_units)
+        state_manager._update_our_capacity(None)
+        cap = state_manager.get_my_state().capacities
+
+        # Only host3's ram and disk were counted again
+        self.assertEqual([[512], [100 * 1024]], counted)
+        self.assertEqual(511, cap['ram_free']['total_mb'])
+        self.assertEqual(0, cap['ram_free']['units_by_mb']['50'])
+        sz = 25 * 1024
+        self.assertEqual(2, cap['disk_free']['units_by_mb'][str(sz)])
+
     def _get_state_manager(self, reserve_percent=0.0):
         self.flags(reserve_percent=reserve_percent, group='cells')
         return state.CellStateManager()
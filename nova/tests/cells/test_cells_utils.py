@@ -15,6 +15,7 @@
 """
 Tests For Cells Utility methods
 """
+import datetime
 import inspect
 import random
 
@@ -101,3 +102,27 @@ class CellsUtilsTestCase(test.TestCase):
         result_cell, result_item = cells_utils.split_cell_and_item(together)
         self.assertEqual(cell, result_cell)
         self.assertEqual(item, result_item)
+
+    def test_get_instances_digest(self):
+        updated_at = datetime.datetime(2013, 5, 1, 12, 0, 0, 500)
+        instances = [dict(uuid='aa-1', updated_at=updated_at),
+                     dict(uuid='aa-2', updated_at=None),
+                     dict(uuid='ab-1', updated_at=updated_at),
+                     dict(uuid='ab-2', updated_at=datetime.datetime(
+                             2013, 5, 1, 12, 1, 0))]
+
+        buckets = cells_utils.get_instances_digest_entries(instances,
+                datetime.datetime(2013, 5, 1, 12, 1, 0))
+        self.assertEqual({'aa': [('aa-1', '2013-05-01T12:00:00'),
+                                 ('aa-2', None)],
+                          'ab': [('ab-1', '2013-05-01T12:00:00')]},
+                         buckets)
+
+        digests = cells_utils.get_instances_digest(buckets)
+        self.assertEqual(['aa', 'ab'], sorted(digests))
+        # Entry order doesn't matter, update times do
+        buckets['aa'].reverse()
+        self.assertEqual(digests, cells_utils.get_instances_digest(buckets))
+        buckets['ab'] = [('ab-1', '2013-05-01T12:00:01')]
+        self.assertNotEqual(digests['ab'],
+                            cells_utils.get_instances_digest(buckets)['ab'])
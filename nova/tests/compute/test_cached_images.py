@@ -0,0 +1,52 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the compact report of cached images."""
+
+from nova.compute import cached_images
+from nova import test
+
+
+class CachedImagesTestCase(test.NoDBTestCase):
+    def test_membership(self):
+        images = cached_images.CachedImages()
+        fingerprint = cached_images.fingerprint('image-1')
+        self.assertNotIn(fingerprint, images)
+        images.add(fingerprint)
+        self.assertIn(fingerprint, images)
+
+    def test_encode_decode(self):
+        images = cached_images.CachedImages()
+        for i in xrange(100):
+            images.add(cached_images.fingerprint('image-%d' % i))
+
+        value = images.encode()
+        self.assertTrue(len(value) <= 255)
+
+        decoded = cached_images.CachedImages.decode(value)
+        for i in xrange(100):
+            self.assertIn(cached_images.fingerprint('image-%d' % i), decoded)
+        false_positives = [i for i in xrange(100, 1100)
+                           if cached_images.fingerprint('image-%d' % i)
+                           in decoded]
+        self.assertTrue(len(false_positives) < 100)
+
+    def test_decode_invalid(self):
+        self.assertRaises(ValueError, cached_images.CachedImages.decode,
+                          'not base64!')
+        self.assertRaises(ValueError, cached_images.CachedImages.decode,
+                          'c2hvcnQ=')
@@ -486,6 +486,58 @@ class ComputeVolumeTestCase(BaseTestCase):
                         self.compute._last_vol_usage_poll)
         self.mox.UnsetStubs()
 
+    def test_poll_bandwidth_usage(self):
+        ctxt = 'MockContext'
+        self.compute.host = 'MockHost'
+        bw_counters = [dict(uuid='uuid1', mac_address='mac1',
+                            bw_in=1500, bw_out=1500),
+                       dict(uuid='uuid2', mac_address='mac2',
+                            bw_in=80, bw_out=100),
+                       dict(uuid='uuid2', mac_address='mac3',
+                            bw_in=10, bw_out=20)]
+        usages = [dict(uuid='uuid1', mac='mac1', bw_in=100, bw_out=200,
+                       last_ctr_in=1000, last_ctr_out=2000)]
+        prev_usages = [dict(uuid='uuid1', mac='mac1', bw_in=1, bw_out=2,
+                            last_ctr_in=3, last_ctr_out=4),
+                       dict(uuid='uuid2', mac='mac2', bw_in=5, bw_out=6,
+                            last_ctr_in=50, last_ctr_out=60)]
+        expected_updates = [dict(uuid='uuid1', mac='mac1', bw_in=600,
+                                 bw_out=1700, last_ctr_in=1500,
+                                 last_ctr_out=1500),
+                            dict(uuid='uuid2', mac='mac2', bw_in=30,
+                                 bw_out=40, last_ctr_in=80,
+                                 last_ctr_out=100),
+                            dict(uuid='uuid2', mac='mac3', bw_in=0,
+                                 bw_out=0, last_ctr_in=10,
+                                 last_ctr_out=20)]
+        self.mox.StubOutWithMock(utils, 'last_completed_audit_period')
+        self.mox.StubOutWithMock(self.compute.conductor_api,
+                                 'instance_get_all_by_host')
+        self.mox.StubOutWithMock(self.compute.driver, 'get_all_bw_counters')
+        self.mox.StubOutWithMock(self.compute.conductor_api,
+                                 'bw_usage_get_by_uuids')
+        self.mox.StubOutWithMock(self.compute.conductor_api,
+                                 'bw_usage_update_batch')
+        # 1 call to fetch the usages of each period, and 1 to update them
+        utils.last_completed_audit_period().AndReturn(('prev', 'start'))
+        self.compute.conductor_api.instance_get_all_by_host(
+            ctxt, 'MockHost', columns_to_join=[]).AndReturn('instances')
+        self.compute.driver.get_all_bw_counters('instances').AndReturn(
+            bw_counters)
+        self.compute.conductor_api.bw_usage_get_by_uuids(
+            ctxt, mox.SameElementsAs(['uuid1', 'uuid2']),
+            'start').AndReturn(usages)
+        self.compute.conductor_api.bw_usage_get_by_uuids(
+            ctxt, mox.SameElementsAs(['uuid1', 'uuid2']),
+            'prev').AndReturn(prev_usages)
+        self.compute.conductor_api.bw_usage_update_batch(
+            ctxt, 'start', expected_updates, last_refreshed=mox.IgnoreArg())
+        self.mox.ReplayAll()
+
+        self.flags(bandwidth_poll_interval=10)
+        self.compute._last_bw_usage_poll = 0
+        self.compute._poll_bandwidth_usage(ctxt)
+
     def test_detach_volume_usage(self):
         # Test that detach volume update the volume usage cache table correctly
         instance = self._create_fake_instance()
@@ -4484,14 +4536,15 @@ class ComputeTestCase(BaseTestCase):
         called = {'get_all': False, 'set_error_state': 0}
         created_at = timeutils.utcnow() + datetime.timedelta(seconds=-60)
 
-        def fake_instance_get_all_by_filters(context, filters, *args, **kw):
+        def fake_instance_get_all_by_filters_light(context, filters, columns,
+                                                   *args, **kw):
             called['get_all'] = True
             self.assertIn('host', filters)
-            self.assertEqual(kw['columns_to_join'], [])
+            self.assertEqual(['uuid', 'created_at'], columns)
             return instances[:]
 
-        self.stubs.Set(db, 'instance_get_all_by_filters',
-                fake_instance_get_all_by_filters)
+        self.stubs.Set(db, 'instance_get_all_by_filters_light',
+                fake_instance_get_all_by_filters_light)
 
         def fake_set_instance_error_state(_ctxt, instance_uuid, **kwargs):
             called['set_error_state'] += 1
@@ -4518,12 +4571,12 @@ class ComputeTestCase(BaseTestCase):
         called = {'get_all': False, 'set_error_state': 0}
         created_at = timeutils.utcnow() + datetime.timedelta(seconds=-60)
 
-        def fake_instance_get_all_by_filters(*args, **kwargs):
+        def fake_instance_get_all_by_filters_light(*args, **kwargs):
             called['get_all'] = True
             return instances[:]
 
-        self.stubs.Set(db, 'instance_get_all_by_filters',
-                fake_instance_get_all_by_filters)
+        self.stubs.Set(db, 'instance_get_all_by_filters_light',
+                fake_instance_get_all_by_filters_light)
 
         def fake_set_instance_error_state(_ctxt, instance_uuid, **kwargs):
             called['set_error_state'] += 1
@@ -4550,12 +4603,12 @@ class ComputeTestCase(BaseTestCase):
         called = {'get_all': False, 'set_error_state': 0}
         created_at = timeutils.utcnow() + datetime.timedelta(seconds=-60)
 
-        def fake_instance_get_all_by_filters(*args, **kwargs):
+        def fake_instance_get_all_by_filters_light(*args, **kwargs):
             called['get_all'] = True
             return instances[:]
 
-        self.stubs.Set(db, 'instance_get_all_by_filters',
-                fake_instance_get_all_by_filters)
+        self.stubs.Set(db, 'instance_get_all_by_filters_light',
+                fake_instance_get_all_by_filters_light)
 
         def fake_set_instance_error_state(_ctxt, instance_uuid, **kwargs):
             called['set_error_state'] += 1
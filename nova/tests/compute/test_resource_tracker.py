@@ -21,6 +21,7 @@ import uuid
 
 from oslo.config import cfg
 
+from nova.compute import cached_images
 from nova.compute import flavors
 from nova.compute import resource_tracker
 from nova.compute import task_states
@@ -376,9 +377,21 @@ class BaseTrackerTestCase(BaseTestCase):
     def _fake_compute_node_update(self, ctx, compute_node_id, values,
             prune_stats=False):
         self.updated = True
-        values['stats'] = [{"key": "num_instances", "value": "1"}]
-
+        values = dict(values)
+        stats = values.pop('stats', None)
         self.compute.update(values)
+        if stats is not None:
+            # Store the stats like the DB does, as a list of key/values
+            if prune_stats:
+                current_stats = {}
+            else:
+                current_stats = dict((stat['key'], stat['value'])
+                                     for stat in self.compute['stats'])
+            current_stats.update((key, unicode(value))
+                                 for (key, value) in stats.iteritems())
+            self.compute['stats'] = [{"key": key, "value": value}
+                                     for (key, value)
+                                     in current_stats.iteritems()]
         return self.compute
 
     def _fake_compute_node_delete(self, ctx, compute_node_id):
@@ -446,6 +459,72 @@ class TrackerTestCase(BaseTrackerTestCase):
         self.assertFalse(self.tracker.disabled)
         self.assertTrue(self.updated)
 
+    def test_update_compute_node_pushes_to_scheduler(self):
+        self.flags(push_compute_node_updates=True)
+        pushed = []
+
+        def fake_update_compute_node(ctxt, compute_node):
+            pushed.append(compute_node)
+
+        self.stubs.Set(self.tracker.scheduler_rpcapi, 'update_compute_node',
+                       fake_update_compute_node)
+        self.tracker.update_available_resource(self.context)
+        self.assertEqual([self.tracker.compute_node], pushed)
+
+    def _record_compute_node_updates(self):
+        updates = []
+
+        def fake_compute_node_update(ctx, compute_node_id, values,
+                                     prune_stats=False):
+            updates.append((dict(values), prune_stats))
+            self.compute.update(values)
+            return self.compute
+
+        self.stubs.Set(db, 'compute_node_update', fake_compute_node_update)
+        return updates
+
+    def test_update_unchanged_compute_node(self):
+        self.tracker.update_available_resource(self.context)
+        updates = self._record_compute_node_updates()
+        self.tracker.update_available_resource(self.context)
+        self.assertEqual([({}, False)], updates)
+
+    def test_update_sends_changed_values(self):
+        self.tracker.update_available_resource(self.context)
+        updates = self._record_compute_node_updates()
+        instance = self._fake_instance(memory_mb=3, root_gb=1, ephemeral_gb=1,
+                                       vcpus=1, task_state=None)
+        self.tracker.instance_claim(self.context, instance, self.limits)
+        values, prune_stats = updates[0]
+        self.assertFalse(prune_stats)
+        self.assertEqual(3, values['memory_mb_used'])
+        self.assertEqual(2, values['local_gb_used'])
+        self.assertEqual(FAKE_VIRT_MEMORY_MB - 3, values['free_ram_mb'])
+        self.assertNotIn('memory_mb', values)
+        self.assertNotIn('local_gb', values)
+        self.assertEqual('1', values['stats']['num_instances'])
+
+    def test_update_prunes_removed_stats(self):
+        self._fake_instance(host=self.host)
+        self.tracker.update_available_resource(self.context)
+        updates = self._record_compute_node_updates()
+        self._instances = {}
+        self.tracker.update_available_resource(self.context)
+        values, prune_stats = updates[0]
+        self.assertTrue(prune_stats)
+        self.assertEqual({}, values['stats'])
+
+    def test_update_reports_cached_images(self):
+        fingerprint = cached_images.fingerprint('image-1')
+        self.stubs.Set(self.tracker.driver, 'get_cached_images',
+                       lambda: [fingerprint])
+        updates = self._record_compute_node_updates()
+        self.tracker.update_available_resource(self.context)
+        values, prune_stats = updates[0]
+        images = cached_images.CachedImages.decode(
+                values['stats'][cached_images.STAT_KEY])
+        self.assertIn(fingerprint, images)
+
     def test_init(self):
         self._assert(FAKE_VIRT_MEMORY_MB, 'memory_mb')
         self._assert(FAKE_VIRT_LOCAL_GB, 'local_gb')
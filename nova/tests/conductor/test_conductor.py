@@ -185,6 +185,28 @@ class _BaseTestCase(object):
         self.assertEqual(orig_instance['name'],
                          copy_instance['name'])
 
+    def test_instance_get_all_by_filters_light(self):
+        filters = {'foo': 'bar'}
+        self.mox.StubOutWithMock(db, 'instance_get_all_by_filters_light')
+        db.instance_get_all_by_filters_light(self.context, filters,
+                                             ['uuid', 'host'],
+                                             'fake-key', 'fake-sort'
+                                             ).AndReturn([{'uuid': 'fake',
+                                                           'host': 'host'}])
+        self.mox.ReplayAll()
+        result = self.conductor.instance_get_all_by_filters_light(
+            self.context, filters, ['uuid', 'host'], 'fake-key', 'fake-sort')
+        self.assertEqual([{'uuid': 'fake', 'host': 'host'}], result)
+
+    def test_instance_get_popular_image_refs(self):
+        self.mox.StubOutWithMock(db, 'instance_get_popular_image_refs')
+        db.instance_get_popular_image_refs(self.context, 'since',
+                                           5).AndReturn(['1', '2'])
+        self.mox.ReplayAll()
+        result = self.conductor.instance_get_popular_image_refs(self.context,
+                                                                'since', 5)
+        self.assertEqual(['1', '2'], result)
+
     def _setup_aggregate_with_host(self):
         aggregate_ref = db.aggregate_create(self.context.elevated(),
                 {'name': 'foo'}, metadata={'availability_zone': 'foo'})
@@ -275,6 +297,23 @@ class _BaseTestCase(object):
         result = self.conductor.bw_usage_update(*update_args)
         self.assertEqual(result, 'foo')
 
+    def test_bw_usage_get_by_uuids(self):
+        self.mox.StubOutWithMock(db, 'bw_usage_get_by_uuids')
+        db.bw_usage_get_by_uuids(self.context, ['uuid1', 'uuid2'],
+                                 0).AndReturn(['foo'])
+        self.mox.ReplayAll()
+        result = self.conductor.bw_usage_get_by_uuids(self.context,
+                                                      ['uuid1', 'uuid2'], 0)
+        self.assertEqual(result, ['foo'])
+
+    def test_bw_usage_update_batch(self):
+        self.mox.StubOutWithMock(db, 'bw_usage_update_batch')
+        usages = [dict(uuid='uuid', mac='mac', bw_in=10, bw_out=20,
+                       last_ctr_in=5, last_ctr_out=10)]
+        db.bw_usage_update_batch(self.context, 0, usages, 20)
+        self.mox.ReplayAll()
+        self.conductor.bw_usage_update_batch(self.context, 0, usages, 20)
+
     def test_security_group_get_by_instance(self):
         fake_instance = {'uuid': 'fake-instance'}
         self.mox.StubOutWithMock(db, 'security_group_get_by_instance')
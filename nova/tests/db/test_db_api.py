@@ -222,6 +222,25 @@ class DbApiTestCase(DbTestCase):
         result = db.instance_get_all_by_filters(self.context, {})
         self.assertEqual(2, len(result))
 
+    def test_instance_get_hosts_by_uuids(self):
+        i1 = self.create_instance_with_args(host='host1')
+        i2 = self.create_instance_with_args(host='host2')
+        i3 = self.create_instance_with_args(host='host3')
+        i4 = self.create_instance_with_args(host=None)
+        self.create_instance_with_args(host='host4')
+        db.instance_destroy(self.context, i3['uuid'])
+        uuids = [i['uuid'] for i in (i1, i2, i3, i4)]
+        result = db.instance_get_hosts_by_uuids(self.context, uuids)
+        self.assertEqual(set(['host1', 'host2']), result)
+        self.assertEqual(set(), db.instance_get_hosts_by_uuids(self.context,
+                                                               []))
+
+    def test_instance_get_hosts_by_uuids_other_project(self):
+        ctxt = context.RequestContext('user2', 'project2')
+        i1 = self.create_instance_with_args(host='host1', context=ctxt)
+        result = db.instance_get_hosts_by_uuids(self.context, [i1['uuid']])
+        self.assertEqual(set(), result)
+
     def test_instance_get_all_by_filters_regex(self):
         self.create_instance_with_args(display_name='test1')
         self.create_instance_with_args(display_name='teeeest2')
@@ -230,6 +249,25 @@ class DbApiTestCase(DbTestCase):
                                                 {'display_name': 't.*st.'})
         self.assertEqual(2, len(result))
 
+    def test_instance_get_all_by_filters_regex_literal(self):
+        self.create_instance_with_args(display_name='test.1')
+        self.create_instance_with_args(display_name='test11')
+        self.create_instance_with_args(display_name='test.12')
+        result = db.instance_get_all_by_filters(self.context,
+                                                {'display_name': '^test\\.1$'})
+        self.assertEqual(['test.1'], [r['display_name'] for r in result])
+
+    def test_regex_to_literal(self):
+        self.assertEqual(('10.0.0.1', True, True),
+                         sqlalchemy_api._regex_to_literal('^10\\.0\\.0\\.1$'))
+        self.assertEqual(('foo', False, False),
+                         sqlalchemy_api._regex_to_literal('foo'))
+        self.assertEqual(('foo$', True, False),
+                         sqlalchemy_api._regex_to_literal('^foo\\$'))
+        self.assertEqual(None, sqlalchemy_api._regex_to_literal('t.*st'))
+        self.assertEqual(None, sqlalchemy_api._regex_to_literal('test\\d'))
+        self.assertEqual(None, sqlalchemy_api._regex_to_literal('a|b'))
+
     def test_instance_get_all_by_filters_exact_match(self):
         self.create_instance_with_args(host='host1')
         self.create_instance_with_args(host='host12')
@@ -237,6 +275,24 @@ class DbApiTestCase(DbTestCase):
                                                 {'host': 'host1'})
         self.assertEqual(1, len(result))
 
+    def test_instance_get_all_by_filters_light(self):
+        i1 = self.create_instance_with_args(host='host1',
+                                            display_name='test1')
+        self.create_instance_with_args(host='host1', display_name='diff')
+        self.create_instance_with_args(host='host2', display_name='test2')
+        result = db.instance_get_all_by_filters_light(self.context,
+                {'host': 'host1', 'display_name': 't.*st'},
+                ['uuid', 'host'])
+        self.assertEqual([{'uuid': i1['uuid'], 'host': 'host1'}], result)
+
+    def test_instance_get_all_by_filters_light_paginate(self):
+        instances = [self.create_instance_with_args() for i in xrange(3)]
+        uuids = sorted(inst['uuid'] for inst in instances)
+        result = db.instance_get_all_by_filters_light(self.context, {},
+                ['uuid'], sort_key='uuid', sort_dir='asc', limit=1,
+                marker=uuids[0])
+        self.assertEqual([{'uuid': uuids[1]}], result)
+
     def test_instance_get_all_by_filters_metadata(self):
         self.create_instance_with_args(metadata={'foo': 'bar'})
         self.create_instance_with_args()
@@ -484,6 +540,85 @@ class DbApiTestCase(DbTestCase):
         system_meta = db.instance_system_metadata_get(ctxt, instance['uuid'])
         self.assertEqual('baz', system_meta['original_image_ref'])
 
+    def test_instance_update_batch(self):
+        ctxt = context.get_admin_context()
+        instance1 = db.instance_create(ctxt, {'vm_state': 'building'})
+        instance2 = db.instance_create(ctxt, {'vm_state': 'active'})
+        missing = {'uuid': uuidutils.generate_uuid(), 'host': 'foo'}
+        updates = [{'uuid': instance1['uuid'],
+                    'vm_state': 'active',
+                    'system_metadata': {'original_image_ref': 'baz'},
+                    'info_cache': {'network_info': 'fake_nw_info'}},
+                   {'uuid': instance2['uuid'],
+                    'vm_state': 'building',
+                    'host': 'foo',
+                    'expected_vm_state': ['building', None]},
+                   missing]
+
+        not_found = db.instance_update_batch(ctxt, updates)
+
+        self.assertEqual([missing], not_found)
+        instance1 = db.instance_get_by_uuid(ctxt, instance1['uuid'])
+        self.assertEqual('active', instance1['vm_state'])
+        self.assertEqual('fake_nw_info',
+                         instance1['info_cache']['network_info'])
+        system_meta = db.instance_system_metadata_get(ctxt,
+                                                      instance1['uuid'])
+        self.assertEqual('baz', system_meta['original_image_ref'])
+        # Failed the expected state check
+        instance2 = db.instance_get_by_uuid(ctxt, instance2['uuid'])
+        self.assertEqual('active', instance2['vm_state'])
+        self.assertEqual(None, instance2['host'])
+
+    def test_instance_get_all_after_watermark(self):
+        ctxt = context.get_admin_context()
+        updated_at = datetime.datetime(2013, 5, 1, 12, 0, 0)
+        db.instance_create(ctxt, {})
+        instances = []
+        for seconds in (2, 1, 1):
+            instance = db.instance_create(ctxt, {})
+            db.instance_update(ctxt, instance['uuid'],
+                    {'updated_at': updated_at +
+                                   datetime.timedelta(seconds=seconds)})
+            instances.append(instance)
+        # Never updated instances aren't returned, the rest in order of
+        # (updated_at, id)
+        expected = [instances[1]['id'], instances[2]['id'],
+                    instances[0]['id']]
+
+        result = db.instance_get_all_after_watermark(ctxt, None, 10)
+        self.assertEqual(expected, [inst['id'] for inst in result])
+
+        result = db.instance_get_all_after_watermark(ctxt, None, 2)
+        self.assertEqual(expected[:2],
+                         [inst['id'] for inst in result])
+
+        watermark = (result[0]['updated_at'], result[0]['id'])
+        result = db.instance_get_all_after_watermark(ctxt, watermark, 10)
+        self.assertEqual(expected[1:],
+                         [inst['id'] for inst in result])
+
+    def test_instance_get_popular_image_refs(self):
+        ctxt = context.get_admin_context()
+        now = timeutils.utcnow()
+        old = now - datetime.timedelta(days=2)
+        for image_ref, created_at in [('2', now), ('1', now), ('2', now),
+                                      ('3', now), ('2', now), ('3', now),
+                                      ('1', old), ('1', old), ('', now)]:
+            db.instance_create(ctxt, {'image_ref': image_ref,
+                                      'created_at': created_at})
+        instance = db.instance_create(ctxt, {'image_ref': '1',
+                                             'created_at': now})
+        db.instance_destroy(ctxt, instance['uuid'])
+
+        since = now - datetime.timedelta(days=1)
+        self.assertEqual(['2', '3', '1'],
+                         db.instance_get_popular_image_refs(ctxt, since, 10))
+        self.assertEqual(['2', '3'],
+                         db.instance_get_popular_image_refs(ctxt, since, 2))
+        self.assertEqual(['1', '2', '3'],
+                         db.instance_get_popular_image_refs(ctxt, old, 10))
+
     def test_delete_instance_metadata_on_instance_destroy(self):
         ctxt = context.get_admin_context()
 
@@ -1066,6 +1201,46 @@ class DbApiTestCase(DbTestCase):
         _compare(bw_usages[2], expected_bw_usages[2])
         timeutils.clear_time_override()
 
+    def test_bw_usage_update_batch(self):
+        ctxt = context.get_admin_context()
+        now = timeutils.utcnow()
+        timeutils.set_time_override(now)
+        start_period = now - datetime.timedelta(seconds=10)
+        refreshed = now - datetime.timedelta(seconds=5)
+
+        db.bw_usage_update(ctxt, 'fake_uuid1', 'fake_mac1', start_period,
+                100, 200, 12345, 67890, update_cells=False)
+        # Another period is left alone
+        db.bw_usage_update(ctxt, 'fake_uuid1', 'fake_mac2', now,
+                1, 2, 3, 4, update_cells=False)
+
+        usages = [{'uuid': 'fake_uuid1', 'mac': 'fake_mac1',
+                   'bw_in': 300, 'bw_out': 400,
+                   'last_ctr_in': 22345, 'last_ctr_out': 77890},
+                  {'uuid': 'fake_uuid1', 'mac': 'fake_mac2',
+                   'bw_in': 10, 'bw_out': 20,
+                   'last_ctr_in': 30, 'last_ctr_out': 40},
+                  {'uuid': 'fake_uuid2', 'mac': 'fake_mac3',
+                   'bw_in': 50, 'bw_out': 60,
+                   'last_ctr_in': 70, 'last_ctr_out': 80}]
+        db.bw_usage_update_batch(ctxt, start_period, usages,
+                                 last_refreshed=refreshed,
+                                 update_cells=False)
+
+        bw_usages = db.bw_usage_get_by_uuids(ctxt,
+                ['fake_uuid1', 'fake_uuid2'], start_period)
+        self.assertEqual(3, len(bw_usages))
+        for usage in usages:
+            bw_usage = db.bw_usage_get(ctxt, usage['uuid'], start_period,
+                                       usage['mac'])
+            for key, value in usage.items():
+                self.assertEqual(value, bw_usage[key])
+            self.assertEqual(refreshed, bw_usage['last_refreshed'])
+        bw_usage = db.bw_usage_get(ctxt, 'fake_uuid1', now, 'fake_mac2')
+        self.assertEqual(1, bw_usage['bw_in'])
+        self.assertEqual(now, bw_usage['last_refreshed'])
+        timeutils.clear_time_override()
+
     def _test_decorator_wraps_helper(self, decorator):
         def test_func():
             """Test docstring."""
@@ -1290,6 +1465,27 @@ class AggregateDBApiTestCase(test.TestCase):
                                                key='good')
         self.assertFalse('good' in r2)
 
+    def test_aggregate_metadata_get_all_by_host(self):
+        ctxt = context.get_admin_context()
+        values = {'name': 'fake_aggregate2'}
+        values2 = {'name': 'fake_aggregate3'}
+        a1 = _create_aggregate_with_hosts(context=ctxt)
+        a2 = _create_aggregate_with_hosts(context=ctxt, values=values,
+                hosts=['foo.openstack.org', 'bar.openstack.org'],
+                metadata={'fake_key1': 'other_value'})
+        a3 = _create_aggregate_with_hosts(context=ctxt, values=values2,
+                hosts=['baz.openstack.org'], metadata={'badkey': 'bad'})
+        db.aggregate_delete(ctxt, a3['id'])
+        r1 = db.aggregate_metadata_get_all_by_host(ctxt)
+        self.assertEqual(set(['foo.openstack.org', 'bar.openstack.org']),
+                         set(r1.keys()))
+        r2 = db.aggregate_metadata_get_by_host(ctxt, 'foo.openstack.org')
+        self.assertEqual(r2, r1['foo.openstack.org'])
+        self.assertEqual(set(['fake_value1', 'other_value']),
+                         r1['foo.openstack.org']['fake_key1'])
+        self.assertEqual({'fake_key1': set(['other_value'])},
+                         r1['bar.openstack.org'])
+
     def test_aggregate_host_get_by_metadata_key(self):
         ctxt = context.get_admin_context()
         values = {'name': 'fake_aggregate2'}
@@ -4100,6 +4296,50 @@ class VirtualInterfaceTestCase(test.TestCase, ModelsObjectComparatorMixin):
         real_vifs = db.virtual_interface_get_all(self.ctxt)
         self._assertEqualListsOfObjects(vifs, real_vifs)
 
+    def _create_vif_addresses(self):
+        db.network_update(self.ctxt, self.network['id'],
+                          {'cidr_v6': 'fd00::/64'})
+        vif1 = self._create_virt_interface({'address': 'fake1'})
+        vif2 = self._create_virt_interface({'address': 'fake2'})
+        self._create_virt_interface({'address': 'fake3'})
+        for vif, address in ((vif1, '10.0.0.1'), (vif1, '10.0.0.2'),
+                             (vif2, '10.0.0.3')):
+            db.fixed_ip_create(self.ctxt, {'address': address,
+                                           'network_id': self.network['id'],
+                                           'virtual_interface_id': vif['id']})
+        fixed_ip = db.fixed_ip_get_by_address(self.ctxt, '10.0.0.1')
+        for address in ('172.16.0.1', '172.16.0.2'):
+            db.floating_ip_create(self.ctxt, {'address': address,
+                                              'fixed_ip_id': fixed_ip['id']})
+
+    def test_virtual_interface_get_all_addresses(self):
+        self._create_vif_addresses()
+        vifs = db.virtual_interface_get_all_addresses(self.ctxt)
+        self.assertEqual(['fake1', 'fake2', 'fake3'],
+                         [vif['address'] for vif in vifs])
+        for vif in vifs:
+            self.assertEqual(self.instance_uuid, vif['instance_uuid'])
+            self.assertEqual(self.network['id'], vif['network_id'])
+            self.assertEqual('fd00::/64', vif['cidr_v6'])
+        self.assertEqual([{'address': '10.0.0.1',
+                           'floating_ips': ['172.16.0.1', '172.16.0.2']},
+                          {'address': '10.0.0.2', 'floating_ips': []}],
+                         vifs[0]['fixed_ips'])
+        self.assertEqual([{'address': '10.0.0.3', 'floating_ips': []}],
+                         vifs[1]['fixed_ips'])
+        self.assertEqual([], vifs[2]['fixed_ips'])
+
+    def test_virtual_interface_get_all_addresses_by_fixed_address(self):
+        self._create_vif_addresses()
+        vifs = db.virtual_interface_get_all_addresses(
+                self.ctxt, fixed_address='10.0.0.3')
+        self.assertEqual(1, len(vifs))
+        self.assertEqual('fake2', vifs[0]['address'])
+        self.assertEqual([{'address': '10.0.0.3', 'floating_ips': []}],
+                         vifs[0]['fixed_ips'])
+        self.assertEqual([], db.virtual_interface_get_all_addresses(
+                self.ctxt, fixed_address='10.0.0.9'))
+
 
 class NetworkTestCase(test.TestCase, ModelsObjectComparatorMixin):
 
@@ -4722,6 +4962,25 @@ class ComputeNodeTestCase(test.TestCase, ModelsObjectComparatorMixin):
         nodes = db.compute_node_get_all(self.ctxt)
         self.assertEqual(len(nodes), 0)
 
+    def test_compute_node_get_all_updated_since(self):
+        since = timeutils.utcnow() - datetime.timedelta(minutes=1)
+        nodes = db.compute_node_get_all_updated_since(self.ctxt, since)
+        self.assertEqual(1, len(nodes))
+        new_stats = self._stats_as_dict(nodes[0]['stats'])
+        self._stats_equal(self.stats, new_stats)
+
+        since = timeutils.utcnow() + datetime.timedelta(minutes=1)
+        nodes = db.compute_node_get_all_updated_since(self.ctxt, since)
+        self.assertEqual([], nodes)
+
+    def test_compute_node_get_all_updated_since_deleted(self):
+        since = timeutils.utcnow() - datetime.timedelta(minutes=1)
+        db.compute_node_delete(self.ctxt, self.item['id'])
+        nodes = db.compute_node_get_all_updated_since(self.ctxt, since)
+        self.assertEqual(1, len(nodes))
+        self.assertEqual(self.item['id'], nodes[0]['id'])
+        self.assertTrue(nodes[0]['deleted'])
+
     def test_compute_node_search_by_hypervisor(self):
         nodes_created = []
         for i in xrange(3):
@@ -4766,6 +5025,22 @@ class ComputeNodeTestCase(test.TestCase, ModelsObjectComparatorMixin):
         for stat in updated_stats:
             self.assertEqual(stat['updated_at'], stats_updated_at[stat['key']])
 
+    def test_compute_node_update_without_stats(self):
+        compute_node_id = self.item['id']
+        item_updated = db.compute_node_update(self.ctxt, compute_node_id,
+                                              {'vcpus': 4})
+        self.assertEqual(4, item_updated['vcpus'])
+        self._stats_equal(self.stats,
+                          self._stats_as_dict(item_updated['stats']))
+
+    def test_compute_node_update_some_stats(self):
+        compute_node_id = self.item['id']
+        db.compute_node_update(self.ctxt, compute_node_id,
+                               {'stats': {'num_instances': 8}})
+        item_updated = db.compute_node_get(self.ctxt, compute_node_id)
+        stats = dict(self.stats, num_instances=8)
+        self._stats_equal(stats, self._stats_as_dict(item_updated['stats']))
+
     def test_compute_node_stat_prune(self):
         for stat in self.item['stats']:
             if stat['key'] == 'num_instances':
@@ -149,6 +149,27 @@ class FakeNetworkManager(network_manager.NetworkManager):
             return [ip for ip in self.fixed_ips
                     if ip['virtual_interface_id'] == vif_id]
 
+        def virtual_interface_get_all_addresses(self, context,
+                                                fixed_address=None):
+            vifs = []
+            for vif in self.vifs:
+                fixed_ips = []
+                for ip in self.fixed_ips_by_virtual_interface(context,
+                                                              vif['id']):
+                    if fixed_address not in (None, ip['address']):
+                        continue
+                    floating_ips = [floating_ip['address']
+                                    for floating_ip in self.floating_ips
+                                    if floating_ip['fixed_ip_id'] == ip['id']]
+                    fixed_ips.append({'address': ip['address'],
+                                      'floating_ips': floating_ips})
+                if fixed_address is not None and not fixed_ips:
+                    continue
+                network = self.network_get(context, vif['network_id'])
+                vifs.append(dict(vif, cidr_v6=network['cidr_v6'],
+                                 fixed_ips=fixed_ips))
+            return vifs
+
         def fixed_ip_disassociate(self, context, address):
             return True
 
@@ -20,6 +20,7 @@ import datetime
 import filecmp
 import os
 import random
+import StringIO
 import tempfile
 import time
 
@@ -478,6 +479,77 @@ class TestGlanceImageService(test.TestCase):
         self.flags(glance_num_retries=1)
         service.download(self.context, image_id, writer)
 
+    def _interrupted_stream_client(self, checksum=None):
+        class MyGlanceStubClient(glance_stubs.StubGlanceClient):
+            """A client whose first data stream breaks part way through."""
+            streams = 0
+            gets = 0
+
+            def get(self, image_id):
+                self.gets += 1
+                return type('GlanceTestChecksumMeta', (object,),
+                            {'checksum': checksum})
+
+            def data(self, image_id):
+                self.streams += 1
+                if self.streams == 1:
+                    return self._broken_stream()
+                return iter(['ab', 'cd', 'ef'])
+
+            def _broken_stream(self):
+                yield 'abc'
+                raise IOError('connection reset')
+
+        self.stubs.Set(time, 'sleep', lambda secs: None)
+        return MyGlanceStubClient()
+
+    def test_download_retries_interrupted_stream(self):
+        client = self._interrupted_stream_client(
+                'e80b5017098950fc58aad83c8c14978e')
+        service = self._create_image_service(client)
+        image_id = 1  # doesn't matter
+
+        writer = StringIO.StringIO()
+        self.assertRaises(IOError, service.download,
+                          self.context, image_id, writer)
+
+        client.streams = 0
+        writer = StringIO.StringIO()
+        self.flags(glance_num_retries=1)
+        service.download(self.context, image_id, writer)
+        self.assertEqual(writer.getvalue(), 'abcdef')
+        self.assertEqual(client.streams, 2)
+        self.assertEqual(client.gets, 1)
+
+    def test_download_retried_checksum_mismatch(self):
+        client = self._interrupted_stream_client('bogus')
+        service = self._create_image_service(client)
+        image_id = 1  # doesn't matter
+        self.flags(glance_num_retries=1)
+        self.assertRaises(exception.ImageChecksumMismatch,
+                          service.download, self.context, image_id,
+                          StringIO.StringIO())
+
+        client.streams = 0
+        self.flags(glance_verify_checksum=False)
+        service.download(self.context, image_id, StringIO.StringIO())
+
+    def test_download_checksum_left_to_glanceclient(self):
+        class MyGlanceStubClient(glance_stubs.StubGlanceClient):
+            """A client that fails if the image metadata is fetched."""
+            def get(self, image_id):
+                raise AssertionError('Image metadata should not be fetched')
+
+            def data(self, image_id):
+                return ['abc', 'def']
+
+        client = MyGlanceStubClient()
+        service = self._create_image_service(client)
+        image_id = 1  # doesn't matter
+        writer = StringIO.StringIO()
+        service.download(self.context, image_id, writer)
+        self.assertEqual(writer.getvalue(), 'abcdef')
+
     def test_download_file_url(self):
         class MyGlanceStubClient(glance_stubs.StubGlanceClient):
             """A client that returns a file url."""
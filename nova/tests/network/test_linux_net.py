@@ -870,3 +870,34 @@ class LinuxNetworkTestCase(test.TestCase):
         self.mox.ReplayAll()
         manager.defer_apply_off()
         self.assertFalse(manager.iptables_apply_deferred)
+
+    def test_ipset_set_members(self):
+        executes = []
+
+        def fake_execute(*cmd, **kwargs):
+            executes.append((cmd, kwargs.get('process_input')))
+            return '', ''
+
+        manager = linux_net.IpsetManager(fake_execute)
+        manager.set_members('nova-sg1-v4', 'inet', ['10.0.0.2', '10.0.0.1'])
+        self.assertEqual([(('ipset', '-exist', 'restore'),
+                           'create nova-sg1-v4 hash:ip family inet\n'
+                           'flush nova-sg1-v4\n'
+                           'add nova-sg1-v4 10.0.0.1\n'
+                           'add nova-sg1-v4 10.0.0.2\n')], executes)
+
+        # Only the changed members are sent
+        del executes[:]
+        manager.set_members('nova-sg1-v4', 'inet', ['10.0.0.2', '10.0.0.3'])
+        self.assertEqual([(('ipset', '-exist', 'restore'),
+                           'del nova-sg1-v4 10.0.0.1\n'
+                           'add nova-sg1-v4 10.0.0.3\n')], executes)
+
+        del executes[:]
+        manager.set_members('nova-sg1-v4', 'inet', ['10.0.0.3', '10.0.0.2'])
+        self.assertEqual([], executes)
+
+        manager.destroy('nova-sg1-v4')
+        manager.destroy('nova-sg1-v4')
+        self.assertEqual([(('ipset', 'destroy', 'nova-sg1-v4'), None)],
+                         executes)
@@ -16,6 +16,8 @@
 Tests For Filter Scheduler.
 """
 
+import random
+
 import mox
 
 from nova.compute import rpcapi as compute_rpcapi
@@ -748,3 +750,75 @@ class FilterSchedulerTestCase(test_scheduler.SchedulerTestCase):
         self.stubs.Set(self.driver, '_schedule', _return_no_host)
         self.assertRaises(exception.NoValidHost,
                           self.driver.select_hosts, self.context, {}, {})
+
+    def _batch_hosts(self):
+        hosts = []
+        for i, free_ram_mb in enumerate([4096, 2048, 8192, 512, 3072, 4096]):
+            # host0 and host5 are two nodes of the same host
+            hosts.append(fakes.FakeHostState('host%d' % (i % 5),
+                    'node%d' % i,
+                    {'free_ram_mb': free_ram_mb, 'total_usable_ram_mb': 8192,
+                     'free_disk_mb': 102400, 'total_usable_disk_gb': 100,
+                     'vcpus_total': 4, 'vcpus_used': 0, 'num_io_ops': 0,
+                     'num_instances': 0}))
+        return hosts
+
+    def _batch_select_hosts(self, num_instances, group=False):
+        self.flags(scheduler_default_filters=['RamFilter',
+                                              'GroupAntiAffinityFilter'],
+                   ram_allocation_ratio=1.0)
+        sched = fakes.FakeFilterScheduler()
+        instance_type = {'memory_mb': 1024, 'root_gb': 10,
+                         'ephemeral_gb': 0, 'vcpus': 1}
+        instance_properties = dict(instance_type, project_id='fake',
+                                   os_type='Linux')
+        filter_properties = {'instance_type': instance_type}
+        if group:
+            filter_properties['group_hosts'] = []
+        random.seed(42)
+        weighed_hosts = sched._select_hosts(self._batch_hosts(),
+                                            filter_properties,
+                                            instance_properties,
+                                            num_instances, group)
+        return [(h.obj.nodename, h.weight) for h in weighed_hosts]
+
+    def _assert_batch_matches_loop(self, num_instances, group=False):
+        expected = self._batch_select_hosts(num_instances, group)
+        self.flags(scheduler_batch_placement=True)
+        self.assertEqual(expected,
+                         self._batch_select_hosts(num_instances, group))
+
+    def test_batch_placement_matches_loop(self):
+        for num_instances in (2, 5, 30):
+            self._assert_batch_matches_loop(num_instances)
+
+    def test_batch_placement_host_subset_size(self):
+        self.flags(scheduler_host_subset_size=3)
+        for num_instances in (2, 5, 30):
+            self._assert_batch_matches_loop(num_instances)
+
+    def test_batch_placement_group_anti_affinity(self):
+        self._assert_batch_matches_loop(6, group=True)
+        selected = self._batch_select_hosts(6, group=True)
+        self.assertEqual(['node2', 'node0', 'node4', 'node1'],
+                         [node for node, weight in selected])
+
+    def test_batch_placement_filters_and_weighs_once(self):
+        self.flags(scheduler_batch_placement=True)
+        sched = fakes.FakeFilterScheduler()
+        hosts = self._batch_hosts()
+        calls = []
+
+        def _fake_get_filtered_hosts(hosts, filter_properties):
+            hosts = list(hosts)
+            calls.append(len(hosts))
+            return hosts
+
+        self.stubs.Set(sched.host_manager, 'get_filtered_hosts',
+                       _fake_get_filtered_hosts)
+        instance_properties = {'memory_mb': 1, 'root_gb': 0,
+                               'ephemeral_gb': 0, 'vcpus': 0}
+        weighed_hosts = sched._select_hosts(hosts, {}, instance_properties,
+                                            10, False)
+        self.assertEqual(10, len(weighed_hosts))
+        self.assertEqual([len(hosts)] + [1] * 10, calls)
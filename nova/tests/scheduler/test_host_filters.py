@@ -17,6 +17,7 @@ Tests For Scheduler Host Filters.
 
 import httplib
 
+import mox
 from oslo.config import cfg
 import stubout
 
@@ -27,6 +28,7 @@ from nova.openstack.common import timeutils
 from nova.scheduler import filters
 from nova.scheduler.filters import extra_specs_ops
 from nova.scheduler.filters import trusted_filter
+from nova.scheduler import host_manager
 from nova import servicegroup
 from nova import test
 from nova.tests.scheduler import fakes
@@ -404,6 +406,27 @@ class HostFiltersTestCase(test.NoDBTestCase):
 
         self.assertFalse(filt_cls.host_passes(host, filter_properties))
 
+    def test_affinity_filters_look_up_hosts_once(self):
+        uuids = ['fake-uuid1', 'fake-uuid2']
+        hosts = [fakes.FakeHostState('host%s' % i, 'node', {})
+                 for i in xrange(1, 4)]
+        filter_properties = {'context': self.context.elevated(),
+                             'scheduler_hints': {'same_host': uuids,
+                                                 'different_host': uuids}}
+        self.mox.StubOutWithMock(db, 'instance_get_hosts_by_uuids')
+        db.instance_get_hosts_by_uuids(mox.IgnoreArg(), uuids).AndReturn(
+                set(['host2']))
+        db.instance_get_hosts_by_uuids(mox.IgnoreArg(), uuids).AndReturn(
+                set(['host2']))
+        self.mox.ReplayAll()
+
+        filt_cls = self.class_map['SameHostFilter']()
+        result = filt_cls.filter_all(hosts, filter_properties)
+        self.assertEqual(['host2'], [h.host for h in result])
+        filt_cls = self.class_map['DifferentHostFilter']()
+        result = filt_cls.filter_all(hosts, filter_properties)
+        self.assertEqual(['host1', 'host3'], [h.host for h in result])
+
     def test_affinity_simple_cidr_filter_passes(self):
         filt_cls = self.class_map['SimpleCIDRAffinityFilter']()
         host = fakes.FakeHostState('host1', 'node1', {})
@@ -1342,6 +1365,22 @@ class HostFiltersTestCase(test.NoDBTestCase):
                                    {'service': service})
         self.assertFalse(filt_cls.host_passes(host, request))
 
+    def test_availability_zone_filter_aggregate_metadata_index(self):
+        filt_cls = self.class_map['AvailabilityZoneFilter']()
+        self.mox.StubOutWithMock(db, 'aggregate_metadata_get_all_by_host')
+        db.aggregate_metadata_get_all_by_host(self.context).AndReturn(
+                {'host1': {'availability_zone': set(['az1'])}})
+        self.mox.ReplayAll()
+
+        index = host_manager.AggregateMetadataIndex(self.context)
+        host1 = fakes.FakeHostState('host1', 'node1',
+                                    {'aggregate_metadata_index': index})
+        host2 = fakes.FakeHostState('host2', 'node2',
+                                    {'aggregate_metadata_index': index})
+        request = self._make_zone_request('az1')
+        self.assertTrue(filt_cls.host_passes(host1, request))
+        self.assertFalse(filt_cls.host_passes(host2, request))
+
     def test_retry_filter_disabled(self):
         # Test case where retry/re-scheduling is disabled.
         filt_cls = self.class_map['RetryFilter']()
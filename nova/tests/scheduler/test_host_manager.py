@@ -15,6 +15,9 @@
 """
 Tests For HostManager
 """
+import datetime
+
+from nova.compute import cached_images
 from nova.compute import task_states
 from nova.compute import vm_states
 from nova import db
@@ -358,6 +361,114 @@ class HostManagerTestCase(test.NoDBTestCase):
                          8388608)
 
 
+class AggregateMetadataIndexTestCase(test.NoDBTestCase):
+    """Test case for AggregateMetadataIndex class."""
+
+    def test_get_by_host(self):
+        context = 'fake_context'
+        self.mox.StubOutWithMock(db, 'aggregate_metadata_get_all_by_host')
+        db.aggregate_metadata_get_all_by_host(context).AndReturn(
+                {'host1': {'availability_zone': set(['az1']),
+                           'ssd': set(['true'])}})
+        self.mox.ReplayAll()
+
+        index = host_manager.AggregateMetadataIndex(context)
+        self.assertEqual({'availability_zone': set(['az1']),
+                          'ssd': set(['true'])},
+                         index.get_by_host('host1'))
+        self.assertEqual({'ssd': set(['true'])},
+                         index.get_by_host('host1', key='ssd'))
+        self.assertEqual({}, index.get_by_host('host1', key='gpu'))
+        self.assertEqual({}, index.get_by_host('host2'))
+
+    def test_get_all_host_states_sets_index(self):
+        context = 'fake_context'
+        hm = host_manager.HostManager()
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        db.compute_node_get_all(context).AndReturn(fakes.COMPUTE_NODES)
+        self.mox.ReplayAll()
+
+        host_states = list(hm.get_all_host_states(context))
+        index = host_states[0].aggregate_metadata_index
+        self.assertTrue(isinstance(index,
+                                   host_manager.AggregateMetadataIndex))
+        for host_state in host_states:
+            self.assertTrue(host_state.aggregate_metadata_index is index)
+
+
+class FilterStatisticsTestCase(test.NoDBTestCase):
+    """Test case for FilterStatistics class."""
+
+    def test_get_stats(self):
+        stats = host_manager.FilterStatistics(2)
+        stats.record(FakeFilterClass1, 10, 10, 5.0)
+        stats.record(FakeFilterClass1, 10, 5, 1.0)
+        stats.record(FakeFilterClass1, 10, 0, 1.0)
+        self.assertEqual({'FakeFilterClass1': {'runs': 2,
+                                               'hosts': 20,
+                                               'rejected': 15,
+                                               'rejection_rate': 0.75,
+                                               'time': 2.0,
+                                               'time_per_host': 0.1}},
+                         stats.get_stats())
+
+    def test_get_stats_disabled(self):
+        stats = host_manager.FilterStatistics(0)
+        stats.record(FakeFilterClass1, 10, 5, 1.0)
+        self.assertEqual({}, stats.get_stats())
+
+    def test_order(self):
+        class FakeFilterClass3(filters.BaseHostFilter):
+            pass
+
+        class FakeFilterClass4(filters.BaseHostFilter):
+            pass
+
+        stats = host_manager.FilterStatistics(10)
+        # 1.0 second per rejected host
+        stats.record(FakeFilterClass1, 10, 8, 2.0)
+        # 0.1 second per rejected host
+        stats.record(FakeFilterClass2, 10, 0, 1.0)
+        # Never rejects a host
+        stats.record(FakeFilterClass3, 10, 10, 0.1)
+        self.assertEqual([FakeFilterClass4, FakeFilterClass2,
+                          FakeFilterClass1, FakeFilterClass3],
+                         stats.order([FakeFilterClass1, FakeFilterClass2,
+                                      FakeFilterClass3, FakeFilterClass4]))
+
+    def test_get_filtered_hosts_records_stats(self):
+        self.flags(scheduler_default_filters=['FakeFilterClass1'])
+        hm = host_manager.HostManager()
+        hm.filter_classes = [FakeFilterClass1]
+        fake_hosts = [host_manager.HostState('fake_host%s' % x, 'fake-node')
+                      for x in xrange(4)]
+
+        def fake_filter_one(_self, obj, filter_props):
+            return obj.host != 'fake_host0'
+
+        self.stubs.Set(FakeFilterClass1, '_filter_one', fake_filter_one)
+        hm.get_filtered_hosts(fake_hosts, {})
+        stats = hm.get_filter_stats()['FakeFilterClass1']
+        self.assertEqual(1, stats['runs'])
+        self.assertEqual(4, stats['hosts'])
+        self.assertEqual(1, stats['rejected'])
+
+    def test_get_filtered_hosts_reorders_filters(self):
+        self.flags(scheduler_default_filters=['FakeFilterClass1',
+                                              'FakeFilterClass2'],
+                   scheduler_reorder_filters=True)
+        hm = host_manager.HostManager()
+        hm.filter_classes = [FakeFilterClass1, FakeFilterClass2]
+        hm.filter_stats.record(FakeFilterClass1, 10, 10, 1.0)
+        hm.filter_stats.record(FakeFilterClass2, 10, 5, 1.0)
+        self.mox.StubOutWithMock(hm.filter_handler, 'get_filtered_objects')
+        hm.filter_handler.get_filtered_objects(
+                [FakeFilterClass2, FakeFilterClass1], [], {},
+                filter_stats=hm.filter_stats).AndReturn([])
+        self.mox.ReplayAll()
+        hm.get_filtered_hosts([], {})
+
+
 class HostManagerChangedNodesTestCase(test.NoDBTestCase):
     """Test case for HostManager class."""
 
@@ -416,6 +527,87 @@ class HostManagerChangedNodesTestCase(test.NoDBTestCase):
         self.assertEqual(len(host_states_map), 0)
 
 
+class HostManagerHostStateCacheTestCase(test.NoDBTestCase):
+    """Test case for HostManager with scheduler_host_state_cache enabled."""
+
+    def setUp(self):
+        super(HostManagerHostStateCacheTestCase, self).setUp()
+        self.flags(scheduler_host_state_cache=True,
+                   scheduler_host_state_full_sync_interval=300)
+        self.host_manager = host_manager.HostManager()
+        self.addCleanup(timeutils.clear_time_override)
+
+    def _compute_node(self, compute_id, free_ram_mb, **kwargs):
+        for compute in fakes.COMPUTE_NODES:
+            if compute['id'] == compute_id:
+                compute = dict(compute, free_ram_mb=free_ram_mb, deleted=0)
+                compute.update(kwargs)
+                return compute
+
+    def test_get_all_host_states_applies_deltas(self):
+        context = 'fake_context'
+        timeutils.set_time_override()
+        start = timeutils.utcnow()
+        services = [dict(compute['service'], topic='compute')
+                    for compute in fakes.COMPUTE_NODES if compute['service']]
+
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        self.mox.StubOutWithMock(db, 'compute_node_get_all_updated_since')
+        self.mox.StubOutWithMock(db, 'service_get_all')
+        db.compute_node_get_all(context).AndReturn(fakes.COMPUTE_NODES)
+        since = start - datetime.timedelta(
+                seconds=host_manager.HOST_STATE_SYNC_OVERLAP)
+        db.compute_node_get_all_updated_since(context, since).AndReturn(
+                [self._compute_node(1, 256, updated_at=start),
+                 self._compute_node(4, 8192, deleted=4)])
+        db.service_get_all(context).AndReturn(services)
+        self.mox.ReplayAll()
+
+        self.host_manager.get_all_host_states(context)
+        timeutils.advance_time_seconds(60)
+        self.host_manager.get_all_host_states(context)
+
+        host_states_map = self.host_manager.host_state_map
+        self.assertEqual(3, len(host_states_map))
+        self.assertNotIn(('host4', 'node4'), host_states_map)
+        self.assertEqual(256, host_states_map[('host1', 'node1')].free_ram_mb)
+        self.assertEqual(1024,
+                         host_states_map[('host2', 'node2')].free_ram_mb)
+
+    def test_get_all_host_states_full_sync_interval(self):
+        context = 'fake_context'
+        timeutils.set_time_override()
+
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        db.compute_node_get_all(context).AndReturn(fakes.COMPUTE_NODES)
+        db.compute_node_get_all(context).AndReturn(fakes.COMPUTE_NODES[:2])
+        self.mox.ReplayAll()
+
+        self.host_manager.get_all_host_states(context)
+        timeutils.advance_time_seconds(300)
+        self.host_manager.get_all_host_states(context)
+
+        self.assertEqual(2, len(self.host_manager.host_state_map))
+
+    def test_update_compute_node(self):
+        context = 'fake_context'
+
+        self.mox.StubOutWithMock(db, 'compute_node_get_all')
+        db.compute_node_get_all(context).AndReturn(fakes.COMPUTE_NODES)
+        self.mox.ReplayAll()
+        self.host_manager.get_all_host_states(context)
+
+        compute = self._compute_node(3, 128,
+                updated_at=timeutils.strtime(timeutils.utcnow()))
+        self.host_manager.update_compute_node(compute)
+        host_state = self.host_manager.host_state_map[('host3', 'node3')]
+        self.assertEqual(128, host_state.free_ram_mb)
+
+        self.host_manager.update_compute_node(dict(compute, deleted=3))
+        self.assertNotIn(('host3', 'node3'),
+                         self.host_manager.host_state_map)
+
+
 class HostStateTestCase(test.NoDBTestCase):
     """Test case for HostState class."""
 
@@ -452,6 +644,24 @@ class HostStateTestCase(test.NoDBTestCase):
         self.assertEqual(4, host.num_instances_by_os_type['linux'])
         self.assertEqual(1, host.num_instances_by_os_type['windoze'])
         self.assertEqual(42, host.num_io_ops)
+        self.assertEqual(None, host.cached_images)
+
+    def test_cached_images_from_compute_node(self):
+        images = cached_images.CachedImages()
+        images.add(cached_images.fingerprint('image-1'))
+        stats = [dict(key=cached_images.STAT_KEY, value=images.encode())]
+        compute = dict(stats=stats, memory_mb=0, free_disk_gb=0, local_gb=0,
+                       local_gb_used=0, free_ram_mb=0, vcpus=0, vcpus_used=0,
+                       updated_at=None)
+
+        host = host_manager.HostState("fakehost", "fakenode")
+        host.update_from_compute_node(compute)
+        self.assertIn(cached_images.fingerprint('image-1'),
+                      host.cached_images)
+
+        stats[0]['value'] = 'bogus'
+        host.update_from_compute_node(compute)
+        self.assertEqual(None, host.cached_images)
 
     def test_stat_consumption_from_instance(self):
         host = host_manager.HostState("fakehost", "fakenode")
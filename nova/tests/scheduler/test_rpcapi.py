@@ -81,6 +81,15 @@ class SchedulerRpcAPITestCase(test.NoDBTestCase):
                 host='fake_host', capabilities='fake_capabilities',
                 version='2.4')
 
+    def test_update_compute_node(self):
+        self._test_scheduler_api('update_compute_node',
+                rpc_method='fanout_cast', compute_node='fake_compute_node',
+                version='2.7')
+
+    def test_get_filter_stats(self):
+        self._test_scheduler_api('get_filter_stats', rpc_method='call',
+                version='2.8')
+
     def test_select_hosts(self):
         self._test_scheduler_api('select_hosts', rpc_method='call',
                 request_spec='fake_request_spec',
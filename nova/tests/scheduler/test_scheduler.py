@@ -124,6 +124,22 @@ class SchedulerManagerTestCase(test.NoDBTestCase):
                 service_name=service_name, host=host,
                 capabilities=[capab1, capab2, capab3])
 
+    def test_update_compute_node(self):
+        compute_node = {'id': 1, 'hypervisor_hostname': 'fake_node'}
+
+        self.mox.StubOutWithMock(self.manager.driver, 'update_compute_node')
+        self.manager.driver.update_compute_node(compute_node)
+        self.mox.ReplayAll()
+        self.manager.update_compute_node(self.context,
+                compute_node=compute_node)
+
+    def test_get_filter_stats(self):
+        self.mox.StubOutWithMock(self.manager.driver, 'get_filter_stats')
+        self.manager.driver.get_filter_stats().AndReturn('fake_stats')
+        self.mox.ReplayAll()
+        self.assertEqual('fake_stats',
+                         self.manager.get_filter_stats(self.context))
+
     def test_show_host_resources(self):
         host = 'fake_host'
 
@@ -0,0 +1,106 @@
+# Copyright (c) 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Tests For Vectorized Filter Scheduler.
+"""
+
+from nova.scheduler import filter_scheduler
+from nova.scheduler import vectorized_scheduler
+from nova import test
+from nova.tests.scheduler import fakes
+
+
+class VectorizedFilterSchedulerTestCase(test.NoDBTestCase):
+    """Test case for Vectorized Filter Scheduler."""
+
+    def setUp(self):
+        super(VectorizedFilterSchedulerTestCase, self).setUp()
+        if vectorized_scheduler.numpy is None:
+            self.skipTest('numpy module not found')
+        self.flags(scheduler_default_filters=['RamFilter', 'CoreFilter',
+                                              'DiskFilter', 'IoOpsFilter',
+                                              'NumInstancesFilter',
+                                              'GroupAntiAffinityFilter'],
+                   ram_allocation_ratio=1.0,
+                   max_instances_per_host=3)
+        self.instance_type = {'memory_mb': 1024, 'root_gb': 10,
+                              'ephemeral_gb': 0, 'vcpus': 1}
+        self.instance_properties = dict(self.instance_type,
+                                        project_id='fake', os_type='Linux')
+
+    def _hosts(self):
+        hosts = []
+        for i, free_ram_mb in enumerate([4096, 2048, 8192, 512, 3072]):
+            hosts.append(fakes.FakeHostState('host%d' % i, 'node%d' % i,
+                    {'free_ram_mb': free_ram_mb, 'total_usable_ram_mb': 8192,
+                     'free_disk_mb': 102400, 'total_usable_disk_gb': 100,
+                     'vcpus_total': 4, 'vcpus_used': i, 'num_io_ops': 0,
+                     'num_instances': 0}))
+        return hosts
+
+    def _select_hosts(self, sched, num_instances, group=False, hosts=None):
+        if hosts is None:
+            hosts = self._hosts()
+        filter_properties = {'instance_type': self.instance_type}
+        if group:
+            filter_properties['group_hosts'] = []
+        weighed_hosts = sched._select_hosts(hosts, filter_properties,
+                                            self.instance_properties,
+                                            num_instances, group)
+        return [(h.obj.host, h.weight) for h in weighed_hosts]
+
+    def test_requires_numpy(self):
+        self.stubs.Set(vectorized_scheduler, 'numpy', None)
+        self.assertRaises(ImportError,
+                          vectorized_scheduler.VectorizedFilterScheduler)
+
+    def test_select_hosts_matches_filter_scheduler(self):
+        sched = vectorized_scheduler.VectorizedFilterScheduler()
+        expected_sched = filter_scheduler.FilterScheduler()
+        for num_instances in (1, 5, 20):
+            self.assertEqual(self._select_hosts(expected_sched,
+                                                num_instances),
+                             self._select_hosts(sched, num_instances))
+
+    def test_select_hosts_group_anti_affinity(self):
+        sched = vectorized_scheduler.VectorizedFilterScheduler()
+        selected = self._select_hosts(sched, 5, group=True)
+        self.assertEqual(['host2', 'host0', 'host4', 'host1'],
+                         [host for host, weight in selected])
+
+    def test_select_hosts_group_anti_affinity_multi_node(self):
+        hosts = []
+        for host, node in [('host0', 'node0'), ('host0', 'node1'),
+                           ('host1', 'node2')]:
+            hosts.append(fakes.FakeHostState(host, node,
+                    {'free_ram_mb': 8192, 'total_usable_ram_mb': 8192,
+                     'free_disk_mb': 102400, 'total_usable_disk_gb': 100,
+                     'vcpus_total': 4, 'vcpus_used': 0, 'num_io_ops': 0,
+                     'num_instances': 0}))
+        sched = vectorized_scheduler.VectorizedFilterScheduler()
+        selected = self._select_hosts(sched, 3, group=True, hosts=hosts)
+        # The other node of the first host chosen is not used
+        self.assertEqual(['host0', 'host1'],
+                         [host for host, weight in selected])
+
+    def test_select_hosts_sets_limits(self):
+        sched = vectorized_scheduler.VectorizedFilterScheduler()
+        hosts = self._hosts()
+        weighed_hosts = sched._select_hosts(hosts,
+                {'instance_type': self.instance_type},
+                self.instance_properties, 1, False)
+        self.assertEqual({'memory_mb': 8192.0, 'disk_gb': 100.0,
+                          'vcpu': 64.0},
+                         weighed_hosts[0].obj.limits)
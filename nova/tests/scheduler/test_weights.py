@@ -16,6 +16,7 @@
 Tests For Scheduler weights.
 """
 
+from nova.compute import cached_images
 from nova import context
 from nova.scheduler import weights
 from nova import test
@@ -34,8 +35,9 @@ class TestWeighedHost(test.NoDBTestCase):
     def test_all_weighers(self):
         classes = weights.all_weighers()
         class_names = [cls.__name__ for cls in classes]
-        self.assertEqual(len(classes), 1)
+        self.assertEqual(len(classes), 2)
         self.assertIn('RAMWeigher', class_names)
+        self.assertIn('ImageLocalityWeigher', class_names)
 
 
 class RamWeigherTestCase(test.NoDBTestCase):
@@ -101,3 +103,46 @@ class RamWeigherTestCase(test.NoDBTestCase):
         weighed_host = self._get_weighed_host(hostinfo_list)
         self.assertEqual(weighed_host.weight, 8192 * 2)
         self.assertEqual(weighed_host.obj.host, 'host4')
+
+
+class ImageLocalityWeigherTestCase(test.NoDBTestCase):
+    def setUp(self):
+        super(ImageLocalityWeigherTestCase, self).setUp()
+        self.weight_handler = weights.HostWeightHandler()
+        self.weight_classes = self.weight_handler.get_matching_classes(
+                ['nova.scheduler.weights.image_locality.'
+                 'ImageLocalityWeigher'])
+
+    def _get_weighed_hosts(self, hosts, image_ref):
+        weight_properties = {'request_spec': {
+                'instance_properties': {'image_ref': image_ref}}}
+        return self.weight_handler.get_weighed_objects(self.weight_classes,
+                hosts, weight_properties)
+
+    def _get_hosts(self):
+        images = cached_images.CachedImages()
+        images.add(cached_images.fingerprint('cached-image'))
+        return [fakes.FakeHostState('host1', 'node1', {}),
+                fakes.FakeHostState('host2', 'node2',
+                                    {'cached_images': images}),
+                fakes.FakeHostState('host3', 'node3',
+                                    {'cached_images':
+                                     cached_images.CachedImages()})]
+
+    def test_disabled_by_default(self):
+        weighed_hosts = self._get_weighed_hosts(self._get_hosts(),
+                                                'cached-image')
+        self.assertEqual([0.0] * 3, [host.weight for host in weighed_hosts])
+
+    def test_host_with_image_wins(self):
+        self.flags(image_locality_weight_multiplier=1024.0)
+        weighed_hosts = self._get_weighed_hosts(self._get_hosts(),
+                                                'cached-image')
+        self.assertEqual(weighed_hosts[0].obj.host, 'host2')
+        self.assertEqual(weighed_hosts[0].weight, 1024.0)
+        self.assertEqual([0.0, 0.0],
+                         [host.weight for host in weighed_hosts[1:]])
+
+        weighed_hosts = self._get_weighed_hosts(self._get_hosts(),
+                                                'other-image')
+        self.assertEqual([0.0] * 3, [host.weight for host in weighed_hosts])
@@ -18,6 +18,7 @@
 """Unit Tests for network code."""
 
 from nova.network import linux_net
+from nova.openstack.common import timeutils
 from nova import test
 
 
@@ -253,3 +254,113 @@ class IptablesManagerTestCase(test.TestCase):
                                                self.manager.ipv4['filter'],
                                                'filter')
         self.assertEqual(current_lines, new_lines)
+
+    def test_top_rules_keep_counts(self):
+        current_lines = list(self.sample_filter)
+        current_lines[12] = '[42:4200] -A FORWARD -j nova-filter-top'
+        new_lines = self.manager._modify_rules(current_lines,
+                                               self.manager.ipv4['filter'],
+                                               'filter')
+        self.assertTrue('[42:4200] -A FORWARD -j nova-filter-top'
+                        in new_lines)
+        self.assertFalse('[0:0] -A FORWARD -j nova-filter-top' in new_lines)
+
+    def test_remove_rules_are_flushed(self):
+        current_lines = list(self.sample_filter)
+        table = self.manager.ipv4['filter']
+        rules = ['-i virbr0 -p udp -m udp --dport 53 -j ACCEPT',
+                 '-i virbr0 -p tcp -m tcp --dport 53 -j ACCEPT',
+                 '-i virbr0 -p udp -m udp --dport 67 -j ACCEPT',
+                 '-s 10.0.0.1 -j DROP',
+                 '-s 10.0.0.2 -j DROP']
+        for rule in rules:
+            table.add_rule('INPUT', rule, wrap=False)
+            table.remove_rule('INPUT', rule, wrap=False)
+        new_lines = self.manager._modify_rules(current_lines, table,
+                                               'filter')
+        for rule in rules:
+            self.assertFalse('[0:0] -A INPUT %s' % rule in new_lines)
+        self.assertEqual([], table.remove_rules)
+        self.assertTrue('[0:0] -A INPUT -i virbr0 -p tcp -m tcp --dport 67 '
+                        '-j ACCEPT' in new_lines)
+
+    def test_modify_chains(self):
+        table = self.manager.ipv4['filter']
+        table.mark_applied()
+        self.assertEqual([], self.manager._modify_chains(table, 'filter'))
+
+        table.add_chain('inst')
+        table.add_rule('inst', '-s 10.0.0.1 -j ACCEPT')
+        table.add_rule('inst', '-j DROP', top=True)
+        table.add_rule('local', '-j $inst')
+        new_lines = self.manager._modify_chains(table, 'filter')
+        self.assertEqual(['*filter',
+                          ':%s-inst - [0:0]' % self.binary_name,
+                          ':%s-local - [0:0]' % self.binary_name,
+                          '[0:0] -A %s-inst -j DROP' % self.binary_name,
+                          '[0:0] -A %s-inst -s 10.0.0.1 -j ACCEPT' %
+                          self.binary_name,
+                          '[0:0] -A %s-local -j %s-inst' %
+                          (self.binary_name, self.binary_name),
+                          'COMMIT'], new_lines)
+
+        table.mark_applied()
+        table.remove_chain('inst')
+        new_lines = self.manager._modify_chains(table, 'filter')
+        self.assertEqual(['*filter',
+                          ':%s-inst - [0:0]' % self.binary_name,
+                          ':%s-local - [0:0]' % self.binary_name,
+                          '-X %s-inst' % self.binary_name,
+                          'COMMIT'], new_lines)
+
+    def _fake_execute(self, executes):
+        def fake_execute(*cmd, **kwargs):
+            executes.append(cmd)
+            if cmd[0] == 'iptables-save':
+                return '\n'.join(self.sample_filter + self.sample_nat), ''
+            return '', ''
+        return fake_execute
+
+    def test_apply_dirty_chains(self):
+        self.flags(iptables_incremental_apply=True, use_ipv6=False)
+        executes = []
+        manager = linux_net.IptablesManager(self._fake_execute(executes))
+        table = manager.ipv4['filter']
+        table.add_chain('inst')
+
+        # The first apply rewrites all of the tables
+        manager._apply()
+        self.assertEqual([('iptables-save', '-c'),
+                          ('iptables-restore', '-c')], executes)
+
+        del executes[:]
+        manager._apply()
+        self.assertEqual([], executes)
+
+        table.add_rule('inst', '-j DROP')
+        manager._apply()
+        self.assertEqual([('iptables-restore', '-c', '--noflush')], executes)
+
+        # Changing a shared chain rewrites all of the tables
+        del executes[:]
+        table.add_rule('FORWARD', '-j ACCEPT', wrap=False)
+        manager._apply()
+        self.assertEqual([('iptables-save', '-c'),
+                          ('iptables-restore', '-c')], executes)
+
+    def test_apply_dirty_chains_full_apply_interval(self):
+        self.flags(iptables_incremental_apply=True, use_ipv6=False,
+                   iptables_full_apply_interval=600)
+        executes = []
+        manager = linux_net.IptablesManager(self._fake_execute(executes))
+        manager.ipv4['filter'].add_chain('inst')
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        manager._apply()
+
+        del executes[:]
+        timeutils.advance_time_seconds(601)
+        manager.ipv4['filter'].add_rule('inst', '-j DROP')
+        manager._apply()
+        self.assertEqual([('iptables-save', '-c'),
+                          ('iptables-restore', '-c')], executes)
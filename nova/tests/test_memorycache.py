@@ -0,0 +1,102 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nova import memorycache
+from nova.openstack.common import timeutils
+from nova import test
+
+
+class MemoryCacheTestCase(test.TestCase):
+    def setUp(self):
+        super(MemoryCacheTestCase, self).setUp()
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+
+    def _stats(self, client):
+        return client.get_stats()[0][1]
+
+    def test_get_client_without_servers(self):
+        self.flags(memcached_servers=None)
+        self.assertTrue(isinstance(memorycache.get_client(),
+                                   memorycache.Client))
+
+    def test_set_get_delete(self):
+        client = memorycache.Client()
+        self.assertTrue(client.set('foo', 'bar'))
+        self.assertEqual('bar', client.get('foo'))
+        client.delete('foo')
+        self.assertEqual(None, client.get('foo'))
+
+    def test_add_incr(self):
+        client = memorycache.Client()
+        self.assertTrue(client.add('foo', '1'))
+        self.assertFalse(client.add('foo', '5'))
+        self.assertEqual(3, client.incr('foo', 2))
+        self.assertEqual('3', client.get('foo'))
+        self.assertEqual(None, client.incr('bar'))
+
+    def test_expire(self):
+        client = memorycache.Client()
+        client.set('foo', 'bar', time=10)
+        client.set('baz', 'qux', time=20)
+        client.set('forever', 'value')
+        timeutils.advance_time_seconds(10)
+        self.assertEqual(None, client.get('foo'))
+        self.assertEqual('qux', client.get('baz'))
+        timeutils.advance_time_seconds(10)
+        self.assertEqual(None, client.get('baz'))
+        self.assertEqual('value', client.get('forever'))
+        self.assertEqual(2, self._stats(client)['expired'])
+
+    def test_set_again_extends_timeout(self):
+        client = memorycache.Client()
+        client.set('foo', 'bar', time=10)
+        timeutils.advance_time_seconds(5)
+        client.set('foo', 'baz', time=10)
+        timeutils.advance_time_seconds(5)
+        self.assertEqual('baz', client.get('foo'))
+        timeutils.advance_time_seconds(5)
+        self.assertEqual(None, client.get('foo'))
+
+    def test_evict_least_recently_used(self):
+        self.flags(memorycache_max_entries=2)
+        client = memorycache.Client()
+        client.set('a', 1)
+        client.set('b', 2)
+        client.get('a')
+        client.set('c', 3)
+        self.assertEqual(None, client.get('b'))
+        self.assertEqual(1, client.get('a'))
+        self.assertEqual(3, client.get('c'))
+        self.assertEqual(1, self._stats(client)['evictions'])
+
+    def test_unbounded_by_default(self):
+        client = memorycache.Client()
+        for i in range(100):
+            client.set(i, i)
+        self.assertEqual(100, self._stats(client)['curr_items'])
+        self.assertEqual(0, self._stats(client)['evictions'])
+
+    def test_stats(self):
+        client = memorycache.Client()
+        client.set('foo', 'bar')
+        client.get('foo')
+        client.get('missing')
+        stats = self._stats(client)
+        self.assertEqual(1, stats['curr_items'])
+        self.assertEqual(1, stats['get_hits'])
+        self.assertEqual(1, stats['get_misses'])
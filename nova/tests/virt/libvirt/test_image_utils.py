@@ -15,6 +15,7 @@
 #    under the License.
 
 import os
+import struct
 
 from nova import test
 from nova import utils
@@ -114,6 +115,55 @@ disk size: 96K
             self.assertEquals(i, d_size)
             self.mox.UnsetStubs()
 
+    def _write_qcow2(self, path, virtual_size, backing_file=None):
+        backing_offset = backing_file and 72 or 0
+        backing_size = backing_file and len(backing_file) or 0
+        with open(path, 'wb') as f:
+            f.write(struct.pack('>4sIQIIQ', 'QFI\xfb', 2, backing_offset,
+                                backing_size, 16, virtual_size))
+            f.write('\0' * (72 - f.tell()))
+            if backing_file:
+                f.write(backing_file)
+
+    def test_disk_backing_qcow2_header(self):
+        self.mox.StubOutWithMock(utils, 'execute')
+        self.mox.ReplayAll()
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'disk')
+            self._write_qcow2(path, 2048, '/var/lib/nova/_base/abcd')
+            self.assertEquals('abcd',
+                              libvirt_utils.get_disk_backing_file(path))
+            self.assertEquals('/var/lib/nova/_base/abcd',
+                              libvirt_utils.get_disk_backing_file(
+                                  path, basename=False))
+            self.assertEquals(2048, libvirt_utils.get_disk_size(path))
+
+            self._write_qcow2(path, 4096, '../_base/abcd')
+            self.assertEquals(os.path.join(tmpdir, '../_base/abcd'),
+                              libvirt_utils.get_disk_backing_file(
+                                  path, basename=False))
+
+            self._write_qcow2(path, 4096)
+            self.assertEquals(None,
+                              libvirt_utils.get_disk_backing_file(path))
+            self.assertEquals(4096, libvirt_utils.get_disk_size(path))
+
+    def test_disk_backing_not_qcow2(self):
+        with utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'disk')
+            with open(path, 'wb') as f:
+                f.write('\0' * 512)
+            output = ("image: %s\n"
+                      "file format: raw\n"
+                      "virtual size: 512 (512 bytes)\n"
+                      "disk size: 4.0K\n") % path
+            self.mox.StubOutWithMock(utils, 'execute')
+            utils.execute('env', 'LC_ALL=C', 'LANG=C',
+                          'qemu-img', 'info', path).AndReturn((output, ''))
+            self.mox.ReplayAll()
+            self.assertEquals(None,
+                              libvirt_utils.get_disk_backing_file(path))
+
     def test_qemu_info_canon(self):
         path = "disk.config"
         example_output = """image: disk.config
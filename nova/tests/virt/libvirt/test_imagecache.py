@@ -18,6 +18,7 @@
 
 import contextlib
 import cStringIO
+import datetime
 import hashlib
 import json
 import os
@@ -27,9 +28,11 @@ from oslo.config import cfg
 
 from nova.compute import vm_states
 from nova import conductor
+from nova import context
 from nova import db
 from nova.openstack.common import importutils
 from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
 from nova import test
 from nova import utils
 from nova.virt.libvirt import imagecache
@@ -970,3 +973,79 @@ class ImageCacheManagerTestCase(test.TestCase):
             compute.conductor_api = conductor.API()
             compute._run_image_cache_manager_pass(None)
             self.assertTrue(was['called'])
+
+    def test_compute_manager_prefetch(self):
+        now = timeutils.utcnow()
+        timeutils.set_time_override(now)
+        self.addCleanup(timeutils.clear_time_override)
+
+        def fake_get_popular_image_refs(context, created_since, limit):
+            self.assertEqual(now - datetime.timedelta(seconds=86400),
+                             created_since)
+            self.assertEqual(2, limit)
+            return ['2', '3']
+
+        prefetched = []
+
+        def fake_prefetch_images(context, image_ids, max_bytes):
+            prefetched.append((image_ids, max_bytes))
+
+        self.flags(image_prefetch_interval=3600, image_prefetch_count=2,
+                   image_prefetch_max_mb=1)
+        self.stubs.Set(db, 'instance_get_popular_image_refs',
+                       fake_get_popular_image_refs)
+        compute = importutils.import_object(CONF.compute_manager)
+        self.flags(use_local=True, group='conductor')
+        compute.conductor_api = conductor.API()
+        self.stubs.Set(compute.driver, 'prefetch_images',
+                       fake_prefetch_images)
+        compute._prefetch_popular_images(None)
+        self.assertEqual(prefetched, [(['2', '3'], 1024 * 1024)])
+
+    def test_compute_manager_prefetch_keystone_without_token(self):
+        self.flags(image_prefetch_interval=3600, auth_strategy='keystone')
+        compute = importutils.import_object(CONF.compute_manager)
+
+        def fail(*args, **kwargs):
+            self.fail('Images should not be pre-fetched')
+
+        self.stubs.Set(compute.conductor_api,
+                       'instance_get_popular_image_refs', fail)
+        self.stubs.Set(compute.driver, 'prefetch_images', fail)
+        compute._prefetch_popular_images(context.get_admin_context())
+
+    def test_verify_base_images_keeps_prefetched(self):
+        hashed = hashlib.sha1('42').hexdigest()
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir)
+            self.flags(remove_unused_base_images=True)
+            base_dir = os.path.join(tmpdir, '_base')
+            os.mkdir(base_dir)
+            base_filename = os.path.join(base_dir, hashed)
+            with open(base_filename, 'w') as f:
+                f.write('prefetched')
+            old = time.time() - (25 * 3600)
+            os.utime(base_filename, (old, old))
+
+            image_cache_manager = imagecache.ImageCacheManager()
+            image_cache_manager.prefetched_images = set(['42'])
+            image_cache_manager.verify_base_images(None, [])
+            self.assertEqual(image_cache_manager.active_base_files,
+                             [base_filename])
+            self.assertEqual(image_cache_manager.removable_base_files, [])
+            self.assertTrue(os.path.exists(base_filename))
+
+            image_cache_manager.prefetched_images = set()
+            image_cache_manager.verify_base_images(None, [])
+            self.assertFalse(os.path.exists(base_filename))
+
+    def test_list_cached_images(self):
+        hashed = hashlib.sha1('42').hexdigest()
+        with utils.tempdir() as tmpdir:
+            self.assertEqual([], imagecache.list_cached_images(
+                    os.path.join(tmpdir, 'missing')))
+            for ent in (hashed, hashed + '_10737418240', hashed + '.info',
+                        'kernel-id', 'Z' * len(hashed)):
+                with open(os.path.join(tmpdir, ent), 'w') as f:
+                    f.write('x')
+            self.assertEqual([hashed], imagecache.list_cached_images(tmpdir))
@@ -19,12 +19,15 @@ import copy
 import errno
 import eventlet
 import fixtures
+import hashlib
+import httplib
 import json
 import mox
 import os
 import re
 import shutil
 import tempfile
+import urllib2
 
 from lxml import etree
 from oslo.config import cfg
@@ -39,6 +42,7 @@ from nova.compute import vm_states
 from nova import context
 from nova import db
 from nova import exception
+from nova.image import glance
 from nova.openstack.common import fileutils
 from nova.openstack.common import importutils
 from nova.openstack.common import jsonutils
@@ -62,6 +66,7 @@ from nova.virt.libvirt import config as vconfig
 from nova.virt.libvirt import driver as libvirt_driver
 from nova.virt.libvirt import firewall
 from nova.virt.libvirt import imagebackend
+from nova.virt.libvirt import imagecache
 from nova.virt.libvirt import utils as libvirt_utils
 from nova.virt import netutils
 
@@ -2548,20 +2553,6 @@ class LibvirtConnTestCase(test.TestCase):
         os.path.getsize('/test/disk').AndReturn((10737418240))
         os.path.getsize('/test/disk.local').AndReturn((3328599655))
 
-        ret = ("image: /test/disk\n"
-               "file format: raw\n"
-               "virtual size: 20G (21474836480 bytes)\n"
-               "disk size: 3.1G\n"
-               "cluster_size: 2097152\n"
-               "backing file: /test/dummy (actual path: /backing/file)\n")
-
-        self.mox.StubOutWithMock(os.path, "exists")
-        os.path.exists('/test/disk.local').AndReturn(True)
-
-        self.mox.StubOutWithMock(utils, "execute")
-        utils.execute('env', 'LC_ALL=C', 'LANG=C', 'qemu-img', 'info',
-                      '/test/disk.local').AndReturn((ret, ''))
-
         self.mox.ReplayAll()
         conn = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
         info = conn.get_instance_disk_info(instance_ref['name'])
@@ -2579,6 +2570,78 @@ class LibvirtConnTestCase(test.TestCase):
 
         db.instance_destroy(self.context, instance_ref['uuid'])
 
+    def test_prefetch_images(self):
+        sizes = {'1': 600, '2': 600, '3': 300}
+        fetched = []
+
+        class FakeImageService(object):
+            def show(self, context, image_id):
+                return {'id': image_id, 'size': sizes[image_id]}
+
+        def fake_fetch_image(context, target, image_id, user_id, project_id):
+            fetched.append(image_id)
+            with open(target, 'w') as f:
+                f.write('x' * sizes[image_id])
+
+        self.stubs.Set(glance, 'get_remote_image_service',
+                       lambda context, image_href: (FakeImageService(),
+                                                    image_href))
+        self.stubs.Set(fake_libvirt_utils, 'fetch_image', fake_fetch_image)
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir)
+            conn = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+
+            # The second image does not fit in what the first leaves over
+            conn.prefetch_images(self.context, ['1', '2', '3'], 1000)
+            self.assertEqual(fetched, ['1', '3'])
+            self.assertEqual(conn.image_cache_manager.prefetched_images,
+                             set(['1', '3']))
+
+            # Images already in _base are not fetched again
+            conn.prefetch_images(self.context, ['3'], 1000)
+            self.assertEqual(fetched, ['1', '3'])
+            self.assertEqual(conn.image_cache_manager.prefetched_images,
+                             set(['3']))
+
+    def test_prefetch_images_grown_past_budget(self):
+        # The first image is qcow2 in glance and grows when made raw
+        glance_sizes = {'1': 300, '2': 300}
+        sizes = {'1': 2000, '2': 300}
+        fetched = []
+
+        class FakeImageService(object):
+            def show(self, context, image_id):
+                return {'id': image_id, 'size': glance_sizes[image_id]}
+
+        def fake_fetch_image(context, target, image_id, user_id, project_id):
+            fetched.append(image_id)
+            with open(target, 'w') as f:
+                f.write('x' * sizes[image_id])
+
+        self.stubs.Set(glance, 'get_remote_image_service',
+                       lambda context, image_href: (FakeImageService(),
+                                                    image_href))
+        self.stubs.Set(fake_libvirt_utils, 'fetch_image', fake_fetch_image)
+        with utils.tempdir() as tmpdir:
+            self.flags(instances_path=tmpdir)
+            conn = libvirt_driver.LibvirtDriver(fake.FakeVirtAPI(), False)
+
+            conn.prefetch_images(self.context, ['1', '2'], 1000)
+            self.assertEqual(fetched, ['1', '2'])
+            self.assertEqual(conn.image_cache_manager.prefetched_images,
+                             set(['2']))
+            base_dir = os.path.join(tmpdir, CONF.base_dir_name)
+            self.assertEqual(
+                    [imagecache.get_cache_fname({'image_id': '2'},
+                                                'image_id')],
+                    imagecache.list_cached_images(base_dir))
+            self.assertEqual([], os.listdir(os.path.join(base_dir,
+                                                         'prefetch')))
+
+            # The image that didn't fit is not fetched again
+            conn.prefetch_images(self.context, ['1', '2'], 1000)
+            self.assertEqual(fetched, ['1', '2'])
+
     def test_spawn_with_network_info(self):
         # Preparing mocks
         def fake_none(*args, **kwargs):
@@ -4195,6 +4258,158 @@ class IptablesFirewallTestCase(test.TestCase):
         self.fw.instances[instance_ref['id']] = instance_ref
         self.fw.do_refresh_security_group_rules("fake")
 
+    def _add_tracked_instances(self):
+        for instance_id, groups, grantees in ((1, [1], []), (2, [2], [1]),
+                                              (3, [1, 3], [3])):
+            self.fw.instances[instance_id] = {'id': instance_id}
+            self.fw.instance_security_groups[instance_id] = set(groups)
+            self.fw.instance_grantee_groups[instance_id] = set(grantees)
+
+    def test_do_refresh_security_group_rules_affected_instances(self):
+        self._add_tracked_instances()
+        refreshed = []
+        self.stubs.Set(self.fw, '_do_refresh_instances',
+                       lambda instances: refreshed.append(
+                           sorted(i['id'] for i in instances)))
+        self.fw.do_refresh_security_group_rules(1)
+        self.fw.do_refresh_security_group_rules(3)
+        # Nobody is known to be in group 4, so all instances are refreshed
+        self.fw.do_refresh_security_group_rules(4)
+        self.assertEqual([[1, 3], [3], [1, 2, 3]], refreshed)
+
+    def test_do_refresh_security_group_members_affected_instances(self):
+        self._add_tracked_instances()
+        refreshed = []
+        self.stubs.Set(self.fw, '_do_refresh_instances',
+                       lambda instances: refreshed.append(
+                           sorted(i['id'] for i in instances)))
+        self.fw.do_refresh_security_group_members(set([1]))
+        self.fw.do_refresh_security_group_members(set([1, 3]))
+        self.fw.do_refresh_security_group_members(set([2]))
+        self.assertEqual([[2], [2, 3], []], refreshed)
+
+    def test_refresh_security_group_members_coalesced(self):
+        refreshed = []
+        applies = []
+
+        def fake_do_refresh(security_groups):
+            refreshed.append(sorted(security_groups))
+            if len(refreshed) == 1:
+                # Casts received while the first refresh is running
+                self.fw.refresh_security_group_members(2)
+                self.fw.refresh_security_group_members(3)
+
+        self.stubs.Set(self.fw, 'do_refresh_security_group_members',
+                       fake_do_refresh)
+        self.stubs.Set(self.fw.iptables, 'apply',
+                       lambda: applies.append(True))
+        self.fw.refresh_security_group_members(1)
+        self.assertEqual([[1], [2, 3]], refreshed)
+        self.assertEqual(2, len(applies))
+        self.assertFalse(self.fw._refreshing_members)
+
+    def _stub_ipset_security_groups(self, grantee_group):
+        rule = {'cidr': None, 'protocol': 'tcp', 'from_port': 22,
+                'to_port': 22, 'grantee_group': grantee_group}
+        self.stubs.Set(self.fw._virtapi, 'security_group_get_by_instance',
+                       lambda ctxt, instance: [{'id': 1}])
+        self.stubs.Set(self.fw._virtapi,
+                       'security_group_rule_get_by_security_group',
+                       lambda ctxt, security_group: [rule])
+        self.stubs.Set(self.fw, '_get_member_ips',
+                       lambda ctxt, security_group, cache: [
+                           (4, '10.0.0.%d' % i)
+                           for i in security_group['instances']])
+        ipset_executes = []
+        self.stubs.Set(self.fw.ipset, 'execute',
+                       lambda *cmd, **kwargs: ipset_executes.append(
+                           (cmd, kwargs.get('process_input'))))
+        return ipset_executes
+
+    def test_instance_rules_ipset(self):
+        self.flags(firewall_use_ipset=True, use_ipv6=False)
+        ipset_executes = self._stub_ipset_security_groups(
+                {'id': 2, 'instances': [1, 2]})
+        network_info = _fake_network_info(self.stubs, 1)
+        instance = {'id': 7, 'uuid': 'fake-uuid-7'}
+        ipv4_rules, ipv6_rules = self.fw.instance_rules(instance,
+                                                        network_info)
+        self.assertTrue('-j ACCEPT -p tcp --dport 22 '
+                        '-m set --match-set nova-sg2-v4 src' in ipv4_rules)
+        self.assertFalse([rule for rule in ipv4_rules if '10.0.0.' in rule])
+        self.assertEqual([(('ipset', '-exist', 'restore'),
+                           'create nova-sg2-v4 hash:ip family inet\n'
+                           'flush nova-sg2-v4\n'
+                           'add nova-sg2-v4 10.0.0.1\n'
+                           'add nova-sg2-v4 10.0.0.2\n')], ipset_executes)
+
+    def test_refresh_security_group_members_ipset(self):
+        self.flags(firewall_use_ipset=True, use_ipv6=False)
+        grantee_group = {'id': 2, 'instances': [1]}
+        ipset_executes = self._stub_ipset_security_groups(grantee_group)
+        network_info = _fake_network_info(self.stubs, 1)
+        instance = {'id': 7, 'uuid': 'fake-uuid-7'}
+        self.fw.instances[7] = instance
+        self.fw.network_infos[7] = network_info
+        self.fw.instance_rules(instance, network_info)
+        del ipset_executes[:]
+
+        def fail(*args, **kwargs):
+            self.fail('Chains should not be rewritten')
+
+        self.stubs.Set(self.fw, '_inner_do_refresh_rules', fail)
+        self.stubs.Set(self.fw.iptables, 'apply', fail)
+        grantee_group['instances'] = [1, 3]
+        self.fw.refresh_security_group_members(2)
+        self.assertEqual([(('ipset', '-exist', 'restore'),
+                           'add nova-sg2-v4 10.0.0.3\n')], ipset_executes)
+
+    def test_refresh_security_group_members_ipset_two_parents(self):
+        self.flags(firewall_use_ipset=True, use_ipv6=False)
+        grantee_group = {'id': 2, 'instances': [1]}
+        ipset_executes = self._stub_ipset_security_groups(grantee_group)
+        rule = {'cidr': None, 'protocol': 'tcp', 'from_port': 22,
+                'to_port': 22, 'grantee_group': grantee_group}
+        # Groups 1 and 5 both grant group 2 access
+        instance_groups = {7: [{'id': 1}], 8: [{'id': 5}]}
+        group_rules = {1: [rule], 5: [rule]}
+        self.stubs.Set(self.fw._virtapi, 'security_group_get_by_instance',
+                       lambda ctxt, instance: instance_groups[instance['id']])
+        self.stubs.Set(self.fw._virtapi,
+                       'security_group_rule_get_by_security_group',
+                       lambda ctxt, security_group: group_rules[
+                           security_group['id']])
+        network_info = _fake_network_info(self.stubs, 1)
+        for instance_id in (7, 8):
+            self.fw.instance_rules({'id': instance_id,
+                                    'uuid': 'fake-uuid-%d' % instance_id},
+                                   network_info)
+        del ipset_executes[:]
+
+        # Group 5 drops its grant, group 1 still grants access
+        group_rules[5] = []
+        grantee_group['instances'] = [1, 3]
+        self.fw.refresh_security_group_members(2)
+        self.assertEqual([(('ipset', '-exist', 'restore'),
+                           'add nova-sg2-v4 10.0.0.3\n')], ipset_executes)
+
+    def test_member_ips_fetched_once_per_refresh(self):
+        nw_info = _fake_network_info(self.stubs, 1, spectacular=True)
+        calls = []
+
+        def fake_get_nw_info(_self, ctxt, instance, conductor_api=None):
+            calls.append(instance)
+            return nw_info
+
+        _fake_stub_out_get_nw_info(self.stubs, fake_get_nw_info)
+        group = {'id': 5, 'instances': ['a', 'b']}
+        cache = {}
+        ips = self.fw._get_member_ips(self.context, group, cache)
+        self.assertEqual(ips, self.fw._get_member_ips(self.context, group,
+                                                      cache))
+        self.assertEqual(['a', 'b'], calls)
+        self.assertEqual(2 * len(nw_info.fixed_ips()), len(ips))
+
     def test_unfilter_instance_undefines_nwfilter(self):
         admin_ctxt = context.get_admin_context()
 
@@ -4701,7 +4916,8 @@ disk size: 4.4M''', ''))
         image_id = '4'
         user_id = 'fake'
         project_id = 'fake'
-        images.fetch_to_raw(context, image_id, target, user_id, project_id)
+        images.fetch_to_raw(context, image_id, target, user_id, project_id,
+                            fetch_func=None)
 
         self.mox.ReplayAll()
         libvirt_utils.fetch_image(context, target, image_id,
@@ -4803,6 +5019,118 @@ disk size: 4.4M''', ''))
         out = libvirt_utils.get_disk_backing_file('')
         self.assertEqual(out, 'c')
 
+    def _stub_image_checksum(self, checksum, disk_format='raw', size=None):
+        class FakeImageService(object):
+            def show(self, context, image_id):
+                return {'id': image_id, 'checksum': checksum,
+                        'disk_format': disk_format, 'size': size}
+
+        self.stubs.Set(glance, 'get_remote_image_service',
+                       lambda context, image_href: (FakeImageService(),
+                                                    image_href))
+
+    def test_fetch_image_from_peers(self):
+        self._stub_image_checksum(hashlib.md5('good data').hexdigest())
+        with utils.tempdir() as tmpdir:
+            peers = []
+            for peer, data in (('bad', 'bad data'), ('good', 'good data')):
+                peer_dir = os.path.join(tmpdir, peer)
+                os.mkdir(peer_dir)
+                with open(os.path.join(peer_dir, 'base'), 'w') as f:
+                    f.write(data)
+                peers.append('file://%s' % peer_dir)
+            peers.append('file://%s/missing/' % tmpdir)
+            self.flags(libvirt_image_peer_urls=peers)
+
+            path = os.path.join(tmpdir, 'base.part')
+            self.assertTrue(libvirt_utils._fetch_image_from_peers(
+                    'opaque context', '4', 'base', path))
+            with open(path) as f:
+                self.assertEqual(f.read(), 'good data')
+
+            self.flags(libvirt_image_peer_urls=peers[:1] + peers[2:])
+            self.assertFalse(libvirt_utils._fetch_image_from_peers(
+                    'opaque context', '4', 'base', path))
+            self.assertFalse(os.path.exists(path))
+
+    def _peer_with_image(self, tmpdir, data):
+        with open(os.path.join(tmpdir, 'base'), 'w') as f:
+            f.write(data)
+        self.flags(libvirt_image_peer_urls=['file://%s' % tmpdir])
+        return os.path.join(tmpdir, 'base.part')
+
+    def test_fetch_image_from_peers_skips_converted_images(self):
+        self._stub_image_checksum(hashlib.md5('good data').hexdigest(),
+                                  disk_format='qcow2')
+        with utils.tempdir() as tmpdir:
+            path = self._peer_with_image(tmpdir, 'good data')
+            # Peers hold the raw conversion of the image, so they are not
+            # asked for it
+            self.flags(force_raw_images=True)
+            self.assertFalse(libvirt_utils._fetch_image_from_peers(
+                    'opaque context', '4', 'base', path))
+            self.assertFalse(os.path.exists(path))
+
+            self.flags(force_raw_images=False)
+            self.assertTrue(libvirt_utils._fetch_image_from_peers(
+                    'opaque context', '4', 'base', path))
+
+    def test_fetch_image_from_peers_checks_size(self):
+        self._stub_image_checksum(hashlib.md5('good data').hexdigest(),
+                                  size=100)
+        with utils.tempdir() as tmpdir:
+            path = self._peer_with_image(tmpdir, 'good data')
+            self.assertFalse(libvirt_utils._fetch_image_from_peers(
+                    'opaque context', '4', 'base', path))
+            self.assertFalse(os.path.exists(path))
+
+    def test_fetch_image_from_peers_http_error(self):
+        self._stub_image_checksum(hashlib.md5('good data').hexdigest())
+
+        def fake_urlopen(url, timeout):
+            raise httplib.BadStatusLine('')
+
+        self.stubs.Set(urllib2, 'urlopen', fake_urlopen)
+        with utils.tempdir() as tmpdir:
+            path = self._peer_with_image(tmpdir, 'good data')
+            self.assertFalse(libvirt_utils._fetch_image_from_peers(
+                    'opaque context', '4', 'base', path))
+            self.assertFalse(os.path.exists(path))
+
+    def test_fetch_image_falls_back_to_glance(self):
+        self._stub_image_checksum(hashlib.md5('good data').hexdigest())
+        fetched = []
+
+        def fake_fetch(context, image_href, path, user_id, project_id):
+            fetched.append(path)
+            with open(path, 'w') as f:
+                f.write('good data')
+
+        def fake_qemu_img_info(path):
+            class FakeImgInfo(object):
+                file_format = 'raw'
+                backing_file = None
+
+            return FakeImgInfo()
+
+        self.stubs.Set(images, 'fetch', fake_fetch)
+        self.stubs.Set(images, 'qemu_img_info', fake_qemu_img_info)
+        with utils.tempdir() as tmpdir:
+            self.flags(libvirt_image_peer_urls=['file://%s' % tmpdir])
+            target = os.path.join(tmpdir, 'base')
+            libvirt_utils.fetch_image('opaque context', target, '4',
+                                      'fake', 'fake')
+            self.assertEqual(fetched, ['%s.part' % target])
+
+            # The next host finds the image on its peer
+            target = os.path.join(tmpdir, 'other', 'base')
+            os.mkdir(os.path.dirname(target))
+            libvirt_utils.fetch_image('opaque context', target, '4',
+                                      'fake', 'fake')
+            self.assertEqual(len(fetched), 1)
+            with open(target) as f:
+                self.assertEqual(f.read(), 'good data')
+
 
 class LibvirtDriverTestCase(test.TestCase):
     """Test for nova.virt.libvirt.libvirt_driver.LibvirtDriver."""
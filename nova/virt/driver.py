@@ -857,6 +857,29 @@ class ComputeDriver(object):
         """
         pass
 
+    def prefetch_images(self, context, image_ids, max_bytes):
+        """
+        Fetch images into the driver's local image cache ahead of use.
+
+        :param image_ids: images to fetch, the most wanted first
+        :param max_bytes: how much space the pre-fetched images may use;
+            images that would not fit are skipped
+
+        Drivers which cache images should also keep these images when
+        managing the cache, even though no instance uses them.
+        """
+        pass
+
+    def get_cached_images(self):
+        """
+        Return the images in the driver's local image cache, identified by
+        nova.compute.cached_images.fingerprint() of their ids.
+
+        The resource tracker reports them so that the scheduler can prefer
+        hosts which already hold the image of a new instance.
+        """
+        return []
+
     def add_to_aggregate(self, context, aggregate, host, **kwargs):
         """Add a compute host to an aggregate."""
         #NOTE(jogo) Currently only used for XenAPI-Pool
@@ -38,6 +38,11 @@ firewall_opts = [
     cfg.BoolOpt('allow_same_net_traffic',
                 default=True,
                 help='Whether to allow network traffic from same network'),
+    cfg.BoolOpt('firewall_use_ipset',
+                default=False,
+                help='Whether the iptables firewall matches the members of '
+                     'a security group through an ipset instead of a rule '
+                     'per member'),
 ]
 
 CONF = cfg.CONF
@@ -154,6 +159,21 @@ class IptablesFirewallDriver(FirewallDriver):
         self.network_infos = {}
         self.basically_filtered = False
 
+        # The security groups of each filtered instance, and the groups
+        # granted access by their rules, as of the last instance_rules
+        self.instance_security_groups = {}
+        self.instance_grantee_groups = {}
+        # Member ips of each grantee group, shared by the instances
+        # refreshed together
+        self._member_ips = None
+        # Groups whose members changed while a refresh was running
+        self._pending_member_refreshes = set()
+        self._refreshing_members = False
+        # The groups whose rules grant access to each member ipset's
+        # group, by id
+        self.ipset = linux_net.IpsetManager()
+        self._member_ipset_parents = {}
+
         # Flags for DHCP request rule
         self.dhcp_create = False
         self.dhcp_created = False
@@ -183,8 +203,11 @@ class IptablesFirewallDriver(FirewallDriver):
         if self.instances.pop(instance['id'], None):
             # NOTE(vish): use the passed info instead of the stored info
             self.network_infos.pop(instance['id'])
+            self.instance_security_groups.pop(instance['id'], None)
+            self.instance_grantee_groups.pop(instance['id'], None)
             self.remove_filters_for_instance(instance)
             self.iptables.apply()
+            self._destroy_unused_member_ipsets()
         else:
             LOG.info(_('Attempted to unfilter instance which is not '
                      'filtered'), instance=instance)
@@ -346,6 +369,95 @@ class IptablesFirewallDriver(FirewallDriver):
                     '--dports', '%s:%s' % (rule['from_port'],
                                            rule['to_port'])]
 
+    def _get_member_ips(self, ctxt, security_group, member_ips_cache):
+        """Return (version, address) of the fixed ips of the members of
+        the security group.
+        """
+        if security_group['id'] in member_ips_cache:
+            return member_ips_cache[security_group['id']]
+
+        # FIXME(jkoelker) This needs to be ported up into
+        #                 the compute manager which already
+        #                 has access to a nw_api handle,
+        #                 and should be the only one making
+        #                 making rpc calls.
+        nw_api = network.API()
+        capi = conductor.API()
+        member_ips = []
+        for member in security_group['instances']:
+            nw_info = nw_api.get_instance_nw_info(ctxt, member,
+                                                  conductor_api=capi)
+            member_ips += [(ip['version'], ip['address'])
+                           for ip in nw_info.fixed_ips()]
+
+        member_ips_cache[security_group['id']] = member_ips
+        return member_ips
+
+    @staticmethod
+    def _member_ipset_name(security_group_id, version):
+        return 'nova-sg%s-v%d' % (security_group_id, version)
+
+    def _update_member_ipset(self, ctxt, parent_group, security_group,
+                             version, member_ips_cache):
+        """Make the ipset of the security group hold the ips of its
+        members and return its name.
+        """
+        ips = [address for (ip_version, address) in
+               self._get_member_ips(ctxt, security_group, member_ips_cache)
+               if ip_version == version]
+        name = self._member_ipset_name(security_group['id'], version)
+        family = 'inet' if version == 4 else 'inet6'
+        self.ipset.set_members(name, family, ips)
+        parent_groups = self._member_ipset_parents.setdefault(
+            security_group['id'], {})
+        parent_groups[parent_group['id']] = parent_group
+        return name
+
+    def _get_granted_group(self, ctxt, parent_group, security_group_id):
+        """Return the security group with the id as granted access by a
+        rule of parent_group, or None if no rule grants it access.
+        """
+        rules = self._virtapi.security_group_rule_get_by_security_group(
+            ctxt, parent_group)
+        for rule in rules:
+            if (rule['grantee_group'] and
+                    rule['grantee_group']['id'] == security_group_id):
+                return rule['grantee_group']
+
+    def _refresh_member_ipsets(self, security_groups):
+        """Update the member ipsets of the security groups from the rules
+        granting them access.
+        """
+        ctxt = context.get_admin_context()
+        member_ips_cache = {}
+        for security_group_id in security_groups:
+            parent_groups = self._member_ipset_parents.get(security_group_id,
+                                                           {})
+            for parent_group_id, parent_group in parent_groups.items():
+                security_group = self._get_granted_group(ctxt, parent_group,
+                                                         security_group_id)
+                if security_group is not None:
+                    self._update_member_ipset(ctxt, parent_group,
+                                              security_group, 4,
+                                              member_ips_cache)
+                    break
+                # The grant is gone, other groups may still have one
+                del parent_groups[parent_group_id]
+
+    def _destroy_unused_member_ipsets(self):
+        """Destroy the member ipsets no instance rule refers to anymore.
+
+        Only call this once the rules have been applied.
+        """
+        granted_groups = set()
+        for grantee_groups in self.instance_grantee_groups.itervalues():
+            granted_groups |= grantee_groups
+        for security_group_id in self._member_ipset_parents.keys():
+            if security_group_id not in granted_groups:
+                del self._member_ipset_parents[security_group_id]
+                self.ipset.destroy(self._member_ipset_name(security_group_id,
+                                                           4))
+
     def instance_rules(self, instance, network_info):
         # make sure this is legacy nw_info
         network_info = self._handle_network_info_model(network_info)
@@ -373,6 +485,13 @@ class IptablesFirewallDriver(FirewallDriver):
 
         security_groups = self._virtapi.security_group_get_by_instance(
             ctxt, instance)
+        self.instance_security_groups[instance['id']] = set(
+                security_group['id'] for security_group in security_groups)
+        grantee_groups = set()
+        self.instance_grantee_groups[instance['id']] = grantee_groups
+        member_ips_cache = self._member_ips
+        if member_ips_cache is None:
+            member_ips_cache = {}
 
         # then, security group chains and rules
         for security_group in security_groups:
@@ -415,27 +534,25 @@ class IptablesFirewallDriver(FirewallDriver):
                     fw_rules += [' '.join(args)]
                 else:
                     if rule['grantee_group']:
-                        # FIXME(jkoelker) This needs to be ported up into
-                        #                 the compute manager which already
-                        #                 has access to a nw_api handle,
-                        #                 and should be the only one making
-                        #                 making rpc calls.
-                        nw_api = network.API()
-                        capi = conductor.API()
-                        for instance in rule['grantee_group']['instances']:
-                            nw_info = nw_api.get_instance_nw_info(
-                                ctxt,
-                                instance,
-                                conductor_api=capi)
-
-                            ips = [ip['address']
-                                for ip in nw_info.fixed_ips()
-                                    if ip['version'] == version]
-
-                            LOG.debug('ips: %r', ips, instance=instance)
-                            for ip in ips:
-                                subrule = args + ['-s %s' % ip]
-                                fw_rules += [' '.join(subrule)]
+                        grantee_groups.add(rule['grantee_group']['id'])
+                    if rule['grantee_group'] and CONF.firewall_use_ipset:
+                        # One rule matching the ipset of the members
+                        name = self._update_member_ipset(
+                            ctxt, security_group, rule['grantee_group'],
+                            version, member_ips_cache)
+                        args += ['-m set --match-set %s src' % name]
+                        fw_rules += [' '.join(args)]
+                    elif rule['grantee_group']:
+                        ips = [address for (ip_version, address) in
+                               self._get_member_ips(ctxt,
+                                                    rule['grantee_group'],
+                                                    member_ips_cache)
+                               if ip_version == version]
+
+                        LOG.debug('ips: %r', ips, instance=instance)
+                        for ip in ips:
+                            subrule = args + ['-s %s' % ip]
+                            fw_rules += [' '.join(subrule)]
 
                 LOG.debug('Using fw_rules: %r', fw_rules, instance=instance)
 
@@ -448,12 +565,29 @@ class IptablesFirewallDriver(FirewallDriver):
         pass
 
     def refresh_security_group_members(self, security_group):
-        self.do_refresh_security_group_rules(security_group)
-        self.iptables.apply()
+        # Refreshes requested while one is running are picked up by it,
+        # so a burst of membership changes is applied together.
+        self._pending_member_refreshes.add(security_group)
+        if self._refreshing_members:
+            return
+        self._refreshing_members = True
+        try:
+            while self._pending_member_refreshes:
+                security_groups = self._pending_member_refreshes
+                self._pending_member_refreshes = set()
+                if CONF.firewall_use_ipset:
+                    # The rules match the members through the ipsets
+                    self._refresh_member_ipsets(security_groups)
+                    continue
+                self.do_refresh_security_group_members(security_groups)
+                self.iptables.apply()
+        finally:
+            self._refreshing_members = False
 
     def refresh_security_group_rules(self, security_group):
         self.do_refresh_security_group_rules(security_group)
         self.iptables.apply()
+        self._destroy_unused_member_ipsets()
 
     def refresh_instance_security_rules(self, instance):
         self.do_refresh_instance_rules(instance)
@@ -465,12 +599,43 @@ class IptablesFirewallDriver(FirewallDriver):
         self.remove_filters_for_instance(instance)
         self.add_filters_for_instance(instance, ipv4_rules, ipv6_rules)
 
+    def _do_refresh_instances(self, instances):
+        self._member_ips = {}
+        try:
+            for instance in instances:
+                network_info = self.network_infos[instance['id']]
+                ipv4_rules, ipv6_rules = self.instance_rules(instance,
+                                                             network_info)
+                self._inner_do_refresh_rules(instance, ipv4_rules,
+                                             ipv6_rules)
+        finally:
+            self._member_ips = None
+
+    def _instances_by_security_groups(self, instance_groups,
+                                      security_groups):
+        """Return the instances whose groups in instance_groups include
+        one of security_groups, and those whose groups are not known.
+        """
+        return [instance for instance in self.instances.values()
+                if (instance['id'] not in instance_groups or
+                    instance_groups[instance['id']] & security_groups)]
+
     def do_refresh_security_group_rules(self, security_group):
-        for instance in self.instances.values():
-            network_info = self.network_infos[instance['id']]
-            ipv4_rules, ipv6_rules = self.instance_rules(instance,
-                                                         network_info)
-            self._inner_do_refresh_rules(instance, ipv4_rules, ipv6_rules)
+        instances = self._instances_by_security_groups(
+                self.instance_security_groups, set([security_group]))
+        if not any(security_group in groups for groups in
+                   self.instance_security_groups.itervalues()):
+            # No instance is known to be in the group, keep refreshing
+            # all of them as before
+            instances = self.instances.values()
+        self._do_refresh_instances(instances)
+
+    def do_refresh_security_group_members(self, security_groups):
+        """Refresh the instances granting access to any of the security
+        groups.
+        """
+        self._do_refresh_instances(self._instances_by_security_groups(
+                self.instance_grantee_groups, security_groups))
 
     def do_refresh_instance_rules(self, instance):
         network_info = self.network_infos[instance['id']]
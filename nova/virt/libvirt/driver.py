@@ -332,6 +332,8 @@ class LibvirtDriver(driver.ComputeDriver):
 
         self._disk_cachemode = None
         self.image_cache_manager = imagecache.ImageCacheManager()
+        # Size in _base of the images pre-fetched, by cache file name
+        self._prefetch_sizes = {}
         self.image_backend = imagebackend.Backend(CONF.use_cow_images)
 
         self.disk_cachemodes = {}
@@ -3489,7 +3491,7 @@ class LibvirtDriver(driver.ComputeDriver):
             disk_type = driver_nodes[cnt].get('type')
             if disk_type == "qcow2":
                 backing_file = libvirt_utils.get_disk_backing_file(path)
-                virt_size = disk.get_disk_size(path)
+                virt_size = libvirt_utils.get_disk_size(path)
                 over_commit_size = int(virt_size) - dk_size
             else:
                 backing_file = ""
@@ -3552,6 +3554,83 @@ class LibvirtDriver(driver.ComputeDriver):
         """Manage the local cache of images."""
         self.image_cache_manager.verify_base_images(context, all_instances)
 
+    def prefetch_images(self, context, image_ids, max_bytes):
+        """Fetch images into _base, keeping within max_bytes.
+
+        Images are fetched into a staging directory first, as converting
+        them to raw can make them much larger than their size in glance,
+        and only moved into _base if they still fit.
+        """
+        base_dir = os.path.join(CONF.instances_path, CONF.base_dir_name)
+        if not os.path.exists(base_dir):
+            fileutils.ensure_tree(base_dir)
+        staging_dir = os.path.join(base_dir, 'prefetch')
+        lock_path = os.path.join(CONF.instances_path, 'locks')
+
+        prefetched = set()
+        used_bytes = 0
+        for image_id in image_ids:
+            fname = imagecache.get_cache_fname({'image_id': image_id},
+                                               'image_id')
+            base = os.path.join(base_dir, fname)
+
+            if not os.path.exists(base):
+                try:
+                    (image_service, image_id) = \
+                            glance.get_remote_image_service(context, image_id)
+                    image_size = image_service.show(context,
+                                                    image_id).get('size')
+                except exception.NovaException:
+                    LOG.exception(_('Failed to look up image %s for '
+                                    'pre-fetching'), image_id)
+                    continue
+                # Images which didn't fit before are skipped by their size
+                # in _base rather than fetched again
+                image_size = max(image_size or 0,
+                                 self._prefetch_sizes.get(fname, 0))
+                if used_bytes + image_size > max_bytes:
+                    LOG.debug(_('Not pre-fetching image %s, it does not fit '
+                                'in the pre-fetch budget'), image_id)
+                    continue
+
+                @utils.synchronized(fname, external=True, lock_path=lock_path)
+                def fetch_if_not_exists():
+                    if os.path.exists(base):
+                        return True
+                    LOG.info(_('Pre-fetching image %s'), image_id)
+                    fileutils.ensure_tree(staging_dir)
+                    staged = os.path.join(staging_dir, fname)
+                    with utils.remove_path_on_error(staged):
+                        libvirt_utils.fetch_image(context, staged, image_id,
+                                                  context.user_id,
+                                                  context.project_id)
+                    self._prefetch_sizes[fname] = os.path.getsize(staged)
+                    if used_bytes + self._prefetch_sizes[fname] > max_bytes:
+                        os.unlink(staged)
+                        return False
+                    os.rename(staged, base)
+                    return True
+
+                try:
+                    if not fetch_if_not_exists():
+                        LOG.info(_('Not keeping pre-fetched image %s, it '
+                                   'does not fit in the pre-fetch budget'),
+                                 image_id)
+                        continue
+                except Exception:
+                    LOG.exception(_('Failed to pre-fetch image %s'), image_id)
+                    continue
+
+            used_bytes += os.path.getsize(base)
+            prefetched.add(str(image_id))
+
+        self.image_cache_manager.prefetched_images = prefetched
+
+    def get_cached_images(self):
+        """Return the fingerprints of the images in _base."""
+        base_dir = os.path.join(CONF.instances_path, CONF.base_dir_name)
+        return imagecache.list_cached_images(base_dir)
+
     def _cleanup_remote_migration(self, dest, inst_base, inst_base_resize,
                                   shared_storage=False):
         """Used only for cleanup in case migrate_disk_and_power_off fails."""
@@ -236,9 +236,23 @@ def write_stored_checksum(target):
     write_stored_info(target, field='sha1', value=checksum)
 
 
+def list_cached_images(base_dir):
+    """Return the fingerprints of the original images in a base directory.
+
+    These are the SHA1 hex digests of the image ids, see get_cache_fname().
+    """
+    if not os.path.isdir(base_dir):
+        return []
+    digest_size = hashlib.sha1().digestsize * 2
+    fingerprint_re = re.compile('^[0-9a-f]{%d}$' % digest_size)
+    return [ent for ent in os.listdir(base_dir) if fingerprint_re.match(ent)]
+
+
 class ImageCacheManager(object):
     def __init__(self):
         self.lock_path = os.path.join(CONF.instances_path, 'locks')
+        # Image ids pre-fetched by the driver, kept even while unused
+        self.prefetched_images = set()
         self._reset_state()
 
     def _reset_state(self):
@@ -586,6 +600,19 @@ class ImageCacheManager(object):
                 if not image_small and not image_resized:
                     self.originals.append(base_file)
 
+        # Pre-fetched images are kept although nothing uses them yet
+        for img in self.prefetched_images:
+            if img in self.used_images:
+                continue
+            base_file = os.path.join(base_dir, hashlib.sha1(img).hexdigest())
+            if base_file in self.unexplained_images:
+                LOG.debug(_('image %(id)s at (%(base_file)s): image is '
+                            'pre-fetched'),
+                          {'id': img,
+                           'base_file': base_file})
+                self.unexplained_images.remove(base_file)
+                self.active_base_files.append(base_file)
+
         # Elements remaining in unexplained_images might be in use
         inuse_backing_images = self._list_backing_images()
         for backing_path in inuse_backing_images:
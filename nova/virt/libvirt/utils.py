@@ -21,11 +21,17 @@
 #    under the License.
 
 import errno
+import hashlib
+import httplib
 import os
+import random
+import struct
+import urllib2
 
 from lxml import etree
 from oslo.config import cfg
 
+from nova.image import glance
 from nova.openstack.common import log as logging
 from nova.openstack.common import processutils
 from nova import utils
@@ -36,10 +42,26 @@ libvirt_opts = [
                 default=False,
                 help='Compress snapshot images when possible. This '
                      'currently applies exclusively to qcow2 images'),
+    cfg.ListOpt('libvirt_image_peer_urls',
+                default=[],
+                help='URLs under which peer compute hosts serve the '
+                     'contents of their image cache directory, for example '
+                     'http://compute2:8080/_base/. A base image whose '
+                     'checksum matches the one in glance is copied from a '
+                     'peer before glance is asked for it. Only images kept '
+                     'in their original format, raw images or all images '
+                     'with force_raw_images=False, can be shared this way. '
+                     'Copies are only verified with the MD5 checksum '
+                     'glance keeps, so only list trusted hosts'),
+    cfg.IntOpt('libvirt_image_peer_timeout',
+               default=10,
+               help='Seconds to wait for a peer compute host serving '
+                    'base images before trying the next one'),
     ]
 
 CONF = cfg.CONF
 CONF.register_opts(libvirt_opts)
+CONF.import_opt('force_raw_images', 'nova.virt.images')
 CONF.import_opt('instances_path', 'nova.compute.manager')
 LOG = logging.getLogger(__name__)
 
@@ -386,6 +408,50 @@ def pick_disk_driver_name(is_block_dev=False):
         return None
 
 
+# magic, version, backing_file_offset, backing_file_size, cluster_bits,
+# virtual size
+_QCOW2_HEADER = struct.Struct('>4sIQIIQ')
+_QCOW2_MAGIC = 'QFI\xfb'
+_QCOW2_MAX_BACKING_FILE_SIZE = 1023
+
+
+def _read_qcow2_header(path):
+    """Read the backing file and virtual size from a qcow2 header
+
+    This saves forking qemu-img for the common case of a local qcow2
+    disk. ValueError is raised for anything this does not understand,
+    in which case the caller should ask qemu-img instead.
+
+    :param path: Path to the disk image
+    :returns: a (backing_file, virtual_size) tuple, the backing file
+              being None if the image has none.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(_QCOW2_HEADER.size)
+        if len(header) != _QCOW2_HEADER.size:
+            raise ValueError(_('%s is too short to be qcow2') % path)
+        (magic, version, backing_offset, backing_size,
+         _cluster_bits, virtual_size) = _QCOW2_HEADER.unpack(header)
+        if magic != _QCOW2_MAGIC or version not in (2, 3):
+            raise ValueError(_('%s is not a qcow2 image') % path)
+        if not backing_offset:
+            return None, virtual_size
+        if backing_size > _QCOW2_MAX_BACKING_FILE_SIZE:
+            raise ValueError(_('%s has a corrupt backing file name') % path)
+        f.seek(backing_offset)
+        backing_file = f.read(backing_size)
+
+    if len(backing_file) != backing_size:
+        raise ValueError(_('%s has a truncated backing file name') % path)
+    if ':' in backing_file:
+        # Protocol prefixes and the like are qemu-img's business
+        raise ValueError(_('%s has a non-local backing file') % path)
+    # qemu resolves relative backing files against the image directory,
+    # which is what qemu-img reports as the "actual path"
+    backing_file = os.path.join(os.path.dirname(path), backing_file)
+    return backing_file, virtual_size
+
+
 def get_disk_size(path):
     """Get the (virtual) size of a disk image
 
@@ -393,6 +459,11 @@ def get_disk_size(path):
     :returns: Size (in bytes) of the given disk image as it would be seen
               by a virtual machine.
     """
+    try:
+        return int(_read_qcow2_header(path)[1])
+    except (IOError, OSError, ValueError):
+        pass
+
     size = images.qemu_img_info(path).virtual_size
     return int(size)
 
@@ -403,7 +474,10 @@ def get_disk_backing_file(path, basename=True):
     :param path: Path to the disk image
     :returns: a path to the image's backing store
     """
-    backing_file = images.qemu_img_info(path).backing_file
+    try:
+        backing_file = _read_qcow2_header(path)[0]
+    except (IOError, OSError, ValueError):
+        backing_file = images.qemu_img_info(path).backing_file
     if backing_file and basename:
         backing_file = os.path.basename(backing_file)
 
@@ -597,9 +671,90 @@ def get_fs_info(path):
             'used': used}
 
 
+def _fetch_url(url, path, size=None):
+    """Copy a URL to path and return the MD5 checksum of what was copied.
+
+    :raises: IOError if the URL's content length is known and is not size
+    """
+    checksum = hashlib.md5()
+    response = urllib2.urlopen(url, timeout=CONF.libvirt_image_peer_timeout)
+    try:
+        length = response.info().get('Content-Length')
+        if size is not None and length is not None and int(length) != size:
+            raise IOError(_('Content length %(length)s is not the expected '
+                            '%(size)s') % {'length': length, 'size': size})
+        with open(path, 'wb') as f:
+            while True:
+                chunk = response.read(65536)
+                if not chunk:
+                    break
+                f.write(chunk)
+                checksum.update(chunk)
+    finally:
+        response.close()
+    return checksum.hexdigest()
+
+
+def _fetch_image_from_peers(context, image_href, filename, path):
+    """Copy a base image from a peer compute host that has it.
+
+    The peers are the static libvirt_image_peer_urls list, and the copy is
+    only checked against the MD5 checksum glance keeps for the image.
+
+    :param image_href: the image being fetched
+    :param filename: name of the base image in the peers' image cache
+    :param path: where to write the image
+    :returns: True if a peer copy matching the glance checksum was written
+              to path, False otherwise.
+    """
+    (image_service, image_id) = glance.get_remote_image_service(context,
+                                                                image_href)
+    image_meta = image_service.show(context, image_id)
+    checksum = image_meta.get('checksum')
+    if not checksum:
+        return False
+    if image_meta.get('disk_format') != 'raw' and CONF.force_raw_images:
+        # Peers have converted their copy to raw, which can't match
+        return False
+
+    peer_urls = list(CONF.libvirt_image_peer_urls)
+    random.shuffle(peer_urls)
+    for peer_url in peer_urls:
+        url = '%s/%s' % (peer_url.rstrip('/'), filename)
+        try:
+            with utils.remove_path_on_error(path):
+                peer_checksum = _fetch_url(url, path,
+                                           size=image_meta.get('size'))
+        except (IOError, httplib.HTTPException) as e:
+            LOG.debug(_('Could not fetch image %(image_id)s from %(url)s: '
+                        '%(error)s'),
+                      {'image_id': image_id, 'url': url, 'error': e})
+            continue
+
+        if peer_checksum == checksum:
+            LOG.info(_('Fetched image %(image_id)s from %(url)s'),
+                     {'image_id': image_id, 'url': url})
+            return True
+        LOG.warn(_('Checksum of image %(image_id)s from %(url)s does not '
+                   'match glance, ignoring it'),
+                 {'image_id': image_id, 'url': url})
+        utils.delete_if_exists(path)
+    return False
+
+
 def fetch_image(context, target, image_id, user_id, project_id):
     """Grab image."""
-    images.fetch_to_raw(context, image_id, target, user_id, project_id)
+    fetch_func = None
+    if CONF.libvirt_image_peer_urls:
+        filename = os.path.basename(target)
+
+        def fetch_func(context, image_href, path, user_id, project_id):
+            if not _fetch_image_from_peers(context, image_href, filename,
+                                           path):
+                images.fetch(context, image_href, path, user_id, project_id)
+
+    images.fetch_to_raw(context, image_id, target, user_id, project_id,
+                        fetch_func=fetch_func)
 
 
 def get_instance_path(instance, forceold=False, relative=False):
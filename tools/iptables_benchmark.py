@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2013 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+"""Benchmark for merging nova's iptables rules into iptables-save output.
+
+Generates a filter table shaped like the one of a compute host running many
+instances, each with its own security group chain, and times
+IptablesManager._modify_rules over it.  Nothing is applied to the host.
+"""
+
+import optparse
+import os
+import sys
+import time
+
+possible_topdir = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                                os.pardir,
+                                                os.pardir))
+if os.path.exists(os.path.join(possible_topdir, 'nova', '__init__.py')):
+    sys.path.insert(0, possible_topdir)
+
+from nova.network import linux_net
+
+
+def build_table(manager, num_lines, rules_per_instance):
+    """Fill the manager's filter table with per-instance chains and return
+    the iptables-save output it would have produced on the last run.
+    """
+    binary_name = linux_net.get_binary_name()
+    table = manager.ipv4['filter']
+    num_instances = max(1, num_lines // (rules_per_instance + 2))
+
+    chains = [':INPUT ACCEPT [0:0]', ':FORWARD ACCEPT [0:0]',
+              ':OUTPUT ACCEPT [0:0]', ':nova-filter-top - [0:0]']
+    rules = ['[0:0] -A FORWARD -j nova-filter-top',
+             '[0:0] -A OUTPUT -j nova-filter-top']
+    for chain in table.chains:
+        chains.append(':%s-%s - [0:0]' % (binary_name, chain))
+
+    for instance in xrange(num_instances):
+        chain = 'inst-%d' % instance
+        table.add_chain(chain)
+        chains.append(':%s-%s - [0:0]' % (binary_name, chain))
+        for port in xrange(rules_per_instance):
+            rule = '-s 10.%d.%d.0/24 -p tcp -m tcp --dport %d -j ACCEPT' % (
+                    instance // 256, instance % 256, 1024 + port)
+            table.add_rule(chain, rule)
+            rules.append('[%d:%d] -A %s-%s %s' % (port, port * 64,
+                                                  binary_name, chain, rule))
+        forward_rule = '-d 10.%d.%d.0/24 -j ACCEPT' % (instance // 256,
+                                                       instance % 256)
+        table.add_rule('FORWARD', forward_rule, wrap=False)
+        rules.append('[0:0] -A FORWARD %s' % forward_rule)
+        # The next run drops every tenth instance
+        if instance % 10 == 0:
+            table.remove_chain(chain)
+            table.remove_rule('FORWARD', forward_rule, wrap=False)
+
+    return (['# Generated by iptables-save', '*filter'] + chains + rules +
+            ['COMMIT', '# Completed'])
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-n', '--lines', type='int', default=50000,
+                      help='approximate number of iptables-save lines')
+    parser.add_option('-r', '--rules-per-instance', type='int', default=20,
+                      help='rules in each instance chain')
+    parser.add_option('-i', '--iterations', type='int', default=3,
+                      help='number of timed runs')
+    (options, args) = parser.parse_args()
+
+    timings = []
+    for iteration in xrange(options.iterations):
+        manager = linux_net.IptablesManager()
+        current_lines = build_table(manager, options.lines,
+                                    options.rules_per_instance)
+        table = manager.ipv4['filter']
+        start = time.time()
+        new_lines = manager._modify_rules(current_lines, table, 'filter')
+        timings.append(time.time() - start)
+
+    print('%d input lines, %d output lines' % (len(current_lines),
+                                               len(new_lines)))
+    print('best %.3fs, worst %.3fs over %d runs' % (min(timings),
+                                                    max(timings),
+                                                    len(timings)))
+
+
+if __name__ == '__main__':
+    main()